@@ -0,0 +1,415 @@
+# api.py
+#
+# Headless JSON-over-HTTP ingestion service for weighbridges and field tablets.
+# Runs next to the Streamlit app against the same database:
+#
+#   python api.py --port 8600
+#
+# Endpoints
+#   POST /sacks           one delivery object, or a list of them  -> sack_id(s)
+#   POST /farmers         one farmer object, or a list of them    -> farmer_id(s)
+#   GET  /farmers         id + name of every farmer
+#   GET  /farmers/<id>    farmer profile with delivery totals
+#   GET  /sacks/<id>      who delivered the sack, and where it went
+#                         (?archive=1 includes archived bundles and invoices)
+#   GET  /sync/pull?cursor=<seq>                   farmer/warehouse delta for a device
+#   POST /sync/push  {"device_id", "deliveries"}   offline deliveries with client_ids
+#   GET  /health
+#
+# Writes from all open connections are queued and applied in grouped
+# transactions (one commit per group, not per row). Set ECOWISE_API_TOKEN to
+# require "Authorization: Bearer <token>" on every request.
+#
+# Standard library only: asyncio for the sockets, a single writer thread for
+# SQLite, and the default thread pool for reads.
+
+import os
+import json
+import math
+import asyncio
+import argparse
+import concurrent.futures
+from datetime import datetime, timezone
+from http import HTTPStatus
+
+from database import db, sync
+
+# A write group closes once it holds this many rows, or this long after its first row arrived
+WRITE_BATCH_MAX = 500
+WRITE_BATCH_WINDOW_S = 0.005
+
+MAX_BODY_BYTES = 1024 * 1024
+API_TOKEN = os.environ.get("ECOWISE_API_TOKEN")
+
+SACK_REQUIRED = ("farmer_id", "weight_kg", "value_paid", "warehouse")
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+# --- Validation ---
+
+def _parse_delivered_at(value):
+    """
+    Normalises an ISO 8601 date or datetime to SQLite's 'YYYY-MM-DD HH:MM:SS'
+    (UTC, like CURRENT_TIMESTAMP); None when absent. Anything DATE() could not
+    read would otherwise fail in the daily rollup trigger.
+    """
+    if value in (None, ""):
+        return None
+    if not isinstance(value, str):
+        raise ApiError(HTTPStatus.UNPROCESSABLE_ENTITY, "delivered_at must be an ISO 8601 date or datetime")
+    text = value.strip()
+    if text.endswith(("Z", "z")):
+        text = text[:-1] + "+00:00"
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        raise ApiError(HTTPStatus.UNPROCESSABLE_ENTITY, f"delivered_at {value!r} is not an ISO 8601 date or datetime")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _validate_sack(d):
+    if not isinstance(d, dict):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Each delivery must be a JSON object")
+    missing = [f for f in SACK_REQUIRED if d.get(f) in (None, "")]
+    if missing:
+        raise ApiError(HTTPStatus.UNPROCESSABLE_ENTITY, f"Missing fields: {', '.join(missing)}")
+    try:
+        weight, value = float(d["weight_kg"]), float(d["value_paid"])
+    except (TypeError, ValueError):
+        raise ApiError(HTTPStatus.UNPROCESSABLE_ENTITY, "weight_kg and value_paid must be numbers")
+    if not (math.isfinite(weight) and math.isfinite(value)):
+        raise ApiError(HTTPStatus.UNPROCESSABLE_ENTITY, "weight_kg and value_paid must be finite")
+    if weight <= 0 or value <= 0:
+        raise ApiError(HTTPStatus.UNPROCESSABLE_ENTITY, "weight_kg and value_paid must be positive")
+    return {
+        "farmer_id": str(d["farmer_id"]),
+        "weight_kg": weight,
+        "value_paid": value,
+        "warehouse": str(d["warehouse"]),
+        "delivered_at": _parse_delivered_at(d.get("delivered_at")),
+    }
+
+
+def _validate_offline_delivery(d):
+    row = _validate_sack(d)
+    if not d.get("client_id"):
+        raise ApiError(HTTPStatus.UNPROCESSABLE_ENTITY, "client_id is required for offline deliveries")
+    row["client_id"] = str(d["client_id"])
+    return row
+
+
+def _validate_farmer(d):
+    if not isinstance(d, dict):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Each farmer must be a JSON object")
+    if not d.get("first_name") or not d.get("last_name"):
+        raise ApiError(HTTPStatus.UNPROCESSABLE_ENTITY, "first_name and last_name are required")
+    return {f: d.get(f) for f in db.FARMER_FIELDS}
+
+
+# --- Group commit ---
+
+WRITERS = {
+    "sack": db.create_sacks_and_mint_tokens,
+    "farmer": db.create_farmers,
+}
+
+
+class WriteBatcher:
+    """
+    Collects rows submitted by concurrent requests and writes each group with
+    one call to the matching bulk db function, on a single writer thread.
+    If a group fails, its rows are retried one by one so a single bad row
+    only fails its own request.
+    """
+
+    def __init__(self, max_rows=WRITE_BATCH_MAX, window_s=WRITE_BATCH_WINDOW_S):
+        self.max_rows = max_rows
+        self.window_s = window_s
+        self.queue = asyncio.Queue()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="api-writer")
+        self.stats = {"groups": 0, "rows": 0}
+
+    async def submit(self, kind, rows):
+        """Queues rows of one kind; resolves to their new ids in order."""
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((kind, rows, fut))
+        return await fut
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.queue.get()]
+            n_rows = len(pending[0][1])
+            deadline = loop.time() + self.window_s
+            while n_rows < self.max_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                n_rows += len(item[1])
+
+            for kind in WRITERS:
+                group = [p for p in pending if p[0] == kind]
+                if group:
+                    await loop.run_in_executor(self.executor, self._apply, loop, kind, group)
+
+    def _apply(self, loop, kind, group):
+        write = WRITERS[kind]
+        rows = [row for _, request_rows, _ in group for row in request_rows]
+        try:
+            ids = write(rows)
+        except Exception:
+            # Isolate the offending request(s)
+            for _, request_rows, fut in group:
+                try:
+                    result = write(request_rows)
+                except ValueError as e:
+                    loop.call_soon_threadsafe(_set_exception, fut, ApiError(HTTPStatus.UNPROCESSABLE_ENTITY, str(e)))
+                except Exception as e:
+                    loop.call_soon_threadsafe(_set_exception, fut, e)
+                else:
+                    loop.call_soon_threadsafe(_set_result, fut, result)
+            return
+        self.stats["groups"] += 1
+        self.stats["rows"] += len(rows)
+        offset = 0
+        for _, request_rows, fut in group:
+            loop.call_soon_threadsafe(_set_result, fut, ids[offset:offset + len(request_rows)])
+            offset += len(request_rows)
+
+
+def _set_result(fut, value):
+    if not fut.done():
+        fut.set_result(value)
+
+
+def _set_exception(fut, exc):
+    if not fut.done():
+        fut.set_exception(exc)
+
+
+# --- Routes ---
+
+async def _read(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+async def _post_many(batcher, kind, body, validate, id_field):
+    many = isinstance(body, list)
+    items = body if many else [body]
+    if not items:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Empty list")
+    rows = [validate(item) for item in items]
+    ids = await batcher.submit(kind, rows)
+    if many:
+        return HTTPStatus.CREATED, {f"{id_field}s": ids}
+    return HTTPStatus.CREATED, {id_field: ids[0]}
+
+
+def _sack_details(sack_id, include_archive=False):
+    info = db.get_sack_ownership(sack_id)
+    if info is None:
+        return None
+    lineage = db.get_sack_lineage(sack_id, include_archive)
+    info["lineage"] = lineage.to_dict(orient="records")
+    return dict(info, sack_id=sack_id)
+
+
+def _query_int(query, name, default):
+    for pair in query.split("&"):
+        key, _, value = pair.partition("=")
+        if key == name:
+            try:
+                return int(value)
+            except ValueError:
+                raise ApiError(HTTPStatus.BAD_REQUEST, f"{name} must be an integer")
+    return default
+
+
+async def route(batcher, method, path, body):
+    path, _, query = path.partition("?")
+    parts = [p for p in path.split("/") if p]
+
+    if method == "GET" and parts == ["health"]:
+        return HTTPStatus.OK, {"status": "ok", "writes": batcher.stats}
+
+    if parts[:1] == ["sacks"]:
+        if method == "POST" and len(parts) == 1:
+            return await _post_many(batcher, "sack", body, _validate_sack, "sack_id")
+        if method == "GET" and len(parts) == 2:
+            info = await _read(_sack_details, parts[1], bool(_query_int(query, "archive", 0)))
+            if info is None:
+                raise ApiError(HTTPStatus.NOT_FOUND, f"No sack {parts[1]}")
+            return HTTPStatus.OK, info
+
+    if parts == ["sync", "pull"] and method == "GET":
+        delta = await _read(
+            sync.export_delta,
+            _query_int(query, "cursor", None),
+            _query_int(query, "limit", sync.SYNC_PAGE_SIZE)
+        )
+        return HTTPStatus.OK, delta
+
+    if parts == ["sync", "push"] and method == "POST":
+        if not isinstance(body, dict) or not body.get("device_id") or not isinstance(body.get("deliveries"), list):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Expected {\"device_id\": ..., \"deliveries\": [...]}")
+        # A bad row is rejected on its own, so the device can drop it rather
+        # than retry the whole upload; rows without a client_id fail the request
+        deliveries, invalid = [], {}
+        for d in body["deliveries"]:
+            try:
+                deliveries.append(_validate_offline_delivery(d))
+            except ApiError as e:
+                client_id = d.get("client_id") if isinstance(d, dict) else None
+                if not client_id:
+                    raise
+                invalid.setdefault(str(client_id), e.message)
+        # Already one bulk transaction; run it on the writer thread so it is
+        # serialised with the grouped writes
+        result = await asyncio.get_running_loop().run_in_executor(
+            batcher.executor, sync.apply_deliveries, str(body["device_id"]), deliveries
+        )
+        for client_id, reason in invalid.items():
+            if client_id not in result["applied"] and client_id not in result["duplicates"]:
+                result["rejected"].setdefault(client_id, reason)
+        return HTTPStatus.OK, result
+
+    if parts[:1] == ["farmers"]:
+        if method == "POST" and len(parts) == 1:
+            return await _post_many(batcher, "farmer", body, _validate_farmer, "farmer_id")
+        if method == "GET" and len(parts) == 1:
+            farmers = await _read(db.get_farmer_list)
+            return HTTPStatus.OK, [{"farmer_id": fid, "name": name} for fid, name in farmers]
+        if method == "GET" and len(parts) == 2:
+            profile = await _read(db.get_farmer_profile, parts[1])
+            if profile is None:
+                raise ApiError(HTTPStatus.NOT_FOUND, f"No farmer {parts[1]}")
+            return HTTPStatus.OK, dict(profile, farmer_id=parts[1])
+
+    raise ApiError(HTTPStatus.NOT_FOUND, f"No route for {method} {path}")
+
+
+# --- HTTP/1.1 plumbing ---
+
+async def _read_request(reader):
+    """Returns (method, path, headers, body bytes), or None when the client closed the connection."""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        length = -1
+    if length < 0:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Content-Length must be a non-negative integer")
+    # Errors raised here leave the body unread; handle_connection then closes
+    # the connection instead of parsing the body as the next request
+    if length > MAX_BODY_BYTES:
+        raise ApiError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path, headers, body
+
+
+def _response(status, payload, keep_alive):
+    body = json.dumps(payload, default=str).encode("utf-8")
+    head = (
+        f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        "\r\n"
+    )
+    return head.encode("latin-1") + body
+
+
+def _authorized(headers):
+    return not API_TOKEN or headers.get("authorization") == f"Bearer {API_TOKEN}"
+
+
+async def handle_connection(batcher, reader, writer):
+    try:
+        while True:
+            # Only set once the whole request, body included, has been read
+            keep_alive = False
+            try:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, raw = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                if not _authorized(headers):
+                    raise ApiError(HTTPStatus.UNAUTHORIZED, "Missing or wrong bearer token")
+                try:
+                    body = json.loads(raw) if raw else None
+                except ValueError:
+                    raise ApiError(HTTPStatus.BAD_REQUEST, "Body is not valid JSON")
+                status, payload = await route(batcher, method, path, body)
+            except ApiError as e:
+                status, payload = e.status, {"error": e.message}
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            except Exception as e:
+                status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(e).__name__}: {e}"}
+            writer.write(_response(status, payload, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    finally:
+        writer.close()
+
+
+async def serve(host="127.0.0.1", port=8600):
+    batcher = WriteBatcher()
+    writer_task = asyncio.create_task(batcher.run())
+    server = await asyncio.start_server(
+        lambda r, w: handle_connection(batcher, r, w), host, port
+    )
+    print(f"EcoWise ingestion API on http://{host}:{port} (db: {db.DB_PATH})", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        writer_task.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the EcoWise ingestion API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--db", help="SQLite file (defaults to the app's database)")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db.DB_PATH = args.db
+    db.create_tables()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
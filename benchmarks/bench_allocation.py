@@ -0,0 +1,280 @@
+# benchmarks/bench_allocation.py
+#
+# Microbenchmarks and randomized property checks for the pure algorithms in
+# database/allocation.py. Alternative implementations can be plugged in with
+# --impl name=module:function and are held to the same properties.
+
+import sys
+import json
+import time
+import random
+import importlib
+import statistics
+from collections import defaultdict
+
+from database import allocation
+
+# Floating point slack when comparing conserved totals
+EPS = 1e-6
+
+IMPLEMENTATIONS = {
+    "pack_sacks_into_bags":   allocation.pack_sacks_into_bags,
+    "pack_sacks_best_fit":    allocation.pack_sacks_best_fit,
+    "pack_bags_into_batches": allocation.pack_bags_into_batches,
+    "pack_bags_ffd":          allocation.pack_bags_ffd,
+    "settle_invoice":         allocation.settle_invoice,
+    "select_target_value":    allocation.select_target_value,
+    "allocate_funding":       allocation.allocate_funding,
+}
+
+
+def _close(a, b, scale=1.0):
+    return abs(a - b) <= EPS * max(1.0, abs(scale))
+
+
+# --- Synthetic inputs ---
+
+def make_sacks(n, rng):
+    """(sack_id, weight_kg) pairs with a realistic spread plus a few oversize sacks."""
+    sacks = []
+    for i in range(n):
+        weight = round(rng.uniform(20, 70), 1) if rng.random() > 0.01 else round(rng.uniform(70, 200), 1)
+        sacks.append((f"sack_{i}", weight))
+    return sacks
+
+
+def make_bags(n, rng):
+    """(bag_id, weight_kg) pairs, mostly full 63 kg bags with some partial ones."""
+    return [(f"bag_{i}", 63.0 if rng.random() > 0.1 else round(rng.uniform(1, 63), 1)) for i in range(n)]
+
+
+def make_funding(n_lenders, n_bundles, rng, scale=1.0):
+    """(lenders, bundles) for allocate_funding, with some empty positions and needs."""
+    lenders = [(f"lender_{i}", round(rng.uniform(0, 5e6) * scale, 2) if rng.random() > 0.1 else 0.0) for i in range(n_lenders)]
+    bundles = [(f"bundle_{i}", round(rng.uniform(0, 2e6) * scale, 2) if rng.random() > 0.1 else 0.0, rng.choice([5, 7.5, 10, 12]))
+               for i in range(n_bundles)]
+    return lenders, bundles
+
+
+def make_settlement_batches(n_batches, farmers_per_batch, rng):
+    batches = []
+    for b in range(n_batches):
+        farmer_values = {
+            f"farmer_{rng.randrange(farmers_per_batch * 4)}": round(rng.uniform(0, 300000), 2)
+            for _ in range(farmers_per_batch)
+        }
+        lenders = [
+            {"lender_id": f"lender_{rng.randrange(50)}",
+             "principal": round(rng.uniform(0, 1e6), 2),
+             "interest_rate": round(rng.uniform(0, 25), 1)}
+            for _ in range(rng.randrange(0, 5))
+        ]
+        batches.append({"batch_id": f"batch_{b}", "farmer_values": farmer_values, "lenders": lenders})
+    return batches
+
+
+# --- Properties ---
+
+def check_bag_packing(pack, sacks, capacity=allocation.BAG_CAPACITY_KG):
+    bags = pack(sacks, capacity)
+    allocated = defaultdict(float)
+    for bag in bags:
+        assert bag, "empty bag produced"
+        load = sum(w for _, w in bag)
+        assert load <= capacity + EPS, f"bag over capacity: {load}"
+        for sack_id, w in bag:
+            assert w > 0, f"non-positive allocation for {sack_id}"
+            allocated[sack_id] += w
+    delivered = defaultdict(float)
+    for sack_id, w in sacks:
+        delivered[sack_id] += w
+    for sack_id, w in delivered.items():
+        assert _close(allocated[sack_id], w, w), f"{sack_id}: allocated {allocated[sack_id]} != delivered {w}"
+    assert set(allocated) <= set(delivered), "allocated a sack that was never delivered"
+
+
+def check_best_fit_bag_count(greedy, best_fit, sacks, capacity=allocation.BAG_CAPACITY_KG):
+    # Fewer splits must not cost extra bags
+    n_greedy = len(greedy(sacks, capacity))
+    n_best = len(best_fit(sacks, capacity))
+    assert n_best <= n_greedy, f"best fit used {n_best} bags, greedy {n_greedy}"
+
+
+def check_batch_packing(pack, bags, capacity=allocation.BATCH_CAPACITY_KG):
+    batches = pack(bags, capacity)
+    weights = dict(bags)
+    seen = []
+    for batch in batches:
+        assert batch, "empty batch produced"
+        load = sum(weights[b] for b in batch)
+        assert load <= capacity + EPS or len(batch) == 1, f"batch over capacity: {load}"
+        seen.extend(batch)
+    assert sorted(seen) == sorted(weights), "every bag must land in exactly one batch"
+
+
+def check_target_value(select, values, target):
+    picked, total = select(values, target)
+    assert len(set(picked)) == len(picked), "a value was picked twice"
+    assert _close(total, sum(values[i] for i in picked), target), "reported total does not match the picked values"
+    assert total <= target + EPS * max(1.0, target), f"total {total} overshoots target {target}"
+    # Never worse than taking the largest values that fit, in order
+    greedy = 0.0
+    for v in sorted(values, reverse=True):
+        if greedy + v <= target:
+            greedy += v
+    assert total >= greedy - EPS * max(1.0, target), f"total {total} below greedy {greedy}"
+
+
+def check_funding(allocate, lenders, bundles, rule):
+    rows = allocate(lenders, bundles, rule)
+    lent, got = defaultdict(float), defaultdict(float)
+    for lender_id, bundle_id, amount in rows:
+        assert amount > 0, "empty funding row"
+        assert round(amount, 2) == amount, f"amount {amount} is not whole kobo"
+        lent[lender_id] += amount
+        got[bundle_id] += amount
+    available, need = dict(lenders), {b: n for b, n, _ in bundles}
+    assert all(lent[l] <= available[l] + EPS for l in lent), "a lender lends more than it has"
+    assert all(got[b] <= need[b] + EPS for b in got), "a bundle gets more than it needs"
+    # Everything that can be placed is, give or take rounding to the kobo
+    placed, possible = sum(lent.values()), min(sum(available.values()), sum(need.values()))
+    assert placed >= possible - 0.01 * (len(bundles) + 1), f"placed {placed} of a possible {possible}"
+    if rule != "pro_rata":
+        assert len(rows) <= max(0, len(lenders) + len(bundles) - 1), "north-west corner gives too many rows"
+
+
+def check_settlement(settle, batches, amount_paid, percent_to_farmers):
+    settlement = settle(batches, amount_paid, percent_to_farmers)
+    total_value = sum(sum(b["farmer_values"].values()) for b in batches)
+    allocated = sum(e["allocated"] for e in settlement)
+    assert _close(allocated, min(amount_paid, total_value), amount_paid), \
+        f"allocated {allocated} != min(paid, value)"
+    by_batch = {b["batch_id"]: b for b in batches}
+    for e in settlement:
+        batch = by_batch[e["batch_id"]]
+        batch_value = sum(batch["farmer_values"].values())
+        assert e["allocated"] <= batch_value + EPS * max(1.0, batch_value)
+        burned = sum(e["burns"].values())
+        if batch_value > 0:
+            assert _close(burned, e["allocated"], e["allocated"]), f"burns {burned} != allocated {e['allocated']}"
+        assert all(v >= 0 for v in e["burns"].values())
+        assert all(v >= 0 for v in e["bonuses"].values())
+        assert e["to_ecowise"] >= -EPS
+        distributed = sum(e["lender_payments"].values()) + sum(e["bonuses"].values()) + e["to_ecowise"]
+        # Lenders can be owed more than the allocation (interest), never less than everything left
+        assert distributed >= e["allocated"] - EPS * max(1.0, e["allocated"]), "money disappeared"
+        if sum(e["lender_payments"].values()) <= e["allocated"]:
+            assert _close(distributed, e["allocated"], e["allocated"]), "money created"
+
+
+def run_checks(trials=200, seed=0, impls=IMPLEMENTATIONS):
+    rng = random.Random(seed)
+    for _ in range(trials):
+        sacks = make_sacks(rng.randrange(0, 400), rng)
+        check_bag_packing(impls["pack_sacks_into_bags"], sacks)
+        check_bag_packing(impls["pack_sacks_best_fit"], sacks)
+        check_best_fit_bag_count(impls["pack_sacks_into_bags"], impls["pack_sacks_best_fit"], sacks)
+        bags = make_bags(rng.randrange(0, 3000), rng)
+        capacity = rng.choice([600, 6000, allocation.BATCH_CAPACITY_KG])
+        check_batch_packing(impls["pack_bags_into_batches"], bags, capacity=capacity)
+        check_batch_packing(impls["pack_bags_ffd"], bags, capacity=capacity)
+        values = [rng.uniform(60000, 210000) for _ in range(rng.randrange(0, 500))]
+        check_target_value(impls["select_target_value"], values, rng.uniform(0, 1.2) * sum(values))
+        lenders, bundles = make_funding(rng.randrange(0, 40), rng.randrange(0, 60), rng, scale=rng.choice([0.01, 1, 100]))
+        check_funding(impls["allocate_funding"], lenders, bundles, rng.choice(list(allocation.FUNDING_RULES)))
+        batches = make_settlement_batches(rng.randrange(0, 6), rng.randrange(1, 40), rng)
+        total = sum(sum(b["farmer_values"].values()) for b in batches)
+        amount = rng.choice([0.0, total * rng.random(), total, total * 1.5 + 1])
+        check_settlement(impls["settle_invoice"], batches, amount, rng.randrange(0, 101))
+    return trials
+
+
+# --- Benchmarks ---
+
+def _time(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t0)
+    return {"min_s": min(timings), "median_s": statistics.median(timings), "runs": repeat}
+
+
+def run_benchmarks(sizes, repeat=3, seed=0, impls=IMPLEMENTATIONS):
+    results = {}
+    for n in sizes:
+        rng = random.Random(seed)
+        sacks = make_sacks(n, rng)
+        bags = make_bags(max(1, n * 45 // 63), rng)
+        batches = make_settlement_batches(max(1, n // 1500), 300, rng)
+        amount = sum(sum(b["farmer_values"].values()) for b in batches) * 0.8
+        lenders, bundles = make_funding(max(1, n // 200), max(1, n // 125), rng)
+        values = [weight * 3000 for _, weight in sacks]
+        target = sum(values) / 10
+        results[str(n)] = {
+            "pack_sacks_into_bags":   _time(lambda: impls["pack_sacks_into_bags"](sacks), repeat),
+            "pack_sacks_best_fit":    _time(lambda: impls["pack_sacks_best_fit"](sacks), repeat),
+            "pack_bags_into_batches": _time(lambda: impls["pack_bags_into_batches"](bags), repeat),
+            "pack_bags_ffd":          _time(lambda: impls["pack_bags_ffd"](bags), repeat),
+            "settle_invoice":         _time(lambda: impls["settle_invoice"](batches, amount, 50), repeat),
+            "select_target_value":    _time(lambda: impls["select_target_value"](values, target), repeat),
+            "allocate_funding":       _time(lambda: impls["allocate_funding"](lenders, bundles, "interest_priority"), repeat),
+        }
+        results[str(n)]["select_target_value"]["gap"] = target - impls["select_target_value"](values, target)[1]
+        for name in ("pack_sacks_into_bags", "pack_sacks_best_fit"):
+            results[str(n)][name]["packing"] = allocation.bag_packing_stats(impls[name](sacks))
+        weights = dict(bags)
+        for name in ("pack_bags_into_batches", "pack_bags_ffd"):
+            fills = sorted(sum(weights[b] for b in batch) / allocation.BATCH_CAPACITY_KG
+                           for batch in impls[name](bags))
+            # The last batch holds whatever is left; the rest show how tightly batches close
+            results[str(n)][name]["batching"] = {"batches": len(fills), "second_lowest_fill": fills[1] if len(fills) > 1 else None}
+    return results
+
+
+def _load_impl(spec):
+    name, target = spec.split("=", 1)
+    module, func = target.split(":", 1)
+    if name not in IMPLEMENTATIONS:
+        raise SystemExit(f"Unknown algorithm '{name}', expected one of {sorted(IMPLEMENTATIONS)}")
+    return name, getattr(importlib.import_module(module), func)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark and property-check the packing/settlement algorithms.")
+    parser.add_argument("mode", choices=["check", "bench"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--trials", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--impl", action="append", default=[], help="name=module:function override")
+    parser.add_argument("--out", help="Write benchmark results as JSON")
+    args = parser.parse_args(argv)
+
+    impls = dict(IMPLEMENTATIONS)
+    impls.update(_load_impl(spec) for spec in args.impl)
+
+    if args.mode == "check":
+        n = run_checks(args.trials, args.seed, impls)
+        print(f"{n} randomized trials passed for {', '.join(sorted(impls))}")
+        return 0
+
+    results = run_benchmarks(args.sizes, args.repeat, args.seed, impls)
+    for size, cases in results.items():
+        for name, res in cases.items():
+            packing = res.get("packing")
+            batching = res.get("batching")
+            detail = f"  {packing['bags']} bags, {packing['split_sacks']} split sacks" if packing else ""
+            if batching and batching["second_lowest_fill"] is not None:
+                detail = f"  {batching['batches']} batches, second-lowest fill {batching['second_lowest_fill']:.4%}"
+            print(f"{size:>9} {name:24s} {res['median_s'] * 1000:9.1f} ms{detail}", file=sys.stderr)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"seed": args.seed, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+# benchmarks/bench_archive.py
+#
+# Hot/cold archiving. Generates a database (two years of history, which is
+# three closed seasons), dates each invoice on its batch so settled records
+# are spread over the seasons too, then measures the hot file size and the
+# everyday queries before and after database/archive.py moves the closed
+# seasons out and incremental_vacuum hands the space back. The results must
+# not change: the kpi table and a full rebuild_kpis, every farmer's token
+# balances, the token and invoice listings with include_archive, and the
+# lineage of a sample of sacks are compared before and after.
+#
+#   python -m benchmarks.bench_archive --scale 100k
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+
+from database import db, archive
+from benchmarks.generate import SCALES, generate_database
+
+
+def _timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return result, round(best * 1000, 2)
+
+
+def _backdate_invoices():
+    conn = db.get_connection()
+    conn.execute("""
+        UPDATE invoices
+           SET created_at = (SELECT MAX(b.created_at) FROM batches b, json_each(invoices.covered_batches) j
+                              WHERE b.id = j.value)
+    """)
+    conn.commit()
+    conn.close()
+
+
+def _kpis():
+    conn = db.get_connection()
+    kpis = dict(conn.execute("SELECT key, value FROM kpi").fetchall())
+    conn.close()
+    return {k: round(v, 2) for k, v in kpis.items()}
+
+
+def _snapshot(farmer_ids, sack_ids, include_archive):
+    """Everything that must survive archiving, plus how long the reads take."""
+    timings = {}
+    tokens, timings["all_tokens_ms"] = _timed(lambda: db.get_all_tokens(include_archive))
+    invoices, timings["all_invoices_ms"] = _timed(lambda: db.get_all_invoices(include_archive))
+    _, timings["bundle_report_ms"] = _timed(db.get_all_bundles_with_details)
+    balances, timings["balances_ms"] = _timed(
+        lambda: {f: sorted(map(tuple, db.get_token_balance_by_farmer(f).round(2).values.tolist()))
+                 for f in farmer_ids}, repeat=1)
+    lineage, timings["lineage_ms"] = _timed(
+        lambda: {s: sorted(map(tuple, db.get_sack_lineage(s, include_archive)[["entity_type", "entity_id"]]
+                               .values.tolist())) for s in sack_ids}, repeat=1)
+    kpis = _kpis()
+    db.rebuild_kpis()
+    state = {
+        "kpi": kpis,
+        "rebuilt_kpi": _kpis(),
+        "tokens": sorted(tokens["id"].tolist()),
+        "invoices": sorted(invoices["id"].tolist()),
+        "balances": balances,
+        "lineage": lineage,
+    }
+    return state, timings
+
+
+def _sizes():
+    sizes = {"hot_bytes": os.path.getsize(db.DB_PATH)}
+    if os.path.exists(db.archive_path()):
+        sizes["archive_bytes"] = os.path.getsize(db.archive_path())
+    return sizes
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Hot file size, read times and results before/after archiving.")
+    parser.add_argument("--scale", default="100k", choices=list(SCALES))
+    parser.add_argument("--sample", type=int, default=200, help="Sacks whose lineage is compared")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Write results as JSON")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="ecowise-archive-")
+    old_path = db.DB_PATH
+    results = {}
+    try:
+        path = os.path.join(workdir, f"{args.scale}.db")
+        generate_database(path, sacks=SCALES[args.scale], seed=args.seed)
+        db.DB_PATH = path
+        _backdate_invoices()
+        rng = random.Random(args.seed)
+        farmer_ids = [f for f, _ in db.get_farmer_list()]
+        sack_ids = rng.sample(db.get_all_sack_ids(), min(args.sample, len(db.get_all_sack_ids())))
+
+        before, results["before_ms"] = _snapshot(farmer_ids, sack_ids, include_archive=False)
+        results["before"] = _sizes()
+        print(f"before   {json.dumps(results['before'])} {json.dumps(results['before_ms'])}", file=sys.stderr)
+
+        t0 = time.perf_counter()
+        moved = archive.archive_closed()
+        results["archive_s"] = round(time.perf_counter() - t0, 3)
+        results["moved"] = moved
+        t0 = time.perf_counter()
+        results["vacuum"] = archive.incremental_vacuum()
+        results["vacuum_s"] = round(time.perf_counter() - t0, 3)
+        results["after"] = _sizes()
+        print(f"archive  {results['archive_s']} s, vacuum {results['vacuum_s']} s, "
+              f"{json.dumps(results['after'])}", file=sys.stderr)
+
+        hot, results["after_hot_ms"] = _snapshot(farmer_ids, sack_ids, include_archive=False)
+        full, results["after_full_ms"] = _snapshot(farmer_ids, sack_ids, include_archive=True)
+        print(f"after    hot {json.dumps(results['after_hot_ms'])}", file=sys.stderr)
+        print(f"after    +archive {json.dumps(results['after_full_ms'])}", file=sys.stderr)
+
+        results["unchanged"] = {
+            key: full[key] == before[key] for key in ("kpi", "rebuilt_kpi", "tokens", "invoices", "balances", "lineage")
+        }
+        results["unchanged"]["hot_balances"] = hot["balances"] == before["balances"]
+        results["unchanged"]["hot_kpi"] = hot["kpi"] == before["kpi"]
+        print(f"unchanged {json.dumps(results['unchanged'])}", file=sys.stderr)
+    finally:
+        db._read_pool.clear()
+        db.DB_PATH = old_path
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if all(results.get("unchanged", {}).values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+# benchmarks/bench_backup.py
+#
+# Backups while deliveries are being recorded. Generates a database, then
+# with writer threads recording deliveries (create_sack_and_mint_token, one
+# commit each) takes a backup four ways and reports the writers' commit
+# latency while it ran:
+#   idle     no backup, for the baseline latency
+#   copy     shutil.copyfile of the live file (what backing up meant before)
+#   onestep  backup API in a single step, no pacing
+#   paced    database/backup.py defaults (BACKUP_STEP_PAGES, BACKUP_STEP_PAUSE_S)
+# Each copy is then checked: quick_check, and whether it holds every delivery
+# committed before it started (a plain file copy misses whatever is still
+# only in the -wal file).
+#
+#   python -m benchmarks.bench_backup --scale 100k --writers 4
+
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+from database import db, backup
+from benchmarks.generate import SCALES, generate_database
+
+MODES = ["idle", "copy", "onestep", "paced"]
+
+
+def _pct(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+
+
+def _count_sacks(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM sacks").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _take(mode, workdir, idle_s):
+    """Runs one backup; returns (path of the copy or None, seconds)."""
+    t0 = time.perf_counter()
+    if mode == "idle":
+        time.sleep(idle_s)
+        return None, time.perf_counter() - t0
+    if mode == "copy":
+        path = os.path.join(workdir, "copy.db")
+        shutil.copyfile(db.DB_PATH, path)
+        return path, time.perf_counter() - t0
+    pages, pause = (-1, 0) if mode == "onestep" else (backup.BACKUP_STEP_PAGES, backup.BACKUP_STEP_PAUSE_S)
+    manifest = backup.create_backup(tag=mode, step_pages=pages, pause_s=pause)
+    return os.path.join(backup.backup_dir(), manifest["files"]["main"]["file"]), time.perf_counter() - t0
+
+
+def run(mode, workdir, writers, farmer_ids, idle_s):
+    stop = threading.Event()
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def writer(n):
+        farmer_id = farmer_ids[n % len(farmer_ids)]
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                db.create_sack_and_mint_token(farmer_id, 45.0, 90000.0, "Backup bench")
+            except sqlite3.OperationalError as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+
+    pool = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    for t in pool:
+        t.start()
+    time.sleep(0.5)  # let the writers settle before measuring
+    with lock:
+        latencies.clear()
+    committed_before = _count_sacks(db.DB_PATH)
+    path, seconds = _take(mode, workdir, idle_s)
+    stop.set()
+    for t in pool:
+        t.join()
+
+    result = {
+        "backup_s": round(seconds, 3),
+        "writes": len(latencies),
+        "write_errors": len(errors),
+        "write_p50_ms": _pct(latencies, 0.5),
+        "write_p99_ms": _pct(latencies, 0.99),
+        "write_max_ms": _pct(latencies, 1.0),
+    }
+    if path:
+        conn = sqlite3.connect(path)
+        try:
+            result["quick_check"] = conn.execute("PRAGMA quick_check").fetchone()[0]
+            result["missing_deliveries"] = max(0, committed_before - _count_sacks(path))
+        except sqlite3.DatabaseError as e:
+            result["quick_check"] = str(e)  # a torn copy may not even open
+        finally:
+            conn.close()
+    return result
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Writer latency during online backups vs a file copy.")
+    parser.add_argument("--scale", default="100k", choices=list(SCALES))
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--idle-seconds", type=float, default=3.0)
+    parser.add_argument("--out", help="Write results as JSON")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="ecowise-backup-")
+    old_path, old_dir = db.DB_PATH, backup.BACKUP_DIR
+    results = {}
+    try:
+        db.DB_PATH = os.path.join(workdir, f"{args.scale}.db")
+        backup.BACKUP_DIR = os.path.join(workdir, "backups")
+        generate_database(db.DB_PATH, sacks=SCALES[args.scale])
+        results["db_bytes"] = os.path.getsize(db.DB_PATH)
+        farmer_ids = [f for f, _ in db.get_farmer_list()]
+        for mode in MODES:
+            results[mode] = run(mode, workdir, args.writers, farmer_ids, args.idle_seconds)
+            print(f"{mode:8s} {json.dumps(results[mode])}", file=sys.stderr)
+    finally:
+        db._read_pool.clear()
+        db.DB_PATH, backup.BACKUP_DIR = old_path, old_dir
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
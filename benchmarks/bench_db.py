@@ -0,0 +1,254 @@
+# benchmarks/bench_db.py
+
+import os
+import sys
+import json
+import shutil
+import time
+import random
+import platform
+import statistics
+import sqlite3
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+
+from database import db
+from benchmarks.generate import SCALES, generate_database
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), ".data")
+
+# A case regresses when its median exceeds the baseline median by this factor
+DEFAULT_TOLERANCE = 1.25
+# ...and by at least this many seconds, so sub-millisecond noise never trips it
+MIN_REGRESSION_SECONDS = 0.005
+
+
+def _sample(conn, query):
+    row = conn.execute(query).fetchone()
+    return row[0] if row else None
+
+
+def _fixtures(path, seed):
+    """Picks stable sample IDs out of a generated database to feed parameterised cases."""
+    conn = sqlite3.connect(path)
+    rng = random.Random(seed)
+    count = _sample(conn, "SELECT COUNT(*) FROM sacks")
+    offset = rng.randrange(max(1, count))
+    fx = {
+        "farmer_id": _sample(conn, "SELECT id FROM farmers ORDER BY id LIMIT 1"),
+        "sack_id":   _sample(conn, f"SELECT id FROM sacks ORDER BY id LIMIT 1 OFFSET {offset}"),
+        "bag_id":    _sample(conn, "SELECT bag_id FROM bag_sacks ORDER BY bag_id LIMIT 1"),
+        # generate_database invoices the oldest batches, so the newest is still open
+        "batch_id":  _sample(conn, "SELECT id FROM batches ORDER BY created_at DESC, id LIMIT 1"),
+        "lender_id": _sample(conn, "SELECT id FROM lenders ORDER BY id LIMIT 1"),
+        "bundle_id": _sample(conn, "SELECT id FROM bundles WHERE status = 'unfunded' ORDER BY id LIMIT 1"),
+        "unbundled_sack_ids": [r[0] for r in conn.execute("""
+            SELECT id FROM sacks WHERE id NOT IN (SELECT sack_id FROM bundle_sacks) ORDER BY id LIMIT 50
+        """)],
+    }
+    conn.close()
+    return fx
+
+
+def read_cases(fx):
+    """(name, callable) pairs that leave the database unchanged."""
+    return [
+        ("get_all_farmers",                 lambda: db.get_all_farmers()),
+        ("get_farmer_list",                 lambda: db.get_farmer_list()),
+        ("get_farmer_profile",              lambda: db.get_farmer_profile(fx["farmer_id"])),
+        ("get_sacks_by_farmer",             lambda: db.get_sacks_by_farmer(fx["farmer_id"])),
+        ("get_unbagged_sacks",              lambda: db.get_unbagged_sacks()),
+        ("get_unbagged_sacks_grouped",      lambda: db.get_unbagged_sacks_grouped()),
+        ("get_all_bags",                    lambda: db.get_all_bags()),
+        ("get_sacks_for_bag",               lambda: db.get_sacks_for_bag(fx["bag_id"])),
+        ("get_unbatched_bags",              lambda: db.get_unbatched_bags()),
+        ("get_all_batches",                 lambda: db.get_all_batches()),
+        ("get_sacks_for_batch",             lambda: db.get_sacks_for_batch(fx["batch_id"])),
+        ("get_batch_contributors",          lambda: db.get_batch_contributors(fx["batch_id"])),
+        ("get_lenders_for_batch",           lambda: db.get_lenders_for_batch(fx["batch_id"])),
+        ("get_all_warrant_receipts",        lambda: db.get_all_warrant_receipts()),
+        ("get_covered_ids_by_type",         lambda: db.get_covered_ids_by_type("pre-processing")),
+        ("get_all_lenders",                 lambda: db.get_all_lenders()),
+        ("get_unfunded_bundles",            lambda: db.get_unfunded_bundles()),
+        ("get_eligible_sacks_for_bundling", lambda: db.get_eligible_sacks_for_bundling()),
+        ("get_all_bundles_with_details",    lambda: db.get_all_bundles_with_details()),
+        ("get_all_tokens",                  lambda: db.get_all_tokens()),
+        ("get_token_balance_by_farmer",     lambda: db.get_token_balance_by_farmer(fx["farmer_id"])),
+        ("get_all_tips",                    lambda: db.get_all_tips()),
+        ("get_all_invoices",                lambda: db.get_all_invoices()),
+        ("get_sack_ownership",              lambda: db.get_sack_ownership(fx["sack_id"])),
+        ("get_bags_for_sack",               lambda: db.get_bags_for_sack(fx["sack_id"])),
+        ("get_batches_for_sack",            lambda: db.get_batches_for_sack(fx["sack_id"])),
+        ("get_bundles_for_sack",            lambda: db.get_bundles_for_sack(fx["sack_id"])),
+        ("get_sack_lineage",                lambda: db.get_sack_lineage(fx["sack_id"])),
+        ("get_all_sack_ids",                lambda: db.get_all_sack_ids()),
+    ]
+
+
+def write_cases(fx):
+    """(name, callable) pairs that mutate the database; each runs on a fresh copy."""
+    return [
+        ("create_farmer",              lambda: db.create_farmer("Bench", "Farmer", "", "Nigeria", "Ondo", "Female", "")),
+        ("create_sack_and_mint_token", lambda: db.create_sack_and_mint_token(fx["farmer_id"], 42.0, 130000.0, "Ondo")),
+        ("create_tip",                 lambda: db.create_tip(fx["farmer_id"], 500.0, "bench")),
+        ("auto_fill_bags",             lambda: db.auto_fill_bags()),
+        ("auto_fill_batches",          lambda: db.auto_fill_batches()),
+        ("create_bundle",              lambda: db.create_bundle("None", "", 10.0, fx["unbundled_sack_ids"])),
+        ("fund_bundle",                lambda: db.fund_bundle(fx["lender_id"], fx["bundle_id"], 1.0)),
+        ("create_invoice",             lambda: db.create_invoice([fx["batch_id"]], 1e6, 50)),
+    ]
+
+
+def _time(fn, repeat):
+    timings, rows, error = [], None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        try:
+            # Some db functions print diagnostics; keep them out of the timings
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                result = fn()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            break
+        timings.append(time.perf_counter() - t0)
+        if hasattr(result, "__len__"):
+            rows = len(result)
+    out = {"rows": rows}
+    if timings:
+        out.update({
+            "min_s": min(timings),
+            "median_s": statistics.median(timings),
+            "runs": len(timings),
+        })
+    if error:
+        out["error"] = error
+    return out
+
+
+def prepare_scale(scale, seed, regenerate=False):
+    """Returns the path to the cached generated database for a scale, building it if needed."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, f"ecowise-{scale}-seed{seed}.db")
+    if regenerate or not os.path.exists(path):
+        generate_database(path, sacks=SCALES[scale], seed=seed)
+    else:
+        # A cached file may predate schema changes; bring it up to date
+        old_path = db.DB_PATH
+        try:
+            db.DB_PATH = path
+            db.create_tables()
+        finally:
+            db.DB_PATH = old_path
+            db._read_pool.clear()
+    return path
+
+
+def _remove_db(path):
+    """Removes a database file with its -wal and -shm, after closing pooled readers of it."""
+    db._read_pool.clear()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def _fresh_copy(source, work):
+    # A leftover -wal from the previous copy would be replayed over the new one
+    _remove_db(work)
+    shutil.copyfile(source, work)
+
+
+def run_scale(scale, seed=0, repeat=5, only=None, regenerate=False):
+    source = prepare_scale(scale, seed, regenerate)
+    fx = _fixtures(source, seed)
+    work = os.path.join(DATA_DIR, f"work-{scale}.db")
+    results = {}
+    old_path = db.DB_PATH
+    try:
+        _fresh_copy(source, work)
+        db.DB_PATH = work
+        for name, fn in read_cases(fx):
+            if only and name not in only:
+                continue
+            results[name] = _time(fn, repeat)
+        for name, fn in write_cases(fx):
+            if only and name not in only:
+                continue
+            _fresh_copy(source, work)
+            results[name] = _time(fn, 1)
+    finally:
+        db.DB_PATH = old_path
+        _remove_db(work)
+    return results
+
+
+def check_regressions(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Annotates each result in `report` with the threshold derived from `baseline`
+    and returns a list of (scale, case, median, threshold) tuples that regressed.
+    """
+    regressions = []
+    for scale, cases in report["results"].items():
+        base_cases = baseline.get("results", {}).get(scale, {})
+        for name, res in cases.items():
+            base = base_cases.get(name, {})
+            if "median_s" not in base or "median_s" not in res:
+                continue
+            threshold = max(base["median_s"] * tolerance, base["median_s"] + MIN_REGRESSION_SECONDS)
+            res["baseline_median_s"] = base["median_s"]
+            res["threshold_s"] = threshold
+            res["regressed"] = res["median_s"] > threshold
+            if res["regressed"]:
+                regressions.append((scale, name, res["median_s"], threshold))
+    return regressions
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Time every public database/db.py function at several data scales.")
+    parser.add_argument("--scales", nargs="+", choices=sorted(SCALES), default=["10k", "100k"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="+", help="Run only these cases")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--regenerate", action="store_true", help="Rebuild cached databases")
+    args = parser.parse_args(argv)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "results": {},
+    }
+    for scale in args.scales:
+        print(f"[{scale}] running...", file=sys.stderr)
+        report["results"][scale] = run_scale(scale, args.seed, args.repeat, args.only, args.regenerate)
+        for name, res in report["results"][scale].items():
+            took = f"{res['median_s'] * 1000:9.1f} ms" if "median_s" in res else "    error"
+            print(f"  {name:34s} {took}  {res.get('error', '')}", file=sys.stderr)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["meta"]["baseline"] = args.baseline
+        report["meta"]["tolerance"] = args.tolerance
+        regressions = check_regressions(report, baseline, args.tolerance)
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for scale, name, median, threshold in regressions:
+        print(f"REGRESSION [{scale}] {name}: {median:.4f}s > {threshold:.4f}s", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# benchmarks/bench_exports.py
+#
+# Listing exports. Generates databases at two or more scales and, for each
+# table in database/export.py's TABLE_EXPORTS and each format, streams the
+# export to /dev/null and records time and peak Python heap (tracemalloc). The
+# same table loaded into a DataFrame and written with to_csv is measured
+# alongside, since that is what an export would cost without streaming. A
+# streamed export's peak should stay flat as the table grows.
+#
+#   python -m benchmarks.bench_exports --scales 10k 100k --tables sacks tokens
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import tracemalloc
+
+import pandas as pd
+
+from database import db, export
+from benchmarks.generate import SCALES, generate_database
+
+
+def _measure(fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"s": round(elapsed, 3), "peak_mb": round(peak / 1e6, 2)}
+
+
+def _stream(table, fmt):
+    export.write_export(export.stream_table(table, fmt), os.devnull)
+
+
+def _dataframe(table):
+    conn = db.get_read_connection()
+    cursor = conn.cursor()
+    cursor.execute(export.TABLE_EXPORTS[table])
+    df = pd.DataFrame(cursor.fetchall(), columns=[d[0] for d in cursor.description])
+    conn.close()
+    with open(os.devnull, "wb") as f:
+        f.write(df.to_csv(index=False).encode("utf-8"))
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Streamed export time and peak memory by table size.")
+    parser.add_argument("--scales", nargs="+", default=["10k", "100k"], choices=list(SCALES))
+    parser.add_argument("--tables", nargs="+", default=["sacks", "tokens", "bundles"],
+                        choices=sorted(export.TABLE_EXPORTS))
+    parser.add_argument("--out", help="Write results as JSON")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="ecowise-exports-")
+    old_path = db.DB_PATH
+    results = {}
+    try:
+        for scale in args.scales:
+            path = os.path.join(workdir, f"{scale}.db")
+            generate_database(path, sacks=SCALES[scale])
+            db.DB_PATH = path
+            for table in args.tables:
+                row = {fmt: _measure(lambda: _stream(table, fmt)) for fmt in export.EXPORT_FORMATS}
+                row["dataframe_csv"] = _measure(lambda: _dataframe(table))
+                results[f"{scale}/{table}"] = row
+                print(f"{scale:5s} {table:9s} {json.dumps(row)}", file=sys.stderr)
+    finally:
+        db.DB_PATH = old_path
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+# benchmarks/bench_ids.py
+#
+# Id scheme and join-table layout. Loads the same deliveries and bag packing
+# into fresh databases keyed by the old random uuid4-hex ids and by the
+# time-ordered ids from database/ids.py, with bag_sacks in its old composite
+# primary-key layout and in the surrogate-key layout, and reports insert
+# throughput, the on-disk size of each table and index (from dbstat), the
+# reverse lookup by sack_id, and what migrate_join_tables() costs on the old
+# layout.
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import sqlite3
+import tempfile
+
+from database import db
+
+LEGACY_BAG_SACKS = """
+    CREATE TABLE bag_sacks (
+        bag_id TEXT,
+        sack_id TEXT,
+        allocated_weight_kg REAL NOT NULL,
+        PRIMARY KEY (bag_id, sack_id),
+        FOREIGN KEY (bag_id) REFERENCES bags(id),
+        FOREIGN KEY (sack_id) REFERENCES sacks(id)
+    );
+"""
+
+ID_SCHEMES = {
+    "uuid4": lambda prefix: f"{prefix}_{uuid.uuid4().hex}",
+    "ulid": db.generate_id,
+}
+
+SIZED_OBJECTS = ["sacks", "bags", "bag_sacks"]
+
+
+def _sizes(path):
+    """Bytes used by each table and index of interest, keyed by name."""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    rows = conn.execute("""
+        SELECT s.name, SUM(s.pgsize)
+          FROM dbstat s
+          JOIN sqlite_master m ON m.name = s.name
+         WHERE m.tbl_name IN ({})
+         GROUP BY s.name
+    """.format(",".join("?" * len(SIZED_OBJECTS))), SIZED_OBJECTS).fetchall()
+    conn.close()
+    return dict(rows)
+
+
+def _prepare(path, layout):
+    db.DB_PATH = path
+    db.create_tables()
+    if layout == "composite":
+        conn = sqlite3.connect(path)
+        conn.execute("DROP TABLE bag_sacks")
+        conn.execute(LEGACY_BAG_SACKS)
+        conn.commit()
+        conn.close()
+        db.create_tables()  # restores the sack_id index and change-capture triggers
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO farmers (id, first_name, last_name) VALUES ('farmer_bench', 'Bench', 'Farmer')")
+    conn.commit()
+    conn.close()
+
+
+def run_load(path, scheme, sacks, chunk, seed):
+    """Deliveries then bags of ~10 sacks, committed every `chunk` sacks."""
+    rng = random.Random(seed)
+    gen = ID_SCHEMES[scheme]
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    t0 = time.perf_counter()
+    sack_ids = []
+    for start in range(0, sacks, chunk):
+        rows = []
+        for _ in range(min(chunk, sacks - start)):
+            weight = round(rng.uniform(20, 70), 1)
+            rows.append((gen("sack"), "farmer_bench", weight, weight * 3000, "Bench"))
+        cursor.executemany("""
+            INSERT INTO sacks (id, farmer_id, weight_kg, value_paid, warehouse) VALUES (?, ?, ?, ?, ?)
+        """, rows)
+        conn.commit()
+        sack_ids.extend(r[0] for r in rows)
+    sack_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for start in range(0, len(sack_ids), chunk):
+        bags, links = [], []
+        for i in range(start, min(start + chunk, len(sack_ids)), 10):
+            bag_id = gen("bag")
+            bags.append((bag_id,))
+            links.extend((bag_id, s, 6.3) for s in sack_ids[i:i + 10])
+        cursor.executemany("INSERT INTO bags (id) VALUES (?)", bags)
+        cursor.executemany("INSERT INTO bag_sacks (bag_id, sack_id, allocated_weight_kg) VALUES (?, ?, ?)", links)
+        conn.commit()
+    bag_s = time.perf_counter() - t0
+
+    probes = rng.sample(sack_ids, min(2000, len(sack_ids)))
+    t0 = time.perf_counter()
+    for sack_id in probes:
+        cursor.execute("SELECT bag_id FROM bag_sacks WHERE sack_id = ?", (sack_id,)).fetchall()
+    lookup_s = time.perf_counter() - t0
+    conn.close()
+    return {
+        "sacks_per_s": round(sacks / sack_s),
+        "bag_links_per_s": round(len(sack_ids) / bag_s),
+        "lookup_us": round(lookup_s / len(probes) * 1e6, 1),
+    }
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Insert throughput and index size: uuid4 vs time-ordered ids.")
+    parser.add_argument("--sacks", type=int, default=200_000)
+    parser.add_argument("--chunk", type=int, default=500, help="Rows per transaction")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Write results as JSON")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="ecowise-ids-")
+    old_path = db.DB_PATH
+    results = {}
+    try:
+        for scheme in ID_SCHEMES:
+            for layout in ("composite", "surrogate"):
+                name = f"{scheme}/{layout}"
+                path = os.path.join(workdir, f"{scheme}-{layout}.db")
+                _prepare(path, layout)
+                result = run_load(path, scheme, args.sacks, args.chunk, args.seed)
+                result["kb"] = {k: v // 1024 for k, v in sorted(_sizes(path).items())}
+                if layout == "composite":
+                    t0 = time.perf_counter()
+                    db.DB_PATH = path
+                    db.migrate_join_tables()
+                    result["migrate_s"] = round(time.perf_counter() - t0, 3)
+                    result["kb_after_migrate"] = {k: v // 1024 for k, v in sorted(_sizes(path).items())}
+                results[name] = result
+                print(f"{name:16s} {json.dumps(result)}", file=sys.stderr)
+    finally:
+        db.DB_PATH = old_path
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"sacks": args.sacks, "chunk": args.chunk, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+# benchmarks/bench_reports.py
+#
+# Reports running next to writers. Builds the stress_funding database, then for
+# a fixed time runs writer threads funding open bundles in small amounts while
+# reader threads run the bundle report (get_all_bundles_with_details) and the
+# lender list, under three read paths:
+#   legacy    rollback journal, a new connection per report, one implicit
+#             transaction per statement (the read path before snapshots)
+#   wal       WAL journal, same per-statement reads
+#   snapshot  WAL journal, pooled read-only connections, one snapshot per report
+# and reports writer commit latency, report latency, and how many reports were
+# internally inconsistent: an open bundle whose stored status (updated in the
+# same transaction as the funding) disagrees with the funding the same report
+# summed.
+#
+#   python -m benchmarks.bench_reports --seconds 5 --writers 4 --readers 4
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import threading
+
+from database import db
+from benchmarks.stress_funding import build
+
+READ_PATHS = ["legacy", "wal", "snapshot"]
+
+
+def _set_read_path(read_path):
+    db._read_pool.clear()
+    conn = db.get_connection()
+    conn.execute(f"PRAGMA journal_mode = {'DELETE' if read_path == 'legacy' else 'WAL'}")
+    conn.close()
+    db.get_read_connection = db.get_connection if read_path != "snapshot" else _pooled
+
+
+_pooled = db.get_read_connection
+
+
+def _pct(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+
+
+def run(open_ids, seconds, writers, readers, seed):
+    lender_ids = db.get_all_lenders()["id"].tolist()
+    stop = threading.Event()
+    write_ms, read_ms = [], []
+    counts = {"writes": 0, "write_errors": 0, "reports": 0, "inconsistent": 0, "read_errors": 0}
+    lock = threading.Lock()
+
+    def writer(n):
+        rng = random.Random(seed * 100 + n)
+        while not stop.is_set():
+            key = "writes"
+            t0 = time.perf_counter()
+            try:
+                db.fund_bundle(rng.choice(lender_ids), rng.choice(open_ids), round(rng.uniform(50, 500), 2))
+            except ValueError:
+                pass  # bundle full or lender dry: still a full round trip under the write lock
+            except Exception:
+                key = "write_errors"
+            elapsed = time.perf_counter() - t0
+            with lock:
+                counts[key] += 1
+                write_ms.append(elapsed)
+
+    def reader():
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                bundles = db.get_all_bundles_with_details()
+                db.get_all_lenders()
+            except Exception:
+                with lock:
+                    counts["read_errors"] += 1
+                continue
+            elapsed = time.perf_counter() - t0
+            open_ = bundles[bundles["status"] != "paid"]
+            wrong = int((open_["status"] != open_["calculated_status"]).sum())
+            with lock:
+                counts["reports"] += 1
+                counts["inconsistent"] += wrong > 0
+                read_ms.append(elapsed)
+
+    pool = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    pool += [threading.Thread(target=reader) for _ in range(readers)]
+    for t in pool:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in pool:
+        t.join()
+
+    return {
+        **counts,
+        "writes_per_s": round(counts["writes"] / seconds),
+        "write_p50_ms": _pct(write_ms, 0.5),
+        "write_p99_ms": _pct(write_ms, 0.99),
+        "write_max_ms": _pct(write_ms, 1.0),
+        "report_p50_ms": _pct(read_ms, 0.5),
+        "report_p99_ms": _pct(read_ms, 0.99),
+    }
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Report consistency and writer stalls: legacy reads vs snapshots.")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--sacks", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Write results as JSON")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="ecowise-reports-")
+    old_path = db.DB_PATH
+    results = {}
+    try:
+        for read_path in READ_PATHS:
+            path = os.path.join(workdir, f"{read_path}.db")
+            _, open_ids = build(path, args.sacks, args.seed)
+            _set_read_path(read_path)
+            results[read_path] = run(open_ids, args.seconds, args.writers, args.readers, args.seed)
+            print(f"{read_path:9s} {json.dumps(results[read_path])}", file=sys.stderr)
+    finally:
+        db.get_read_connection = _pooled
+        db._read_pool.clear()
+        db.DB_PATH = old_path
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"seconds": args.seconds, "writers": args.writers, "readers": args.readers,
+                       "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+# benchmarks/bench_writes.py
+#
+# Concurrent write load: many threads (standing in for Streamlit sessions)
+# recording deliveries and tips at once. Runs the same load with each write on
+# its own connection/commit and through the group-commit writer, and reports
+# throughput, latency and how many writes failed with "database is locked".
+
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import tempfile
+import threading
+import statistics
+
+from database import db
+from benchmarks.generate import generate_database
+
+
+def _pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run_load(threads, writes_per_thread, farmer_ids):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    start = threading.Barrier(threads)
+
+    def session(n):
+        farmer_id = farmer_ids[n % len(farmer_ids)]
+        start.wait()
+        for i in range(writes_per_thread):
+            t0 = time.perf_counter()
+            try:
+                if i % 2:
+                    db.create_tip(farmer_id, 100.0, "load test")
+                else:
+                    db.create_sack_and_mint_token(farmer_id, 45.0, 90000.0, "Load")
+            except sqlite3.OperationalError as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+
+    workers = [threading.Thread(target=session, args=(n,)) for n in range(threads)]
+    t0 = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - t0
+    return {
+        "writes": len(latencies),
+        "errors": len(errors),
+        "elapsed_s": round(elapsed, 3),
+        "writes_per_s": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(statistics.median(latencies) * 1000, 2) if latencies else 0.0,
+        "p99_ms": round(_pct(latencies, 0.99) * 1000, 2),
+    }
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Concurrent write load: per-write commits vs group commit.")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--writes", type=int, default=200, help="Writes per thread")
+    parser.add_argument("--sacks", type=int, default=1000, help="Size of the seed database")
+    parser.add_argument("--out", help="Write results as JSON")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="ecowise-writes-")
+    seed_db = os.path.join(workdir, "seed.db")
+    generate_database(seed_db, sacks=args.sacks)
+    conn = sqlite3.connect(seed_db)
+    farmer_ids = [r[0] for r in conn.execute("SELECT id FROM farmers ORDER BY id LIMIT 100")]
+    conn.close()
+
+    results = {}
+    try:
+        for mode in ("direct", "group_commit"):
+            db.DB_PATH = os.path.join(workdir, f"{mode}.db")
+            shutil.copy(seed_db, db.DB_PATH)
+            if mode == "group_commit":
+                db.start_group_commit()
+            try:
+                results[mode] = run_load(args.threads, args.writes, farmer_ids)
+                stats = db.get_group_commit_stats()
+                if stats:
+                    results[mode]["commits"] = stats["groups"]
+                    results[mode]["busy_retries"] = stats["busy_retries"]
+            finally:
+                db.stop_group_commit()
+            print(f"{mode:13s} {json.dumps(results[mode])}", file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"threads": args.threads, "writes_per_thread": args.writes, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
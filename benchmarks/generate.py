@@ -0,0 +1,249 @@
+# benchmarks/generate.py
+
+import os
+import random
+import json
+from datetime import datetime, timedelta
+
+from database import db
+
+# Named scales used by the benchmark suite. Every other entity count is
+# derived from the sack count so the ratios stay realistic.
+SCALES = {
+    "1k":   1_000,
+    "10k":  10_000,
+    "100k": 100_000,
+    "1m":   1_000_000,
+}
+
+WAREHOUSES = ["Ikom", "Ondo", "Ife", "Akure", "Idanre", "Owena", "Ilesa", "Calabar"]
+COUNTRIES = [("Nigeria", ["Ondo", "Akure", "Ife", "Ikom", "Calabar"]), ("Ghana", ["Kumasi", "Takoradi"])]
+GENDERS = ["Male", "Female", "Other"]
+
+BAG_CAPACITY_KG = 63
+BATCH_CAPACITY_KG = 60000
+INSERT_CHUNK = 50_000
+
+
+def default_counts(sacks):
+    """Entity counts for a database with the given number of sacks."""
+    return {
+        "farmers":        max(10, sacks // 20),
+        "sacks":          sacks,
+        "bagged_ratio":   0.9,   # share of sacks already packed into bags
+        "batched_ratio":  0.8,   # share of bags already packed into batches
+        "warranted_ratio": 0.7,  # share of bags covered by a pre-processing warrant
+        "bundle_size":    200,   # sacks per bundle
+        "bundled_ratio":  0.5,   # share of warranted sacks already bundled
+        "lenders":        max(5, sacks // 2000),
+        "tips":           max(10, sacks // 100),
+        "invoiced_ratio": 0.2,   # share of batches covered by an invoice
+    }
+
+
+def _executemany(cursor, sql, rows):
+    for i in range(0, len(rows), INSERT_CHUNK):
+        cursor.executemany(sql, rows[i:i + INSERT_CHUNK])
+
+
+def _gen_id(rng, prefix):
+    return f"{prefix}_{rng.getrandbits(128):032x}"
+
+
+def generate_database(path, sacks=10_000, seed=0, **overrides):
+    """
+    Builds a fresh EcoWise database at `path` populated with synthetic
+    farmers, sacks, bags, batches, warrants, bundles, lenders, tips and
+    invoices. The same (sacks, seed, overrides) always produces the same data.
+    Returns the entity counts that were written.
+    """
+    counts = default_counts(sacks)
+    counts.update(overrides)
+    rng = random.Random(seed)
+
+    if os.path.exists(path):
+        os.remove(path)
+    old_path = db.DB_PATH
+    db.DB_PATH = path
+    try:
+        db.create_tables()
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA synchronous = OFF")
+        cursor.execute("PRAGMA journal_mode = MEMORY")
+
+        start = datetime(2023, 1, 1)
+        days = 730
+
+        def ts(offset_days, seconds=0):
+            return (start + timedelta(days=offset_days, seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+        # Farmers
+        farmers = []
+        for i in range(counts["farmers"]):
+            country, cities = rng.choice(COUNTRIES)
+            farmers.append((
+                _gen_id(rng, "farmer"), f"First{i}", f"Last{i}", f"farmer{i}@example.com",
+                country, rng.choice(cities), rng.choice(GENDERS), f"+234{rng.randrange(10**9):09d}",
+                ts(rng.randrange(30)),
+            ))
+        _executemany(cursor, """
+            INSERT INTO farmers (id, first_name, last_name, email, country, city, gender, phone_number, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, farmers)
+        farmer_ids = [f[0] for f in farmers]
+
+        # Sacks + their debt tokens, in delivery order
+        sack_rows = []
+        for i in range(counts["sacks"]):
+            weight = round(rng.uniform(20, 70), 1)
+            delivered = ts(30 + (i * days) // max(1, counts["sacks"]), rng.randrange(36000))
+            sack_rows.append((
+                _gen_id(rng, "sack"), rng.choice(farmer_ids), weight,
+                round(weight * rng.uniform(2500, 3500), 2), delivered, rng.choice(WAREHOUSES),
+            ))
+        sack_rows.sort(key=lambda r: (r[4], r[0]))
+        _executemany(cursor, """
+            INSERT INTO sacks (id, farmer_id, weight_kg, value_paid, delivered_at, warehouse, debt_token_minted)
+            VALUES (?, ?, ?, ?, ?, ?, 1)
+        """, sack_rows)
+        _executemany(cursor, """
+            INSERT INTO tokens (farmer_id, token_type, amount, created_at, description)
+            VALUES (?, 'debt', ?, ?, ?)
+        """, [(r[1], r[3], r[4], f"Debt token minted for sack {r[0]}") for r in sack_rows])
+
+        # Bags: greedy 63 kg packing of the oldest share of sacks
+        bagged = sack_rows[:int(len(sack_rows) * counts["bagged_ratio"])]
+        bags, bag_sacks, bag_weight = [], [], {}
+        current, current_kg = None, 0.0
+        for sack_id, _, weight, _, delivered, _ in bagged:
+            remaining = weight
+            while remaining > 0:
+                if current is None or current_kg >= BAG_CAPACITY_KG:
+                    current, current_kg = _gen_id(rng, "bag"), 0.0
+                    bags.append((current, delivered))
+                    bag_weight[current] = 0.0
+                portion = min(BAG_CAPACITY_KG - current_kg, remaining)
+                bag_sacks.append((current, sack_id, portion))
+                current_kg += portion
+                bag_weight[current] += portion
+                remaining -= portion
+        _executemany(cursor, "INSERT INTO bags (id, created_at) VALUES (?, ?)", bags)
+        _executemany(cursor, """
+            INSERT INTO bag_sacks (bag_id, sack_id, allocated_weight_kg) VALUES (?, ?, ?)
+        """, bag_sacks)
+
+        # Batches: 60 MT batches from the oldest share of bags
+        batched = bags[:int(len(bags) * counts["batched_ratio"])]
+        batches, batch_bags = [], []
+        current, current_kg = None, 0.0
+        for bag_id, created in batched:
+            kg = bag_weight[bag_id]
+            if current is None or current_kg + kg > BATCH_CAPACITY_KG:
+                if current is not None:
+                    batches[-1] = (current, current_kg / 1000.0, batches[-1][2], batches[-1][3])
+                current, current_kg = _gen_id(rng, "batch"), 0.0
+                batches.append((current, 0.0, rng.choice(["liquor", "butter", "powder"]), created))
+            batch_bags.append((current, bag_id))
+            current_kg += kg
+        if current is not None:
+            batches[-1] = (current, current_kg / 1000.0, batches[-1][2], batches[-1][3])
+        _executemany(cursor, """
+            INSERT INTO batches (id, weight_mt, product_type, created_at) VALUES (?, ?, ?, ?)
+        """, batches)
+        _executemany(cursor, "INSERT INTO batch_bags (batch_id, bag_id) VALUES (?, ?)", batch_bags)
+
+        # Pre-processing warrants over the oldest share of bags, 500 bags per receipt
+        warranted = [b[0] for b in bags[:int(len(bags) * counts["warranted_ratio"])]]
+        receipts = []
+        for i in range(0, len(warranted), 500):
+            chunk = warranted[i:i + 500]
+            receipts.append((_gen_id(rng, "warrant"), "pre-processing", json.dumps(chunk), 0.0))
+        _executemany(cursor, """
+            INSERT INTO warrant_receipts (id, type, covered_ids, total_value) VALUES (?, ?, ?, ?)
+        """, receipts)
+
+        # Lenders
+        lenders = [
+            (_gen_id(rng, "lender"), f"0x{rng.getrandbits(160):040x}", round(rng.uniform(1e6, 5e7), 2), ts(rng.randrange(60)))
+            for _ in range(counts["lenders"])
+        ]
+        _executemany(cursor, """
+            INSERT INTO lenders (id, wallet_address, position, created_at) VALUES (?, ?, ?, ?)
+        """, lenders)
+
+        # Bundles over warranted sacks, roughly two-thirds of them funded
+        warranted_set = set(warranted)
+        sack_value = {r[0]: r[3] for r in sack_rows}
+        seen, warranted_sacks = set(), []
+        for bag_id, sack_id, _ in bag_sacks:
+            if bag_id in warranted_set and sack_id not in seen:
+                seen.add(sack_id)
+                warranted_sacks.append(sack_id)
+        to_bundle = warranted_sacks[:int(len(warranted_sacks) * counts["bundled_ratio"])]
+        bundles, bundle_sacks, bundle_lenders = [], [], []
+        for i in range(0, len(to_bundle), counts["bundle_size"]):
+            bundle_id = _gen_id(rng, "bundle")
+            members = to_bundle[i:i + counts["bundle_size"]]
+            total = sum(sack_value[s] for s in members)
+            funded = rng.random() < 0.66
+            bundles.append((bundle_id, "None", "", round(rng.uniform(5, 20), 1),
+                            "funded" if funded else "unfunded", ts(60 + i * days // max(1, len(to_bundle)))))
+            bundle_sacks.extend((bundle_id, s) for s in members)
+            if funded and lenders:
+                for lender in rng.sample(lenders, min(2, len(lenders))):
+                    bundle_lenders.append((bundle_id, lender[0], round(total / 2, 2)))
+        _executemany(cursor, """
+            INSERT INTO bundles (id, filter_type, filter_value, interest_rate, status, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, bundles)
+        _executemany(cursor, "INSERT INTO bundle_sacks (bundle_id, sack_id) VALUES (?, ?)", bundle_sacks)
+        _executemany(cursor, """
+            INSERT INTO bundle_lenders (bundle_id, lender_id, amount) VALUES (?, ?, ?)
+        """, bundle_lenders)
+
+        # Tips and their internal tokens
+        tips = []
+        for _ in range(counts["tips"]):
+            tips.append((_gen_id(rng, "tip"), rng.choice(farmer_ids), round(rng.uniform(100, 5000), 2), ts(rng.randrange(days))))
+        _executemany(cursor, "INSERT INTO tips (id, farmer_id, amount, created_at) VALUES (?, ?, ?, ?)", tips)
+        _executemany(cursor, """
+            INSERT INTO tokens (farmer_id, token_type, amount, created_at, description)
+            VALUES (?, 'internal', ?, ?, ?)
+        """, [(t[1], t[2], t[3], f"Tip {t[0]}: Farmer tip") for t in tips])
+
+        conn.commit()
+        cursor.execute("PRAGMA journal_mode = WAL").fetchall()  # back to what the app runs on
+        conn.close()
+
+        # Closure table is derived, so build it the same way the app would
+        db.rebuild_sack_lineage()
+
+        # Invoices go through the real settlement path so tokens/positions move too
+        invoiced = batches[:int(len(batches) * counts["invoiced_ratio"])]
+        for batch_id, weight_mt, _, _ in invoiced:
+            db.create_invoice([batch_id], round(weight_mt * 1000 * 3200, 2), rng.choice([0, 25, 50, 75]))
+    finally:
+        db.DB_PATH = old_path
+
+    written = {
+        "farmers": len(farmers), "sacks": len(sack_rows), "bags": len(bags),
+        "bag_sacks": len(bag_sacks), "batches": len(batches), "warrant_receipts": len(receipts),
+        "lenders": len(lenders), "bundles": len(bundles), "bundle_sacks": len(bundle_sacks),
+        "tips": len(tips), "invoices": len(invoiced),
+    }
+    return written
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic EcoWise database.")
+    parser.add_argument("path")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="10k")
+    parser.add_argument("--sacks", type=int, help="Overrides --scale")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    n = args.sacks or SCALES[args.scale]
+    print(json.dumps(generate_database(args.path, sacks=n, seed=args.seed), indent=2))
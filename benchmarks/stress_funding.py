@@ -0,0 +1,229 @@
+# benchmarks/stress_funding.py
+#
+# Concurrency stress test for the money-moving writes. Builds a fresh database
+# (farmers, sacks, bags, two batches, bundles, lenders), then hammers it from
+# many threads at once with:
+#   - fund_bundle on random open bundles, including repeat fundings of the
+#     same lender/bundle pair
+#   - lender top-ups through update_lender_position(expected_position=...),
+#     re-read and retried when another session got there first
+#   - bulk plans applied with fund_bundles
+#   - the same invoice batch settled by several threads at the same moment
+# and afterwards checks that no money was created or lost:
+#   - no lender position went negative, no bundle holds more than its value
+#   - every open bundle's status matches what it holds
+#   - sum(positions) == start + top-ups - new fundings + one repayment, i.e.
+#     the invoiced bundles' lenders were repaid exactly once
+#   - no "database is locked" error reached a caller
+#
+#   python -m benchmarks.stress_funding --threads 16 --ops 300
+#   python -m benchmarks.stress_funding --group-commit   # through the group-commit writer
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+from collections import Counter
+
+from database import db
+from database.allocation import FUNDING_RULES
+
+# Money is REAL; totals over thousands of writes are compared to the kobo
+# times the number of writes
+TOLERANCE_PER_WRITE = 0.01
+
+
+def build(path, sacks, seed):
+    """Fresh database; returns (invoice_batch_id, open_bundle_ids)."""
+    rng = random.Random(seed)
+    db.DB_PATH = path
+    db.create_tables()
+    farmer_ids = db.create_farmers([
+        {"first_name": f"Stress{i}", "last_name": "Farmer", "country": "Ghana", "gender": rng.choice(["Male", "Female"])}
+        for i in range(40)
+    ])
+    deliveries = []
+    for _ in range(sacks):
+        weight = round(rng.uniform(30, 60), 1)
+        deliveries.append({"farmer_id": rng.choice(farmer_ids), "weight_kg": weight,
+                           "value_paid": round(weight * 3000, 2), "warehouse": "Stress"})
+    db.create_sacks_and_mint_tokens(deliveries)
+    db.auto_fill_bags()
+    bag_ids = [b[0] for b in db.get_all_bags()]
+    db.create_warrant_receipt("pre-processing", bag_ids)
+
+    # The invoice batch's bundles are funded in full before the run, so the
+    # hammering threads cannot change who gets repaid
+    split = max(1, len(bag_ids) // 8)
+    invoice_batch = db.create_batch_with_bags(bag_ids[:split], "liquor")
+    db.create_batch_with_bags(bag_ids[split:], "liquor")
+    invoice_sacks = set(db.get_sacks_for_batch(invoice_batch)["sack_id"])
+    eligible = db.get_eligible_sacks_for_bundling()["id"].tolist()
+    closed = [s for s in eligible if s in invoice_sacks]
+    open_ = [s for s in eligible if s not in invoice_sacks]
+    closed_ids = db.create_bundles(None, None, 10.0, [closed[i:i + 30] for i in range(0, len(closed), 30)])
+    open_ids = db.create_bundles(None, None, 8.0, [open_[i:i + 30] for i in range(0, len(open_), 30)])
+
+    for i in range(20):
+        db.create_lender(f"stress_wallet_{i}", round(rng.uniform(2e6, 8e6), 2))
+    db.fund_bundles(db.plan_bundle_funding("oldest_first", bundle_ids=closed_ids))
+    return invoice_batch, open_ids
+
+
+def _positions(path):
+    conn = sqlite3.connect(path)
+    rows = dict(conn.execute("SELECT id, position FROM lenders").fetchall())
+    funded = conn.execute("SELECT COALESCE(SUM(amount), 0), COUNT(*) FROM bundle_lenders").fetchone()
+    conn.close()
+    return rows, funded
+
+
+def hammer(path, invoice_batch, open_ids, threads, ops, invoicers, seed):
+    lender_ids = list(_positions(path)[0])
+    counts = Counter()
+    topups = [0.0] * threads
+    errors = []
+    start = threading.Barrier(threads + invoicers)
+    lock = threading.Lock()
+
+    def count(key):
+        with lock:
+            counts[key] += 1
+
+    def worker(n):
+        rng = random.Random(seed * 1000 + n)
+        start.wait()
+        for _ in range(ops):
+            roll = rng.random()
+            try:
+                if roll < 0.6:
+                    db.fund_bundle(rng.choice(lender_ids), rng.choice(open_ids), round(rng.uniform(100, 60000), 2))
+                    count("fund_bundle")
+                elif roll < 0.9:
+                    lender_id = rng.choice(lender_ids)
+                    delta = round(rng.uniform(1000, 50000), 2)
+                    for attempt in range(10):
+                        current = _positions(path)[0][lender_id]
+                        try:
+                            db.update_lender_position(lender_id, current + delta, expected_position=current)
+                        except ValueError:
+                            count("position_conflicts")
+                            continue
+                        topups[n] += delta
+                        count("top_up")
+                        break
+                else:
+                    subset = rng.sample(open_ids, min(len(open_ids), 5))
+                    db.fund_bundles(db.plan_bundle_funding(rng.choice(list(FUNDING_RULES)), bundle_ids=subset))
+                    count("fund_bundles")
+            except ValueError:
+                count("rejected")
+            except Exception as e:  # anything else (e.g. database is locked) is a failure
+                errors.append(repr(e))
+
+    def invoicer():
+        start.wait()
+        try:
+            db.create_invoice([invoice_batch], 1e9, 50)
+            count("invoice")
+        except Exception as e:
+            errors.append(repr(e))
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    pool += [threading.Thread(target=invoicer) for _ in range(invoicers)]
+    t0 = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return time.perf_counter() - t0, counts, sum(topups), errors
+
+
+def check(path, start_total, start_funded, topups, repayment, writes):
+    positions, (funded, rows) = _positions(path)
+    tolerance = TOLERANCE_PER_WRITE * max(1, writes)
+    failures = []
+    negative = {l: p for l, p in positions.items() if p < -db.FUNDING_EPS}
+    if negative:
+        failures.append(f"negative positions: {negative}")
+
+    expected = start_total + topups - (funded - start_funded) + repayment
+    actual = sum(positions.values())
+    if abs(actual - expected) > tolerance:
+        failures.append(f"sum(positions) {actual:,.2f} != expected {expected:,.2f} "
+                        f"(off by {actual - expected:,.2f}; one repayment is {repayment:,.2f})")
+
+    bundles = db.get_all_bundles_with_details()
+    over = bundles[bundles["funded_amount"] > bundles["total_bundle_value"] + db.FUNDING_EPS]
+    if len(over):
+        failures.append(f"{len(over)} bundle(s) funded past their value")
+    open_ = bundles[bundles["status"] != "paid"]
+    wrong = open_[open_["status"] != open_["calculated_status"]]
+    if len(wrong):
+        failures.append(f"{len(wrong)} bundle(s) with a stale status, e.g. {wrong.iloc[0].to_dict()}")
+    return failures, {"funding_rows": rows, "sum_positions": round(actual, 2), "expected": round(expected, 2)}
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Hammer funding, position updates and invoices from many threads.")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=200, help="Operations per thread")
+    parser.add_argument("--invoicers", type=int, default=4, help="Threads settling the same invoice batch at once")
+    parser.add_argument("--sacks", type=int, default=3000)
+    parser.add_argument("--group-commit", action="store_true", help="Route write ops through the group-commit writer")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Write results as JSON")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="ecowise-stress-")
+    path = os.path.join(workdir, "stress.db")
+    old_path = db.DB_PATH
+    try:
+        invoice_batch, open_ids = build(path, args.sacks, args.seed)
+        positions, (start_funded, _) = _positions(path)
+        start_total = sum(positions.values())
+        preview = db.simulate_invoice([invoice_batch], 1e9, 50)
+        repayment = float(preview.loc[preview["role"] == "lender", "received"].sum())
+
+        if args.group_commit:
+            db.start_group_commit()
+        elapsed, counts, topups, errors = hammer(
+            path, invoice_batch, open_ids, args.threads, args.ops, args.invoicers, args.seed
+        )
+        if args.group_commit:
+            db.stop_group_commit()
+
+        writes = sum(counts.values())
+        failures, totals = check(path, start_total, start_funded, topups, repayment, writes)
+        failures += [f"{len(errors)} unexpected error(s), e.g. {errors[0]}"] if errors else []
+        result = {
+            "threads": args.threads,
+            "ops_per_thread": args.ops,
+            "group_commit": args.group_commit,
+            "elapsed_s": round(elapsed, 3),
+            "ops_per_s": round(args.threads * args.ops / elapsed),
+            "counts": dict(counts),
+            **totals,
+            "failures": failures,
+        }
+    finally:
+        db.stop_group_commit()
+        db.DB_PATH = old_path
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(result, indent=2), file=sys.stderr)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    return 1 if result["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
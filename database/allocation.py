@@ -0,0 +1,474 @@
+# database/allocation.py
+#
+# Pure packing, funding and settlement algorithms behind auto_fill_bags,
+# auto_fill_batches, bundle funding and create_invoice. Nothing in here touches the database, so alternative
+# implementations can be benchmarked and checked against these in isolation.
+
+import math
+
+import numpy as np
+from bisect import bisect_left, insort
+
+BAG_CAPACITY_KG = 63
+BATCH_CAPACITY_KG = 60000
+
+
+def group_sacks_for_bagging(sacks):
+    """
+    Groups (sack_id, weight_kg, warehouse, delivery_date) rows by
+    (warehouse, delivery_date), keeping each group's input order.
+    Returns {(warehouse, date): [(sack_id, weight_kg), ...]}.
+    """
+    grouped = {}
+    for sack_id, weight, warehouse, date in sacks:
+        grouped.setdefault((warehouse, date), []).append((sack_id, weight))
+    return grouped
+
+
+def pack_sacks_into_bags(sacks, capacity=BAG_CAPACITY_KG):
+    """
+    Greedily fills bags in input order, splitting a sack across bags when it
+    does not fit in the space left.
+    sacks: iterable of (sack_id, weight_kg)
+    Returns a list of bags, each a list of (sack_id, allocated_weight_kg).
+    """
+    bags = []
+    allocations = []
+    current_weight = 0
+
+    for sack_id, weight in sacks:
+        remaining = weight
+        while remaining > 0:
+            space_left = capacity - current_weight
+            if space_left <= 0:
+                if allocations:
+                    bags.append(allocations)
+                allocations = []
+                current_weight = 0
+                space_left = capacity
+            portion = min(space_left, remaining)
+            allocations.append((sack_id, portion))
+            current_weight += portion
+            remaining -= portion
+
+    if allocations:
+        bags.append(allocations)
+    return bags
+
+
+
+# Slack for floating point weights when deciding whether a piece fits
+PACK_EPS = 1e-9
+
+
+def pack_sacks_best_fit(sacks, capacity=BAG_CAPACITY_KG):
+    """
+    Best-fit-decreasing packing that splits as few sacks as possible while
+    still using the minimum number of bags, ceil(total / capacity), the same
+    as pack_sacks_into_bags:
+      1. A sack heavier than a bag fills whole bags on its own; only its
+         remainder is packed with other sacks.
+      2. Sacks (and remainders) go in heaviest first, each whole into the
+         open bag it fills most tightly, or a new bag if none has room.
+      3. While that leaves more bags than the minimum, the lightest bag is
+         emptied into the others: each piece whole into the tightest bag it
+         fits, otherwise split across the bags with the most room.
+    sacks: iterable of (sack_id, weight_kg)
+    Returns a list of bags, each a list of (sack_id, allocated_weight_kg).
+    """
+    bags = []   # {sack_id: kg}, or None once emptied in step 3
+    loads = []
+    free = []   # sorted (space_left, bag_index) for bags with room
+    items = []
+    total = 0.0
+
+    def new_bag():
+        bags.append({})
+        loads.append(0.0)
+        return len(bags) - 1
+
+    def put(b, sack_id, kg):
+        bags[b][sack_id] = bags[b].get(sack_id, 0.0) + kg
+        loads[b] += kg
+        if capacity - loads[b] > PACK_EPS:
+            insort(free, (capacity - loads[b], b))
+
+    for sack_id, weight in sacks:
+        total += weight
+        while weight > capacity + PACK_EPS:
+            put(new_bag(), sack_id, capacity)
+            weight -= capacity
+        if weight > PACK_EPS:
+            items.append((weight, sack_id))
+
+    items.sort(key=lambda item: item[0], reverse=True)
+    for weight, sack_id in items:
+        i = bisect_left(free, (weight - PACK_EPS, -1))
+        b = free.pop(i)[1] if i < len(free) else new_bag()
+        put(b, sack_id, weight)
+
+    target = max(1, math.ceil(total / capacity - PACK_EPS)) if total > 0 else 0
+    open_bags = len(bags)
+    overflowed = False
+    while open_bags > target and free and not overflowed:
+        _, lightest = free.pop()
+        pieces = sorted(bags[lightest].items(), key=lambda p: p[1], reverse=True)
+        bags[lightest] = None
+        open_bags -= 1
+        for sack_id, kg in pieces:
+            i = bisect_left(free, (kg - PACK_EPS, -1))
+            if i < len(free):
+                put(free.pop(i)[1], sack_id, kg)
+                continue
+            while kg > PACK_EPS and free:
+                space, b = free.pop()
+                portion = min(space, kg)
+                put(b, sack_id, portion)
+                kg -= portion
+            if kg > PACK_EPS:
+                # Rounding left no room anywhere; the rest gets its own bag
+                put(new_bag(), sack_id, kg)
+                open_bags += 1
+                overflowed = True
+
+    return [list(bag.items()) for bag in bags if bag]
+
+
+BAG_PACKING_MODES = {
+    "greedy": pack_sacks_into_bags,
+    "best_fit": pack_sacks_best_fit,
+}
+
+
+def bag_packing_stats(bags, capacity=BAG_CAPACITY_KG):
+    """
+    Summary of a packing (a list of bags of (sack_id, kg)): bags, sacks,
+    bag_sack_rows, split_sacks (sacks spread over more than one bag), and
+    avg_fill / min_fill as fractions of capacity.
+    """
+    bags_per_sack = {}
+    fills = []
+    rows = 0
+    for bag in bags:
+        fills.append(sum(kg for _, kg in bag) / capacity)
+        rows += len(bag)
+        for sack_id, _ in bag:
+            bags_per_sack[sack_id] = bags_per_sack.get(sack_id, 0) + 1
+    return {
+        "bags": len(bags),
+        "sacks": len(bags_per_sack),
+        "bag_sack_rows": rows,
+        "split_sacks": sum(1 for n in bags_per_sack.values() if n > 1),
+        "avg_fill": sum(fills) / len(fills) if fills else 0.0,
+        "min_fill": min(fills) if fills else 0.0,
+    }
+
+def pack_bags_into_batches(bags, capacity=BATCH_CAPACITY_KG):
+    """
+    Fills batches with bags in input order, closing a batch whenever the next
+    bag would overflow it. A bag heavier than a whole batch gets its own batch.
+    bags: iterable of (bag_id, weight_kg)
+    Returns a list of batches, each a list of bag_ids.
+    """
+    batches = []
+    current_batch = []
+    current_kg = 0
+
+    for bag_id, kg in bags:
+        if current_kg + kg > capacity:
+            if current_batch:
+                batches.append(current_batch)
+            current_batch = []
+            current_kg = 0
+        if kg > capacity:
+            batches.append([bag_id])
+            continue
+        current_batch.append(bag_id)
+        current_kg += kg
+
+    if current_batch:
+        batches.append(current_batch)
+    return batches
+
+
+
+def pack_bags_ffd(bags, capacity=BATCH_CAPACITY_KG):
+    """
+    First-fit-decreasing batching over a NumPy weight array. Bags are taken
+    heaviest first and each goes into the first batch with room, so a batch
+    is filled by the longest run of the sorted bags that fits, then topped
+    up with the next lighter bags that still fit its gap. Batches are built
+    one at a time with vectorised cumsum / searchsorted scans, which gives
+    exactly the FFD result. A bag heavier than a whole batch gets its own.
+    bags: iterable of (bag_id, weight_kg)
+    Returns a list of batches, each a list of bag_ids.
+    """
+    bags = list(bags)
+    if not bags:
+        return []
+    ids = np.array([b[0] for b in bags], dtype=object)
+    weights = np.array([b[1] or 0.0 for b in bags], dtype=float)
+
+    oversize = weights > capacity
+    batches = [[bag_id] for bag_id in ids[oversize]]
+    # Positions into ids of the bags still to place, heaviest first
+    positions = np.flatnonzero(~oversize)
+    positions = positions[np.argsort(-weights[positions], kind="stable")]
+    weights = weights[positions]
+
+    while len(weights):
+        cumulative = np.cumsum(weights)
+        prefix = int(np.searchsorted(cumulative, capacity + PACK_EPS, side="right"))
+        room = capacity - cumulative[prefix - 1]
+        # Top up: the next bag (in descending order) that fits the gap, repeatedly
+        ascending = -weights
+        extra = []
+        i = prefix
+        while i < len(weights):
+            j = i + int(np.searchsorted(ascending[i:], -room - PACK_EPS, side="left"))
+            if j >= len(weights):
+                break
+            extra.append(j)
+            room -= weights[j]
+            i = j + 1
+        taken = np.concatenate((np.arange(prefix), np.array(extra, dtype=int)))
+        batches.append(ids[positions[taken]].tolist())
+        keep = np.ones(len(weights), dtype=bool)
+        keep[taken] = False
+        positions, weights = positions[keep], weights[keep]
+    return batches
+
+
+def select_target_value(values, target, max_swaps=4):
+    """
+    Approximate subset sum over a NumPy array: picks items whose values add
+    up as close to target as it can without going over.
+      1. Highest value first, take the longest run that stays within target
+         (cumsum + searchsorted), then keep adding the largest remaining
+         item that still fits the gap.
+      2. While that leaves a gap, try the single swap (one chosen item out,
+         one unchosen in) that closes the most of it, for every
+         chosen item at once with searchsorted; repeat up to max_swaps times.
+    values: 1-D array-like of non-negative item values
+    Returns (indices into values of the chosen items, their total).
+    """
+    values = np.asarray(values, dtype=float)
+    if not len(values) or target <= 0:
+        return np.array([], dtype=int), 0.0
+    order = np.argsort(-values, kind="stable")
+    ranked = values[order]
+
+    cumulative = np.cumsum(ranked)
+    prefix = int(np.searchsorted(cumulative, target + PACK_EPS, side="right"))
+    chosen = np.zeros(len(ranked), dtype=bool)
+    chosen[:prefix] = True
+    room = target - (cumulative[prefix - 1] if prefix else 0.0)
+    ascending = -ranked
+    i = prefix
+    while i < len(ranked):
+        j = i + int(np.searchsorted(ascending[i:], -room - PACK_EPS, side="left"))
+        if j >= len(ranked):
+            break
+        chosen[j] = True
+        room -= ranked[j]
+        i = j + 1
+
+    for _ in range(max_swaps):
+        if room <= PACK_EPS or chosen.all() or not chosen.any():
+            break
+        inside = np.flatnonzero(chosen)
+        outside = np.flatnonzero(~chosen)
+        # outside values ascending, so the best partner for each chosen item
+        # (largest value within that item + room, so the total never passes
+        # target) is found by binary search
+        out_order = np.argsort(ranked[outside], kind="stable")
+        out_values = ranked[outside][out_order]
+        wanted = ranked[inside] + room
+        pick = np.searchsorted(out_values, wanted + PACK_EPS, side="right") - 1
+        errors = np.where(pick >= 0, wanted - out_values[np.maximum(pick, 0)], np.inf)
+        best = int(np.argmin(errors))
+        if errors[best] >= room - PACK_EPS:
+            break
+        swap_in = outside[out_order[pick[best]]]
+        swap_out = inside[best]
+        chosen[swap_out] = False
+        chosen[swap_in] = True
+        room -= ranked[swap_in] - ranked[swap_out]
+
+    picked = order[chosen]
+    return picked, float(values[picked].sum())
+
+FUNDING_RULES = {
+    "pro_rata":          "Pro rata (every lender in every bundle)",
+    "interest_priority": "Highest interest rate first",
+    "oldest_first":      "Oldest bundle first",
+}
+
+
+def _to_kobo(amounts):
+    # Whole kobo, never rounding a position up past what is really there
+    return np.floor(np.round(np.maximum(np.asarray(amounts, dtype=float), 0.0) * 100, 4)).astype(np.int64)
+
+
+def allocate_funding(lenders, bundles, rule="pro_rata"):
+    """
+    Spreads lenders' available positions over bundles' unfunded amounts.
+      pro_rata           every bundle is filled to the same fraction of its
+                         need, and every lender takes a share of every bundle
+                         in proportion to its position (one row per pair)
+      interest_priority  bundles with the highest interest rate are funded in
+                         full first (ties keep the given order)
+      oldest_first       bundles are funded in full in the order given, which
+                         the caller makes oldest first
+    Under the priority rules lenders are drawn largest position first and
+    laid end to end against the bundles' needs (north-west corner), so each
+    bundle is split across as few lenders as possible: at most
+    len(lenders) + len(bundles) - 1 rows.
+    Amounts are worked in whole kobo and rounded down, so no lender is asked
+    for more than it has nor a bundle given more than it needs.
+    lenders: [(lender_id, available)]
+    bundles: [(bundle_id, need, interest_rate)]
+    Returns [(lender_id, bundle_id, amount)].
+    """
+    if rule not in FUNDING_RULES:
+        raise ValueError(f"Unknown funding rule '{rule}', expected one of {sorted(FUNDING_RULES)}")
+    if not lenders or not bundles:
+        return []
+    lender_ids = [l for l, _ in lenders]
+    bundle_ids = [b for b, _, _ in bundles]
+    supply = _to_kobo([a for _, a in lenders])
+    demand = _to_kobo([n for _, n, _ in bundles])
+    available, needed = int(supply.sum()), int(demand.sum())
+    if not available or not needed:
+        return []
+    total = min(available, needed)
+
+    if rule == "pro_rata":
+        # What each bundle gets (exact integer maths: kobo products overflow int64)
+        targets = np.array([d * total // needed for d in demand.tolist()], dtype=np.int64)
+        # Lender l's share of bundle b is target_b * supply_l / available, nudged
+        # down so float error can never round a kobo up
+        shares = np.floor(np.outer(supply.astype(float), targets) * (1 / available * (1 - 1e-12))).astype(np.int64)
+        # Hand the kobo lost to rounding back out, from the lenders with the
+        # most left, so a bundle that can be funded in full is not left short
+        slack = supply - shares.sum(axis=1)
+        short = targets - shares.sum(axis=0)
+        for b in np.flatnonzero(short > 0).tolist():
+            while short[b] > 0 and slack.max() > 0:
+                l = int(np.argmax(slack))
+                give = min(int(short[b]), int(slack[l]))
+                shares[l, b] += give
+                slack[l] -= give
+                short[b] -= give
+        lender_at, bundle_at = np.nonzero(shares)
+        amounts = shares[lender_at, bundle_at]
+    else:
+        lender_order = np.argsort(-supply, kind="stable")
+        bundle_order = np.arange(len(bundles))
+        if rule == "interest_priority":
+            bundle_order = np.argsort(-np.array([r for _, _, r in bundles], dtype=float), kind="stable")
+        supply_ends = np.minimum(np.cumsum(supply[lender_order]), total)
+        demand_ends = np.minimum(np.cumsum(demand[bundle_order]), total)
+        ends = np.union1d(supply_ends, demand_ends)
+        starts = np.concatenate(([0], ends[:-1]))
+        amounts = ends - starts
+        keep = amounts > 0
+        starts, amounts = starts[keep], amounts[keep]
+        lender_at = lender_order[np.searchsorted(supply_ends, starts, side="right")]
+        bundle_at = bundle_order[np.searchsorted(demand_ends, starts, side="right")]
+    return [
+        (lender_ids[l], bundle_ids[b], a / 100)
+        for l, b, a in zip(lender_at.tolist(), bundle_at.tolist(), amounts.tolist())
+    ]
+
+def settle_invoice(batches, amount_paid, percent_to_farmers):
+    """
+    Splits an invoice payment across batches in order, then within each batch:
+      - burns farmers' debt pro rata to the value they contributed,
+      - repays lenders principal + interest pro rata to what they lent,
+      - shares whatever is left between farmers (percent_to_farmers, 0-100)
+        and EcoWise.
+
+    batches: list of dicts with
+        batch_id
+        farmer_values: {farmer_id: allocated_value}
+        lenders:       [{"lender_id", "principal", "interest_rate"}, ...]
+
+    Returns a list with one dict per batch that received money:
+        batch_id, allocated, burns {farmer_id: amount},
+        lender_payments {lender_id: amount}, bonuses {farmer_id: amount},
+        to_ecowise
+    """
+    settlement = []
+    remaining = amount_paid
+
+    for batch in batches:
+        if remaining <= 0:
+            break
+
+        farmer_values = batch["farmer_values"]
+        batch_value = sum(farmer_values.values())
+
+        allocate = min(remaining, batch_value)
+        remaining -= allocate
+
+        burns = {}
+        if batch_value > 0:
+            for farmer_id, farmer_value in farmer_values.items():
+                burns[farmer_id] = allocate * (farmer_value / batch_value)
+
+        lenders = batch["lenders"]
+        total_principal = sum(l["principal"] for l in lenders)
+        lender_payments = {}
+        paid_to_lenders = 0.0
+        if total_principal > 0:
+            for l in lenders:
+                frac = l["principal"] / total_principal
+                pay_principal = allocate * frac
+                pay_interest = pay_principal * l["interest_rate"] / 100.0
+                pay_total = pay_principal + pay_interest
+                lender_payments[l["lender_id"]] = lender_payments.get(l["lender_id"], 0.0) + pay_total
+                paid_to_lenders += pay_total
+
+        remainder_after_lenders = allocate - paid_to_lenders
+        if remainder_after_lenders < 0:
+            remainder_after_lenders = 0
+
+        to_farmers = remainder_after_lenders * (percent_to_farmers / 100.0)
+        to_ecowise = remainder_after_lenders - to_farmers
+
+        bonuses = {}
+        if to_farmers > 0 and batch_value > 0:
+            for farmer_id, farmer_value in farmer_values.items():
+                bonuses[farmer_id] = to_farmers * (farmer_value / batch_value)
+
+        settlement.append({
+            "batch_id": batch["batch_id"],
+            "allocated": allocate,
+            "burns": burns,
+            "lender_payments": lender_payments,
+            "bonuses": bonuses,
+            "to_ecowise": to_ecowise,
+        })
+
+    return settlement
+
+
+def settlement_totals(settlement):
+    """
+    Sums a settle_invoice result across its batches. Returns a dict:
+        allocated        total spread over the batches
+        burns            {farmer_id: amount}
+        bonuses          {farmer_id: amount}
+        lender_payments  {lender_id: amount}
+        to_ecowise
+    """
+    totals = {"allocated": 0.0, "burns": {}, "bonuses": {}, "lender_payments": {}, "to_ecowise": 0.0}
+    for entry in settlement:
+        totals["allocated"] += entry["allocated"]
+        totals["to_ecowise"] += entry["to_ecowise"]
+        for key in ("burns", "bonuses", "lender_payments"):
+            target = totals[key]
+            for party_id, amount in entry[key].items():
+                target[party_id] = target.get(party_id, 0.0) + amount
+    return totals
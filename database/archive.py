@@ -0,0 +1,345 @@
+# database/archive.py
+#
+# Hot/cold archiving. Records that are closed and will never change again are
+# moved, one cocoa season at a time, out of the main database into an archive
+# database next to it (db.archive_path(), attached as `archive`):
+#
+#   bundles         paid bundles created in the season, with their bundle_lenders
+#   invoices        invoices created in the season (settled when recorded)
+#   tokens          token rows created in the season
+#
+# bundle_sacks and sack_lineage stay in the hot database: they are the per-sack
+# indexes that eligibility checks and lineage lookups walk, like bag_sacks.
+# What was moved is remembered in two small hot tables so nothing that reads
+# the hot tables alone goes wrong:
+#   archived_entities       archived bundle and invoice ids (an archived invoice
+#                           id is never re-applied; lineage can flag them)
+#   archived_token_totals   per-farmer token sums, so balances and the KPI
+#                           rebuild still count archived tokens
+# Listings take include_archive=True to union the archive back in
+# (db.get_all_tokens, get_all_invoices, get_bundles_for_sack, get_sack_lineage).
+#
+# A season is moved in two transactions: copy into the archive, then delete
+# from the hot tables only the rows the archive now holds. Under WAL a commit
+# spanning two database files is not atomic, so this order means an
+# interruption can only leave rows in both places, and re-running finishes it.
+# The deletes are not logged to the change feed: nothing was deleted, it moved.
+#
+# Freed pages are returned to the OS with PRAGMA incremental_vacuum in short
+# steps, so writers are never locked out for long.
+#
+#   python -m database.archive status
+#   python -m database.archive run [--season 2023/24] [--vacuum]
+#   python -m database.archive vacuum [--enable]
+
+import os
+import re
+from datetime import datetime
+
+from database import db
+from database.writer import run_immediate
+
+# The main cocoa crop season runs from October to September
+SEASON_START_MONTH = 10
+
+# Pages released per incremental_vacuum transaction
+VACUUM_STEP_PAGES = 2000
+
+ARCHIVED_TABLES = ["bundles", "bundle_lenders", "invoices", "tokens"]
+
+ARCHIVE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_tokens_farmer ON tokens (farmer_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_tokens_season ON tokens (season)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_bundles_season ON bundles (season)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_bundle_lenders_bundle ON bundle_lenders (bundle_id)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_bundle_lenders_season ON bundle_lenders (season)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_invoices_season ON invoices (season)",
+]
+
+_SEASON_RE = re.compile(r"^(\d{4})/(\d{2})$")
+
+
+def season_of(when):
+    """Season label ('2023/24') of a datetime or a 'YYYY-MM-DD[ HH:MM:SS]' string."""
+    if isinstance(when, str):
+        when = datetime.fromisoformat(when[:19])
+    year = when.year if when.month >= SEASON_START_MONTH else when.year - 1
+    return f"{year}/{(year + 1) % 100:02d}"
+
+
+def season_bounds(season):
+    """(start, end) timestamps of a season, end exclusive, in the format SQLite stores."""
+    m = _SEASON_RE.match(season or "")
+    if not m or (int(m.group(1)) + 1) % 100 != int(m.group(2)):
+        raise ValueError(f"Season must look like 2023/24, got {season!r}")
+    year = int(m.group(1))
+    return (
+        f"{year:04d}-{SEASON_START_MONTH:02d}-01 00:00:00",
+        f"{year + 1:04d}-{SEASON_START_MONTH:02d}-01 00:00:00",
+    )
+
+
+def _columns(cursor, schema, table):
+    cursor.execute(f"PRAGMA {schema}.table_info({table})")
+    return [(row[1], row[2], row[5]) for row in cursor.fetchall()]
+
+
+def _ensure_archive_schema(cursor):
+    """
+    Creates the archive tables from the hot tables' current columns plus a
+    season column, and adds any column the hot table has gained since.
+    """
+    for table in ARCHIVED_TABLES:
+        hot = _columns(cursor, "main", table)
+        existing = {name for name, _, _ in _columns(cursor, "archive", table)}
+        if not existing:
+            cols = ", ".join(f"{name} {decl}" for name, decl, _ in hot)
+            pk = ", ".join(name for name, _, pk in sorted(hot, key=lambda c: c[2]) if pk)
+            cursor.execute(f"CREATE TABLE archive.{table} ({cols}, season TEXT NOT NULL, PRIMARY KEY ({pk}))")
+            continue
+        for name, decl, _ in hot:
+            if name not in existing:
+                cursor.execute(f"ALTER TABLE archive.{table} ADD COLUMN {name} {decl}")
+    for index_sql in ARCHIVE_INDEXES:
+        cursor.execute(index_sql)
+
+
+def _connect():
+    """Write connection to the main database with the archive attached (created if missing)."""
+    conn = db.get_connection()
+    new = not os.path.exists(db.archive_path())
+    conn.execute("ATTACH DATABASE ? AS archive", (db.archive_path(),))
+    if new:
+        conn.execute("PRAGMA archive.auto_vacuum = INCREMENTAL").fetchall()
+        conn.execute("PRAGMA archive.journal_mode = WAL").fetchall()
+    cursor = conn.cursor()
+    _ensure_archive_schema(cursor)
+    conn.commit()
+    return conn
+
+
+# Rows of each archived table that belong to a season, as (FROM ... WHERE, params
+# after the season bounds)
+_SEASON_ROWS = {
+    "bundles": "main.bundles t WHERE t.status = 'paid' AND t.created_at >= ? AND t.created_at < ?",
+    "bundle_lenders": """main.bundle_lenders t
+        JOIN main.bundles b ON b.id = t.bundle_id
+        WHERE b.status = 'paid' AND b.created_at >= ? AND b.created_at < ?""",
+    "invoices": "main.invoices t WHERE t.created_at >= ? AND t.created_at < ?",
+    "tokens": "main.tokens t WHERE t.created_at >= ? AND t.created_at < ?",
+}
+
+
+def _copy_season(cursor, season):
+    """Step 1: copy the season's closed rows into the archive (idempotent)."""
+    start, end = season_bounds(season)
+    # bundle_lenders rows are only identified by a surrogate id; one the
+    # archive already holds for a different funding must not be skipped by
+    # INSERT OR IGNORE (ids issued before bundle_lenders had AUTOINCREMENT)
+    cursor.execute(f"""
+        SELECT t.id FROM {_SEASON_ROWS["bundle_lenders"]}
+           AND EXISTS (SELECT 1 FROM archive.bundle_lenders a
+                        WHERE a.id = t.id AND (a.bundle_id IS NOT t.bundle_id OR a.lender_id IS NOT t.lender_id))
+    """, (start, end))
+    clashes = [row[0] for row in cursor.fetchall()]
+    if clashes:
+        raise ValueError(
+            f"bundle_lenders ids {clashes[:10]} of season {season} are already used by other archived fundings"
+        )
+    copied = {}
+    for table in ARCHIVED_TABLES:
+        cols = [name for name, _, _ in _columns(cursor, "main", table)]
+        cursor.execute(f"""
+            INSERT OR IGNORE INTO archive.{table} ({", ".join(cols)}, season)
+            SELECT {", ".join("t." + c for c in cols)}, ?
+              FROM {_SEASON_ROWS[table]}
+        """, (season, start, end))
+        copied[table] = cursor.rowcount
+    return copied
+
+
+def _remove_season(cursor, season):
+    """
+    Step 2: delete from the hot tables the season's rows the archive holds,
+    recording what moved in archived_entities / archived_token_totals.
+    """
+    cursor.execute("""
+        INSERT OR IGNORE INTO archived_entities (entity_type, entity_id, season, amount)
+        SELECT 'bundle', a.id, a.season, NULL
+          FROM archive.bundles a
+         WHERE a.season = ? AND a.id IN (SELECT id FROM main.bundles)
+    """, (season,))
+    cursor.execute("""
+        INSERT OR IGNORE INTO archived_entities (entity_type, entity_id, season, amount)
+        SELECT 'invoice', a.id, a.season, a.amount_paid
+          FROM archive.invoices a
+         WHERE a.season = ? AND a.id IN (SELECT id FROM main.invoices)
+    """, (season,))
+    cursor.execute("""
+        INSERT INTO archived_token_totals (farmer_id, token_type, amount, token_count)
+        SELECT COALESCE(t.farmer_id, ''), t.token_type, SUM(t.amount), COUNT(*)
+          FROM main.tokens t
+         WHERE t.id IN (SELECT id FROM archive.tokens WHERE season = ?)
+         GROUP BY 1, 2
+        ON CONFLICT (farmer_id, token_type) DO UPDATE SET
+            amount      = amount + excluded.amount,
+            token_count = token_count + excluded.token_count
+    """, (season,))
+
+    # The change feed would otherwise report every archived row as deleted
+    for table in ARCHIVED_TABLES:
+        cursor.execute(f"DROP TRIGGER IF EXISTS cdc_{table}_delete")
+    removed = {}
+    for table in ARCHIVED_TABLES:
+        if table == "bundle_lenders":
+            # Fundings go with their bundle: select them by bundle_id, and
+            # only those whose copy (same id, same funding) is in the archive
+            cursor.execute("""
+                DELETE FROM main.bundle_lenders
+                 WHERE bundle_id IN (SELECT id FROM archive.bundles WHERE season = ?)
+                   AND EXISTS (SELECT 1 FROM archive.bundle_lenders a
+                                WHERE a.id = main.bundle_lenders.id
+                                  AND a.bundle_id = main.bundle_lenders.bundle_id
+                                  AND a.lender_id IS main.bundle_lenders.lender_id
+                                  AND a.amount IS main.bundle_lenders.amount)
+            """, (season,))
+        else:
+            cursor.execute(f"""
+                DELETE FROM main.{table}
+                 WHERE id IN (SELECT id FROM archive.{table} WHERE season = ?)
+            """, (season,))
+        removed[table] = cursor.rowcount
+    for trigger_sql in db._cdc_trigger_sql(cursor):
+        cursor.execute(trigger_sql)
+    return removed
+
+
+def archive_season(season):
+    """
+    Moves one season's closed records to the archive. The season must have
+    ended. Returns {table: rows moved}; safe to re-run.
+    """
+    start, end = season_bounds(season)
+    if end > datetime.now().strftime("%Y-%m-%d %H:%M:%S"):
+        raise ValueError(f"Season {season} has not ended yet")
+    run_immediate(_connect, _copy_season, season)
+    return run_immediate(_connect, _remove_season, season)
+
+
+def closed_seasons(now=None):
+    """Ended seasons that still have records in the hot tables, oldest first."""
+    current = season_of(now or datetime.now())
+    conn = db.get_read_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT MIN(created_at) FROM (
+            SELECT MIN(created_at) AS created_at FROM tokens
+            UNION ALL SELECT MIN(created_at) FROM invoices
+            UNION ALL SELECT MIN(created_at) FROM bundles WHERE status = 'paid'
+        )
+    """)
+    oldest = cursor.fetchone()[0]
+    conn.close()
+    if oldest is None:
+        return []
+    seasons = []
+    year = int(season_of(oldest)[:4])
+    while True:
+        season = f"{year}/{(year + 1) % 100:02d}"
+        if season >= current:
+            return seasons
+        seasons.append(season)
+        year += 1
+
+
+def archive_closed(now=None):
+    """Archives every ended season; returns {season: {table: rows moved}}."""
+    return {season: archive_season(season) for season in closed_seasons(now)}
+
+
+def incremental_vacuum(step_pages=VACUUM_STEP_PAGES):
+    """
+    Returns free pages to the OS, step_pages per transaction, then checkpoints
+    so the file actually shrinks. Needs auto_vacuum = INCREMENTAL (see
+    enable_incremental_vacuum); otherwise frees nothing. Returns
+    {"auto_vacuum", "freed_pages", "bytes_before", "bytes_after"}.
+    """
+    conn = db.get_connection()
+    conn.isolation_level = None
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    before = os.path.getsize(db.DB_PATH)
+    freed = 0
+    if mode == 2:
+        while True:
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if free == 0:
+                break
+            conn.execute(f"PRAGMA incremental_vacuum({int(step_pages)})").fetchall()
+            freed += min(free, step_pages)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    conn.close()
+    return {
+        "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}[mode],
+        "freed_pages": freed,
+        "bytes_before": before,
+        "bytes_after": os.path.getsize(db.DB_PATH),
+    }
+
+
+def enable_incremental_vacuum():
+    """One-off VACUUM that switches an existing database to incremental auto-vacuum (locks it while it runs)."""
+    conn = db.get_connection()
+    conn.isolation_level = None
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL").fetchall()
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    conn.close()
+
+
+def archive_status():
+    """Row counts per table in the hot database and per season in the archive, and file sizes."""
+    conn = db.get_read_connection(attach_archive=os.path.exists(db.archive_path()))
+    cursor = conn.cursor()
+    status = {"hot": {}, "archive": {}, "bytes": {"hot": os.path.getsize(db.DB_PATH), "archive": 0}}
+    for table in ARCHIVED_TABLES:
+        cursor.execute(f"SELECT COUNT(*) FROM main.{table}")
+        status["hot"][table] = cursor.fetchone()[0]
+    if "archive" in conn._schemas:
+        status["bytes"]["archive"] = os.path.getsize(db.archive_path())
+        for table in ARCHIVED_TABLES:
+            cursor.execute(f"SELECT season, COUNT(*) FROM archive.{table} GROUP BY season ORDER BY season")
+            for season, count in cursor.fetchall():
+                status["archive"].setdefault(season, {})[table] = count
+    conn.close()
+    return status
+
+
+if __name__ == "__main__":
+    import sys
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Move closed records to the archive database by season.")
+    parser.add_argument("command", choices=["status", "run", "vacuum"])
+    parser.add_argument("--season", help="Archive only this season, e.g. 2023/24 (default: every ended season)")
+    parser.add_argument("--vacuum", action="store_true", help="Reclaim the freed space after archiving")
+    parser.add_argument("--enable", action="store_true",
+                        help="vacuum: first switch the database to incremental auto-vacuum (full VACUUM, locks it)")
+    parser.add_argument("--db", help="SQLite file (defaults to the app's database)")
+    args = parser.parse_args()
+    if args.db:
+        db.DB_PATH = args.db
+    db.create_tables()
+
+    if args.command == "status":
+        result = archive_status()
+    elif args.command == "run":
+        result = {args.season: archive_season(args.season)} if args.season else archive_closed()
+        if args.vacuum:
+            result = {"archived": result, "vacuum": incremental_vacuum()}
+    else:
+        if args.enable:
+            enable_incremental_vacuum()
+        result = incremental_vacuum()
+    print(json.dumps(result, indent=2))
+    sys.exit(0)
@@ -0,0 +1,330 @@
+# database/backup.py
+#
+# Online backups. Copying the database file while the app runs can catch a
+# write halfway and produce a torn copy; this uses SQLite's backup API instead.
+# The source is opened read-only and one read transaction is held for the whole
+# copy, so the backup is a single committed snapshot of the database and of
+# the archive (database/archive.py) together. Under WAL that read transaction
+# does not block writers; the copy runs BACKUP_STEP_PAGES pages at a time with
+# a short pause between steps so it never saturates the disk the deliveries
+# are committing to. (While it runs, checkpoints cannot rewind the WAL past
+# the snapshot, so the -wal file grows by whatever is written meanwhile.)
+#
+# Each backup is a set of files in backup_dir():
+#   <name>.db            the database, as a self-contained rollback-journal file
+#   <name>-archive.db    the archive, if there is one
+#   <name>.json          manifest: sizes and SHA-256 of each file, written last,
+#                        so a backup without one is incomplete and is ignored
+#
+#   python -m database.backup create
+#   python -m database.backup schedule --every 6h [--keep-last 7 --keep-daily 30]
+#   python -m database.backup list
+#   python -m database.backup verify [<name>]
+#   python -m database.backup restore <name> [--to path]
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+from datetime import datetime
+
+from database import db
+from database.readpool import _ro_uri
+
+# Where backups are written; None means a "backups" directory next to DB_PATH
+BACKUP_DIR = os.environ.get("ECOWISE_BACKUP_DIR")
+
+# Pages copied per step (1 MB at the default page size) and the pause after
+# each one: roughly 40 MB/s, leaving most of the disk to the app. A longer
+# pause slows the backup and lowers its share further.
+BACKUP_STEP_PAGES = 256
+BACKUP_STEP_PAUSE_S = 0.02
+
+# Retention: the newest BACKUP_KEEP_LAST backups, plus the newest backup of
+# each of the last BACKUP_KEEP_DAILY days
+BACKUP_KEEP_LAST = 7
+BACKUP_KEEP_DAILY = 30
+
+BACKUP_INTERVAL = "6h"
+
+_HASH_CHUNK = 1024 * 1024
+
+
+def backup_dir():
+    return BACKUP_DIR or os.path.join(os.path.dirname(os.path.abspath(db.DB_PATH)), "backups")
+
+
+def _stem():
+    return os.path.splitext(os.path.basename(db.DB_PATH))[0]
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _copy_schema(src, schema, dest_path, step_pages, pause_s):
+    """Copies one schema of src to a new file at dest_path, step_pages at a time. Returns its page count."""
+    dst = sqlite3.connect(dest_path, isolation_level=None)
+    try:
+        pages = {"total": 0}
+
+        def pace(status, remaining, total):
+            pages["total"] = total
+            if remaining and pause_s:
+                time.sleep(pause_s)
+
+        src.backup(dst, pages=step_pages, progress=pace, name=schema)
+        # The copy keeps the source's WAL flag; a backup should be one file
+        dst.execute("PRAGMA journal_mode = DELETE").fetchall()
+        return pages["total"]
+    finally:
+        dst.close()
+
+
+def create_backup(tag=None, step_pages=BACKUP_STEP_PAGES, pause_s=BACKUP_STEP_PAUSE_S):
+    """
+    Backs up the database (and archive) into backup_dir() without blocking
+    writers. Returns the manifest.
+    """
+    directory = backup_dir()
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.now()
+    name = f"{_stem()}-{stamp.strftime('%Y%m%d-%H%M%S')}" + (f"-{tag}" if tag else "")
+    archive_file = db.archive_path()
+
+    t0 = time.perf_counter()
+    src = sqlite3.connect(_ro_uri(db.DB_PATH), uri=True, isolation_level=None)
+    written = {}
+    try:
+        schemas = {"main": f"{name}.db"}
+        if os.path.exists(archive_file):
+            src.execute("ATTACH DATABASE ? AS archive", (_ro_uri(archive_file),))
+            schemas["archive"] = f"{name}-archive.db"
+        # One snapshot for the whole copy, taken on both files up front
+        src.execute("BEGIN")
+        for schema in schemas:
+            src.execute(f"SELECT 1 FROM {schema}.sqlite_master LIMIT 1").fetchall()
+
+        files = {}
+        for schema, file_name in schemas.items():
+            partial = os.path.join(directory, file_name + ".partial")
+            written[schema] = partial
+            pages = _copy_schema(src, schema, partial, step_pages, pause_s)
+            files[schema] = {"file": file_name, "pages": pages}
+        src.execute("ROLLBACK")
+    except BaseException:
+        for partial in written.values():
+            if os.path.exists(partial):
+                os.remove(partial)
+        raise
+    finally:
+        src.close()
+
+    for schema, info in files.items():
+        final = os.path.join(directory, info["file"])
+        os.replace(written[schema], final)
+        info["bytes"] = os.path.getsize(final)
+        info["sha256"] = _sha256(final)
+
+    manifest = {
+        "name": name,
+        "created_at": stamp.strftime("%Y-%m-%d %H:%M:%S"),
+        "source": os.path.abspath(db.DB_PATH),
+        "seconds": round(time.perf_counter() - t0, 3),
+        "files": files,
+    }
+    manifest_path = os.path.join(directory, f"{name}.json")
+    with open(manifest_path + ".partial", "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(manifest_path + ".partial", manifest_path)
+    return manifest
+
+
+def list_backups():
+    """Manifests of every complete backup, newest first."""
+    directory = backup_dir()
+    if not os.path.isdir(directory):
+        return []
+    manifests = []
+    for entry in os.listdir(directory):
+        if entry.endswith(".json"):
+            with open(os.path.join(directory, entry)) as f:
+                manifests.append(json.load(f))
+    return sorted(manifests, key=lambda m: (m["created_at"], m["name"]), reverse=True)
+
+
+def get_backup(name=None):
+    """Manifest of the named backup, or of the newest one."""
+    for manifest in list_backups():
+        if name is None or manifest["name"] == name:
+            return manifest
+    raise ValueError(f"No backup named {name!r} in {backup_dir()}" if name else f"No backups in {backup_dir()}")
+
+
+def verify_backup(name=None):
+    """
+    Re-hashes every file of a backup against its manifest and runs
+    PRAGMA quick_check on it. Returns {"name", "ok", "problems"}.
+    """
+    manifest = get_backup(name)
+    problems = []
+    for schema, info in manifest["files"].items():
+        path = os.path.join(backup_dir(), info["file"])
+        if not os.path.exists(path):
+            problems.append(f"{info['file']}: missing")
+            continue
+        if _sha256(path) != info["sha256"]:
+            problems.append(f"{info['file']}: checksum mismatch")
+            continue
+        conn = sqlite3.connect(_ro_uri(path), uri=True)
+        try:
+            result = [row[0] for row in conn.execute("PRAGMA quick_check").fetchall()]
+        except sqlite3.DatabaseError as e:
+            result = [str(e)]
+        finally:
+            conn.close()
+        if result != ["ok"]:
+            problems.append(f"{info['file']}: {'; '.join(result[:5])}")
+    return {"name": manifest["name"], "ok": not problems, "problems": problems}
+
+
+def prune_backups(keep_last=BACKUP_KEEP_LAST, keep_daily=BACKUP_KEEP_DAILY):
+    """Deletes backups outside the retention policy; returns their names."""
+    manifests = list_backups()
+    keep = {m["name"] for m in manifests[:keep_last]}
+    days = set()
+    for m in manifests:
+        day = m["created_at"][:10]
+        if day not in days and len(days) < keep_daily:
+            days.add(day)
+            keep.add(m["name"])
+    removed = []
+    for m in manifests:
+        if m["name"] in keep:
+            continue
+        # Manifest first: a backup missing some files must not still look complete
+        os.remove(os.path.join(backup_dir(), f"{m['name']}.json"))
+        for info in m["files"].values():
+            path = os.path.join(backup_dir(), info["file"])
+            if os.path.exists(path):
+                os.remove(path)
+        removed.append(m["name"])
+    return removed
+
+
+def _restore_file(backup_path, target_path):
+    # The backup API writes the target in one transaction under its write
+    # lock, so other connections see either the old database or the restored one
+    src = sqlite3.connect(_ro_uri(backup_path), uri=True)
+    dst = sqlite3.connect(target_path, isolation_level=None, timeout=30)
+    try:
+        src.backup(dst)
+        dst.execute("PRAGMA journal_mode = WAL").fetchall()
+    finally:
+        dst.close()
+        src.close()
+
+
+def restore_backup(name, to=None, safety_backup=True):
+    """
+    Restores a verified backup over the app's database (and archive), or into
+    a new database file at `to`. Restoring over the live database first takes a
+    "pre-restore" backup of it unless safety_backup is False. Returns
+    {"restored", "to", "pre_restore"}.
+    """
+    manifest = get_backup(name)
+    check = verify_backup(manifest["name"])
+    if not check["ok"]:
+        raise ValueError(f"Backup {manifest['name']} failed verification: {'; '.join(check['problems'])}")
+
+    main_target = to or db.DB_PATH
+    archive_target = os.path.splitext(main_target)[0] + "-archive.db" if to else db.archive_path()
+    if "archive" not in manifest["files"] and os.path.exists(archive_target):
+        # The restored database would not match the archive's contents
+        raise ValueError(f"Backup {manifest['name']} has no archive but {archive_target} exists; move it aside first")
+
+    pre_restore = None
+    if to is None and safety_backup and os.path.exists(db.DB_PATH):
+        pre_restore = create_backup(tag="pre-restore")["name"]
+
+    targets = {"main": main_target, "archive": archive_target}
+    for schema, info in manifest["files"].items():
+        _restore_file(os.path.join(backup_dir(), info["file"]), targets[schema])
+    if to is None:
+        db._read_pool.clear()
+    return {"restored": manifest["name"], "to": os.path.abspath(main_target), "pre_restore": pre_restore}
+
+
+def _parse_interval(text):
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    text = text.strip().lower()
+    if text[-1:] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+
+def run_schedule(every_s, keep_last=BACKUP_KEEP_LAST, keep_daily=BACKUP_KEEP_DAILY):
+    """Creates, verifies and prunes a backup every every_s seconds until interrupted."""
+    while True:
+        started = time.monotonic()
+        try:
+            manifest = create_backup()
+            result = {"backup": manifest["name"], "seconds": manifest["seconds"],
+                      "verified": verify_backup(manifest["name"]), "pruned": prune_backups(keep_last, keep_daily)}
+        except (sqlite3.Error, OSError, ValueError) as e:
+            result = {"error": f"{type(e).__name__}: {e}"}
+        print(json.dumps(result), flush=True)
+        time.sleep(max(0.0, every_s - (time.monotonic() - started)))
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Online backups of the EcoWise database.")
+    parser.add_argument("command", choices=["create", "schedule", "list", "verify", "restore", "prune"])
+    parser.add_argument("name", nargs="?", help="Backup name (verify/restore; default: newest)")
+    parser.add_argument("--db", help="SQLite file (defaults to the app's database)")
+    parser.add_argument("--dir", help="Backup directory (default: $ECOWISE_BACKUP_DIR or ./backups next to the db)")
+    parser.add_argument("--every", default=BACKUP_INTERVAL, help="schedule: interval, e.g. 30m, 6h, 1d")
+    parser.add_argument("--keep-last", type=int, default=BACKUP_KEEP_LAST)
+    parser.add_argument("--keep-daily", type=int, default=BACKUP_KEEP_DAILY)
+    parser.add_argument("--to", help="restore: write to this new file instead of over the app's database")
+    parser.add_argument("--no-safety-backup", action="store_true", help="restore: skip the pre-restore backup")
+    args = parser.parse_args(argv)
+    global BACKUP_DIR
+    if args.db:
+        db.DB_PATH = args.db
+    if args.dir:
+        BACKUP_DIR = args.dir
+
+    if args.command == "schedule":
+        try:
+            run_schedule(_parse_interval(args.every), args.keep_last, args.keep_daily)
+        except KeyboardInterrupt:
+            return 0
+    if args.command == "create":
+        result = create_backup()
+    elif args.command == "list":
+        result = [{k: m[k] for k in ("name", "created_at", "seconds")} for m in list_backups()]
+    elif args.command == "verify":
+        result = verify_backup(args.name)
+    elif args.command == "prune":
+        result = prune_backups(args.keep_last, args.keep_daily)
+    else:
+        if not args.name:
+            parser.error("restore needs a backup name (see `list`)")
+        result = restore_backup(args.name, args.to, not args.no_safety_backup)
+    print(json.dumps(result, indent=2))
+    return 1 if args.command == "verify" and not result["ok"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
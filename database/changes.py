@@ -0,0 +1,151 @@
+# database/changes.py
+#
+# Consumer side of the change feed. Triggers (CDC_TABLES in database/db.py)
+# append every insert/update/delete on the core tables to the changes table
+# with an increasing seq. A consumer reads the changes after its last offset in
+# batches, applies them to whatever it derives, and commits the new offset, so
+# it never has to rescan the source tables.
+#
+#   for batch in iter_changes("warehouse_export", tables=["sacks"]):
+#       apply(batch)                       # offset advances after each batch
+
+import json
+
+from database.db import write_op, get_connection
+
+CHANGE_BATCH_SIZE = 1000
+
+CHANGE_COLUMNS = ["seq", "table_name", "op", "row_key", "data", "changed_at"]
+
+
+def _decode(row):
+    change = dict(zip(CHANGE_COLUMNS, row))
+    change["data"] = json.loads(change["data"]) if change["data"] else None
+    return change
+
+
+def latest_seq():
+    """Sequence number of the newest change (0 if there are none)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM changes")
+    seq = cursor.fetchone()[0]
+    conn.close()
+    return seq
+
+
+def read_changes(after_seq, limit=CHANGE_BATCH_SIZE, tables=None):
+    """
+    Returns up to limit changes with seq > after_seq, oldest first, as dicts
+    with the row's JSON already decoded. tables optionally restricts the feed.
+    """
+    params = [after_seq]
+    table_filter = ""
+    if tables:
+        table_filter = f"AND table_name IN ({','.join('?' * len(tables))})"
+        params.extend(tables)
+    params.append(limit)
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT seq, table_name, op, row_key, data, changed_at
+        FROM changes
+        WHERE seq > ? {table_filter}
+        ORDER BY seq
+        LIMIT ?
+    """, params)
+    rows = cursor.fetchall()
+    conn.close()
+    return [_decode(r) for r in rows]
+
+
+def get_offset(consumer):
+    """Last seq the consumer has committed (0 for a new consumer)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT last_seq FROM change_consumers WHERE name = ?", (consumer,))
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+
+@write_op
+def commit_offset(cursor, consumer, seq):
+    """Records that the consumer has applied everything up to seq. Offsets never move backwards."""
+    cursor.execute("""
+        INSERT INTO change_consumers (name, last_seq, updated_at)
+        VALUES (?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (name) DO UPDATE SET
+            last_seq = MAX(last_seq, excluded.last_seq),
+            updated_at = CURRENT_TIMESTAMP
+    """, (consumer, seq))
+
+
+@write_op
+def reset_offset(cursor, consumer, seq=0):
+    """Moves a consumer's offset to seq (0 replays the whole retained feed)."""
+    cursor.execute("""
+        INSERT INTO change_consumers (name, last_seq, updated_at)
+        VALUES (?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (name) DO UPDATE SET last_seq = excluded.last_seq, updated_at = CURRENT_TIMESTAMP
+    """, (consumer, seq))
+
+
+def iter_changes(consumer, batch_size=CHANGE_BATCH_SIZE, tables=None):
+    """
+    Yields the consumer's pending changes in batches until it is caught up.
+    The offset is committed when the caller asks for the next batch, so a batch
+    whose processing raises is delivered again next time (at-least-once).
+    """
+    offset = get_offset(consumer)
+    while True:
+        batch = read_changes(offset, batch_size, tables)
+        if not batch:
+            return
+        yield batch
+        offset = batch[-1]["seq"]
+        commit_offset(consumer, offset)
+        if len(batch) < batch_size:
+            return
+
+
+def consume(consumer, handler, batch_size=CHANGE_BATCH_SIZE, tables=None):
+    """Calls handler(batch) for every pending batch; returns how many changes were handled."""
+    handled = 0
+    for batch in iter_changes(consumer, batch_size, tables):
+        handler(batch)
+        handled += len(batch)
+    return handled
+
+
+def get_consumers():
+    """[(name, last_seq, lag, updated_at)] for every registered consumer."""
+    head = latest_seq()
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT name, last_seq, updated_at FROM change_consumers ORDER BY name")
+    rows = cursor.fetchall()
+    conn.close()
+    return [(name, seq, head - seq, updated) for name, seq, updated in rows]
+
+
+@write_op
+def prune_changes(cursor, keep_after=None):
+    """
+    Deletes changes every registered consumer has already committed, or
+    everything up to keep_after when given. Returns the number of rows removed.
+    """
+    if keep_after is None:
+        cursor.execute("SELECT MIN(last_seq) FROM change_consumers")
+        keep_after = cursor.fetchone()[0] or 0
+    cursor.execute("DELETE FROM changes WHERE seq <= ?", (keep_after,))
+    return cursor.rowcount
+
+
+if __name__ == "__main__":
+    # Follow the feed from the command line: python -m database.changes [after_seq]
+    import sys
+
+    after = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    for change in read_changes(after, limit=CHANGE_BATCH_SIZE):
+        print(json.dumps(change))
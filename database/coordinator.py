@@ -0,0 +1,238 @@
+# database/coordinator.py
+#
+# Cross-process write coordinator. One daemon per host owns the SQLite write
+# connection (through a GroupCommitWriter) and every Streamlit replica, the
+# ingestion API and the job workers send it their write_op calls over a Unix
+# socket, so writes from all processes share group commits instead of fighting
+# over the file lock. Reads stay in each process.
+#
+#   python -m database.coordinator --socket /run/ecowise/writes.sock
+#   ECOWISE_WRITE_COORDINATOR=/run/ecowise/writes.sock streamlit run main.py
+#
+# Protocol: each frame is a 4-byte big-endian length followed by a UTF-8 JSON
+# body. Requests are {"op": name, "args": [...], "kwargs": {...}}; replies are
+# {"ok": true, "result": ...} or {"ok": false, "error": type, "message": str}.
+# A connection carries any number of request/reply pairs in order.
+
+import os
+import sys
+import json
+import signal
+import socket
+import struct
+import sqlite3
+import threading
+import socketserver
+
+_HEADER = struct.Struct("!I")
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+
+PING_OP = "__ping__"
+STATS_OP = "__stats__"
+
+
+class CoordinatorError(RuntimeError):
+    """The coordinator could not be reached, or the op failed with an error that has no local equivalent."""
+
+
+# Exceptions re-raised on the client with their original type
+_ERROR_TYPES = {
+    "ValueError": ValueError,
+    "KeyError": KeyError,
+    "IntegrityError": sqlite3.IntegrityError,
+    "OperationalError": sqlite3.OperationalError,
+}
+
+
+def _json_default(o):
+    # numpy / pandas values (scalars, arrays, Series) coming from DataFrames
+    if hasattr(o, "tolist"):
+        return o.tolist()
+    return str(o)
+
+
+def write_frame(sock, payload):
+    body = json.dumps(payload, default=_json_default, separators=(",", ":")).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(body)) + body)
+
+
+def _recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            return None
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def read_frame(sock):
+    """Returns the decoded frame, or None if the peer closed the connection."""
+    header = _recv_exact(sock, _HEADER.size)
+    if header is None:
+        return None
+    (length,) = _HEADER.unpack(header)
+    if length > MAX_FRAME_BYTES:
+        raise CoordinatorError(f"Frame of {length} bytes exceeds limit")
+    body = _recv_exact(sock, length)
+    if body is None:
+        return None
+    return json.loads(body)
+
+
+# --- Client ---
+
+class CoordinatorClient:
+    """Sends write ops to the daemon; keeps one persistent connection per thread."""
+
+    def __init__(self, socket_path, timeout=30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise CoordinatorError(f"Write coordinator not reachable at {self.socket_path}: {e}")
+        return sock
+
+    def _socket(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = self._local.sock = self._connect()
+        return sock
+
+    def _drop(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+        self._local.sock = None
+
+    def call(self, op, args=(), kwargs=None):
+        request = {"op": op, "args": list(args), "kwargs": kwargs or {}}
+        try:
+            write_frame(self._socket(), request)
+        except (BrokenPipeError, ConnectionResetError):
+            # Daemon restarted since this thread last used its connection; nothing
+            # was delivered, so sending again on a fresh connection is safe
+            self._drop()
+            write_frame(self._socket(), request)
+        try:
+            reply = read_frame(self._socket())
+        except (OSError, ValueError) as e:
+            self._drop()
+            raise CoordinatorError(f"No reply from write coordinator for {op}: {e}")
+        if reply is None:
+            self._drop()
+            raise CoordinatorError(f"Write coordinator closed the connection during {op}")
+        if reply["ok"]:
+            return reply["result"]
+        raise _ERROR_TYPES.get(reply["error"], CoordinatorError)(reply["message"])
+
+    def ping(self):
+        return self.call(PING_OP)
+
+    def stats(self):
+        return self.call(STATS_OP)
+
+
+# --- Daemon ---
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = read_frame(self.request)
+            except (OSError, ValueError, CoordinatorError):
+                return
+            if request is None:
+                return
+            write_frame(self.request, self.server.dispatch(request))
+
+
+class CoordinatorServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, writer, ops):
+        self.writer = writer
+        self.ops = ops
+        super().__init__(socket_path, _Handler)
+        os.chmod(socket_path, 0o660)
+
+    def dispatch(self, request):
+        name = request.get("op")
+        try:
+            if name == PING_OP:
+                return {"ok": True, "result": "pong"}
+            if name == STATS_OP:
+                return {"ok": True, "result": dict(self.writer.stats)}
+            fn = self.ops.get(name)
+            if fn is None:
+                raise ValueError(f"Unknown write op '{name}'")
+            result = self.writer.call(fn, *request.get("args", []), **request.get("kwargs", {}))
+            return {"ok": True, "result": result}
+        except Exception as e:
+            return {"ok": False, "error": type(e).__name__, "message": str(e)}
+
+
+def _claim_socket_path(socket_path):
+    """Removes a stale socket file left by a dead daemon; refuses if one is still serving."""
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.unlink(socket_path)
+    else:
+        raise SystemExit(f"A write coordinator is already listening on {socket_path}")
+    finally:
+        probe.close()
+
+
+def serve(socket_path, db_path=None):
+    from database import db
+    from database import jobs, changes  # noqa: F401  registers their write ops
+
+    if db_path:
+        db.DB_PATH = db_path
+    # The daemon executes ops itself; never forward them back to a socket
+    db.use_write_coordinator(None)
+    db.create_tables()
+
+    _claim_socket_path(socket_path)
+    writer = db.start_group_commit()
+    server = CoordinatorServer(socket_path, writer, db.WRITE_OPS)
+    # Stop cleanly (finishing queued writes, removing the socket) on SIGTERM too
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    print(f"EcoWise write coordinator on {socket_path} (db: {db.DB_PATH})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+        db.stop_group_commit()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the EcoWise cross-process write coordinator.")
+    parser.add_argument("--socket", default=os.environ.get("ECOWISE_WRITE_COORDINATOR"),
+                        help="Unix socket path (default: $ECOWISE_WRITE_COORDINATOR)")
+    parser.add_argument("--db", help="SQLite file (defaults to the app's database)")
+    args = parser.parse_args(argv)
+    if not args.socket:
+        parser.error("--socket or ECOWISE_WRITE_COORDINATOR is required")
+    serve(args.socket, args.db)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
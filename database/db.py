@@ -1,22 +1,209 @@
 import sqlite3
 import pandas as pd
-import uuid
+import numpy as np
 import os
 import json
+import functools
 from datetime import datetime
 import math
 
+from database.allocation import (
+    group_sacks_for_bagging,
+    BAG_PACKING_MODES,
+    bag_packing_stats,
+    pack_bags_ffd,
+    BATCH_CAPACITY_KG,
+    settle_invoice,
+    settlement_totals,
+    select_target_value,
+    allocate_funding,
+)
+from database import instrumentation
+from database.ids import new_ulid
+from database.writer import GroupCommitWriter, run_immediate
+from database.readpool import ReadPool
+from database.coordinator import CoordinatorClient
+
 
 # Path to your SQLite database file
 DB_PATH = os.path.join(os.path.dirname(__file__), "ecowise-mvp.db")
 
 def get_connection():
+    if instrumentation.is_enabled():
+        return instrumentation.connect(DB_PATH, check_same_thread=False)
     return sqlite3.connect(DB_PATH, check_same_thread=False)
 
+# Read-only functions below use pooled snapshot connections instead
+# (database/readpool.py): every statement they run sees one committed state,
+# and in WAL mode they neither wait for nor block writers. close() hands the
+# connection back to the pool.
+_read_pool = ReadPool()
+
+# Closed records (paid bundles, invoices, old tokens) are moved out by season
+# into a separate archive database (database/archive.py). None means
+# "<database name>-archive.db" next to DB_PATH.
+ARCHIVE_PATH = None
+
+def archive_path():
+    return ARCHIVE_PATH or os.path.splitext(DB_PATH)[0] + "-archive.db"
+
+def get_read_connection(attach_archive=False):
+    """A pooled snapshot connection; attach_archive also opens the archive as `archive`."""
+    base = instrumentation.InstrumentedConnection if instrumentation.is_enabled() else sqlite3.Connection
+    attach = {"archive": archive_path()} if attach_archive else None
+    return _read_pool.acquire(DB_PATH, base, attach)
+
+def _listing_source(table, columns, include_archive):
+    """
+    Row source for a listing of table, as (sql, attach_archive). With
+    include_archive it also yields the table's archived rows, and an `archived`
+    column (0/1) either way. A row briefly present in both (an archive run
+    interrupted between its two steps) is taken from the hot table.
+    """
+    cols = ", ".join(columns)
+    if not include_archive:
+        return f"SELECT {cols} FROM main.{table}", False
+    if not os.path.exists(archive_path()):
+        return f"SELECT {cols}, 0 AS archived FROM main.{table}", False
+    return f"""
+        SELECT {cols}, 0 AS archived FROM main.{table}
+        UNION ALL
+        SELECT {cols}, 1 AS archived FROM archive.{table} a
+         WHERE NOT EXISTS (SELECT 1 FROM main.{table} h WHERE h.id = a.id)
+    """, True
+
+# Small writes made from page sessions. Each is written as fn(cursor, *args)
+# without committing; write_op decides whose connection and commit it gets:
+#   1. the write coordinator daemon, if ECOWISE_WRITE_COORDINATOR names its socket
+#      (database/coordinator.py, shared by every process on the host)
+#   2. this process's group-commit writer, if start_group_commit() was called
+#   3. otherwise a BEGIN IMMEDIATE transaction of its own (writer.run_immediate)
+# All three hold the write lock for the whole op, so an op's reads stay valid
+# until its writes commit, and all three retry on SQLITE_BUSY.
+# Every data write goes through a write_op (database/jobs.py and changes.py
+# included). The exceptions are schema and maintenance work run by an operator
+# with the app quiet: create_tables, the rebuild_* repairs,
+# migrate_join_tables, and database/archive.py and backup.py, which need
+# connections of their own (an attached archive, the backup API).
+WRITE_OPS = {}
+
+_group_writer = None
+_coordinator = None
+
+def use_write_coordinator(socket_path):
+    """Routes write_op calls to the coordinator at socket_path (None to write locally)."""
+    global _coordinator
+    _coordinator = CoordinatorClient(socket_path) if socket_path else None
+
+use_write_coordinator(os.environ.get("ECOWISE_WRITE_COORDINATOR"))
+
+def start_group_commit(**options):
+    """
+    Starts the process-wide group-commit writer (database/writer.py); from then
+    on every write_op joins its batched transactions. Safe to call repeatedly.
+    """
+    global _group_writer
+    if _group_writer is None or not _group_writer.is_running():
+        _group_writer = GroupCommitWriter(get_connection, **options).start()
+    return _group_writer
+
+def stop_group_commit():
+    global _group_writer
+    if _group_writer is not None:
+        _group_writer.stop()
+        _group_writer = None
+
+def get_group_commit_stats():
+    return dict(_group_writer.stats) if _group_writer is not None else None
+
+def write_op(fn):
+    """Decorator for fn(cursor, *args); callers pass only *args and get fn's result."""
+    WRITE_OPS[fn.__name__] = fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if _coordinator is not None:
+            return _coordinator.call(fn.__name__, args, kwargs)
+        if _group_writer is not None and _group_writer.is_running():
+            return _group_writer.call(fn, *args, **kwargs)
+        return run_immediate(get_connection, fn, *args, **kwargs)
+
+    return wrapper
+
+# Many-to-many tables. Each row gets an INTEGER PRIMARY KEY surrogate (its
+# rowid) and the id pair is a UNIQUE constraint, so rows append in insert order
+# and the secondary indexes below store an 8-byte integer per entry instead of
+# repeating the other TEXT id. Databases created before the surrogate existed
+# keep working unchanged and are converted by migrate_join_tables().
+JOIN_TABLE_SQL = {
+    "bag_sacks": """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY,
+        bag_id TEXT,
+        sack_id TEXT,
+        allocated_weight_kg REAL NOT NULL,
+        UNIQUE (bag_id, sack_id),
+        FOREIGN KEY (bag_id) REFERENCES bags(id),
+        FOREIGN KEY (sack_id) REFERENCES sacks(id)
+    );
+    """,
+    "batch_bags": """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY,
+        batch_id TEXT,
+        bag_id TEXT,
+        UNIQUE (batch_id, bag_id),
+        FOREIGN KEY (batch_id) REFERENCES batches(id),
+        FOREIGN KEY (bag_id) REFERENCES bags(id)
+    );
+    """,
+    "bundle_sacks": """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY,
+        bundle_id TEXT,
+        sack_id TEXT,
+        UNIQUE (bundle_id, sack_id),
+        FOREIGN KEY (bundle_id) REFERENCES bundles(id),
+        FOREIGN KEY (sack_id) REFERENCES sacks(id)
+    );
+    """,
+    # No unique pair here: a lender can fund the same bundle more than once,
+    # and each funding is its own row. AUTOINCREMENT because archiving
+    # (database/archive.py) deletes funding rows, and their ids name the
+    # archived copies; a new funding must never be handed one of them.
+    "bundle_lenders": """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        bundle_id TEXT,
+        lender_id TEXT,
+        amount REAL,
+        FOREIGN KEY (bundle_id) REFERENCES bundles(id),
+        FOREIGN KEY (lender_id) REFERENCES lenders(id)
+    );
+    """,
+}
+
+# Reverse lookups (which bag / batch / bundle holds this sack or bag) and the
+# "not yet bagged / batched / bundled" filters
+JOIN_TABLE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_bag_sacks_sack ON bag_sacks (sack_id);",
+    "CREATE INDEX IF NOT EXISTS idx_batch_bags_bag ON batch_bags (bag_id);",
+    "CREATE INDEX IF NOT EXISTS idx_bundle_sacks_sack ON bundle_sacks (sack_id);",
+    "CREATE INDEX IF NOT EXISTS idx_bundle_lenders_bundle ON bundle_lenders (bundle_id, lender_id);",
+]
+
 def create_tables():
     conn = get_connection()
     cursor = conn.cursor()
 
+    # Incremental auto-vacuum lets archiving hand freed pages back to the OS a
+    # few at a time (database/archive.py). It only takes effect on a new file;
+    # an existing one is converted once with `python -m database.archive vacuum --enable`.
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # WAL lets report snapshots and writers run side by side; the setting is
+    # stored in the file, so this is a no-op once it has been applied
+    cursor.execute("PRAGMA journal_mode = WAL")
+
     # cursor.execute("PRAGMA foreign_keys = OFF;")
     # cursor.execute("DROP TABLE IF EXISTS invoice;")
     # cursor.execute("DROP TABLE IF EXISTS tips;")
@@ -73,16 +260,7 @@ def create_tables():
     """)
 
     # BAG_SACKS (Many-to-Many)
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS bag_sacks (
-        bag_id TEXT,
-        sack_id TEXT,
-        allocated_weight_kg REAL NOT NULL,
-        PRIMARY KEY (bag_id, sack_id),
-        FOREIGN KEY (bag_id) REFERENCES bags(id),
-        FOREIGN KEY (sack_id) REFERENCES sacks(id)
-    );
-    """)
+    cursor.execute(JOIN_TABLE_SQL["bag_sacks"].format(name="bag_sacks"))
 
     # --- BATCHES (TEXT PK) ---
     cursor.execute("""
@@ -95,15 +273,7 @@ def create_tables():
     """)
 
     # --- BATCH_BAGS (TEXT FKs) ---
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS batch_bags (
-        batch_id TEXT,
-        bag_id TEXT,
-        PRIMARY KEY (batch_id, bag_id),
-        FOREIGN KEY (batch_id) REFERENCES batches(id),
-        FOREIGN KEY (bag_id) REFERENCES bags(id)
-    );
-    """)
+    cursor.execute(JOIN_TABLE_SQL["batch_bags"].format(name="batch_bags"))
 
     # --- Warrant Receipts (TEXT PK) ---
     cursor.execute("""
@@ -139,28 +309,11 @@ def create_tables():
     """)
 
     # BUNDLE_SACKS
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS bundle_sacks (
-            bundle_id TEXT,
-            sack_id TEXT,
-            PRIMARY KEY (bundle_id, sack_id),
-            FOREIGN KEY (bundle_id) REFERENCES bundles(id),
-            FOREIGN KEY (sack_id) REFERENCES sacks(id)
-        );
-        """)
+    cursor.execute(JOIN_TABLE_SQL["bundle_sacks"].format(name="bundle_sacks"))
 
 
     # BUNDLE_LENDERS
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS bundle_lenders (
-        bundle_id TEXT,
-        lender_id TEXT,
-        amount REAL,
-        PRIMARY KEY (bundle_id, lender_id),
-        FOREIGN KEY (bundle_id) REFERENCES bundles(id),
-        FOREIGN KEY (lender_id) REFERENCES lenders(id)
-    );
-    """)
+    cursor.execute(JOIN_TABLE_SQL["bundle_lenders"].format(name="bundle_lenders"))
 
     # TOKENS
     cursor.execute("""
@@ -198,22 +351,631 @@ def create_tables():
     );
     """)
 
+    # SACK_LINEAGE (closure table: sack -> every downstream bag/batch/bundle/invoice)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sack_lineage (
+        sack_id TEXT NOT NULL,
+        entity_type TEXT CHECK(entity_type IN ('bag','batch','bundle','invoice')) NOT NULL,
+        entity_id TEXT NOT NULL,
+        PRIMARY KEY (sack_id, entity_type, entity_id),
+        FOREIGN KEY (sack_id) REFERENCES sacks(id)
+    );
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_sack_lineage_entity
+        ON sack_lineage (entity_type, entity_id, sack_id);
+    """)
+
+    # ARCHIVED_ENTITIES / ARCHIVED_TOKEN_TOTALS (what database/archive.py has
+    # moved to the archive database: ids that must not be reused or re-applied,
+    # and each farmer's archived token sums so balances stay complete)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS archived_entities (
+        entity_type TEXT CHECK(entity_type IN ('bundle','invoice')) NOT NULL,
+        entity_id TEXT NOT NULL,
+        season TEXT NOT NULL,
+        amount REAL,              -- invoice amount_paid, for rebuild_kpis
+        PRIMARY KEY (entity_type, entity_id)
+    );
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS archived_token_totals (
+        farmer_id TEXT NOT NULL,
+        token_type TEXT NOT NULL,
+        amount REAL NOT NULL DEFAULT 0,
+        token_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (farmer_id, token_type)
+    );
+    """)
+
+    # KPI (running totals for the dashboard, maintained by the triggers below)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS kpi (
+        key TEXT PRIMARY KEY,
+        value REAL NOT NULL DEFAULT 0
+    );
+    """)
+    cursor.execute("SELECT COUNT(*) FROM kpi")
+    kpi_missing = cursor.fetchone()[0] < len(KPI_KEYS)
+    cursor.executemany(
+        "INSERT OR IGNORE INTO kpi (key, value) VALUES (?, 0)",
+        [(k,) for k in KPI_KEYS]
+    )
+    for trigger_sql in KPI_TRIGGERS:
+        cursor.execute(trigger_sql)
+
+    # DELIVERY_DAILY_ROLLUP (per day / warehouse / farmer intake, kept current by trigger)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS delivery_daily_rollup (
+        date TEXT NOT NULL,
+        warehouse TEXT NOT NULL DEFAULT '',
+        farmer_id TEXT NOT NULL,
+        sack_count INTEGER NOT NULL DEFAULT 0,
+        weight_kg REAL NOT NULL DEFAULT 0,
+        value_paid REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (date, warehouse, farmer_id)
+    );
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_delivery_rollup_farmer
+        ON delivery_daily_rollup (farmer_id, date);
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_sacks_delivered_at ON sacks (delivered_at);
+    """)
+    for index_sql in JOIN_TABLE_INDEXES:
+        cursor.execute(index_sql)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS delivery_rollup_sacks_insert AFTER INSERT ON sacks
+    BEGIN
+        INSERT INTO delivery_daily_rollup (date, warehouse, farmer_id, sack_count, weight_kg, value_paid)
+        VALUES (DATE(NEW.delivered_at), COALESCE(NEW.warehouse, ''), NEW.farmer_id, 1, NEW.weight_kg, NEW.value_paid)
+        ON CONFLICT (date, warehouse, farmer_id) DO UPDATE SET
+            sack_count = sack_count + 1,
+            weight_kg  = weight_kg + excluded.weight_kg,
+            value_paid = value_paid + excluded.value_paid;
+    END;
+    """)
+    # JOBS (background pipeline runs, see database/jobs.py)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        params TEXT NOT NULL DEFAULT '{}',   -- JSON
+        status TEXT CHECK(status IN ('queued','running','succeeded','failed')) NOT NULL DEFAULT 'queued',
+        progress REAL NOT NULL DEFAULT 0,   -- 0.0 to 1.0
+        message TEXT,
+        state TEXT NOT NULL DEFAULT '{}',    -- JSON checkpoint for resuming
+        result TEXT,                         -- JSON
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        heartbeat_at TIMESTAMP,
+        finished_at TIMESTAMP
+    );
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+    """)
+
+    # CHANGES (change feed for incremental consumers, see database/changes.py)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,   -- never reused, so always increasing
+        table_name TEXT NOT NULL,
+        op TEXT CHECK(op IN ('insert','update','delete')) NOT NULL,
+        row_key TEXT NOT NULL,
+        data TEXT,                               -- JSON of the new row (old row for deletes)
+        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS change_consumers (
+        name TEXT PRIMARY KEY,
+        last_seq INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    for trigger_sql in _cdc_trigger_sql(cursor):
+        cursor.execute(trigger_sql)
+
+    # SYNC_RECEIPTS (offline deliveries already applied, keyed by the device's own id)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sync_receipts (
+        client_id TEXT PRIMARY KEY,
+        device_id TEXT NOT NULL,
+        sack_id TEXT NOT NULL,
+        received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (sack_id) REFERENCES sacks(id)
+    );
+    """)
+
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM delivery_daily_rollup)")
+    has_rollup = cursor.fetchone()[0]
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM sacks)")
+    rollup_missing = cursor.fetchone()[0] and not has_rollup
+
     conn.commit()
+
+    if kpi_missing:
+        rebuild_kpis()
+    if rollup_missing:
+        rebuild_delivery_rollup()
+
+    # Backfill lineage for databases created before the closure table existed
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM sack_lineage)")
+    has_lineage = cursor.fetchone()[0]
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM bag_sacks)")
+    has_bags = cursor.fetchone()[0]
+    # bundle_lenders is small, and repeat funding and archiving need its
+    # AUTOINCREMENT surrogate key, so it is converted straight away rather than
+    # waiting for migrate_join_tables
+    bundle_lenders_keyed = _join_table_current(cursor, "bundle_lenders")
     conn.close()
+    if has_bags and not has_lineage:
+        rebuild_sack_lineage()
+    if not bundle_lenders_keyed:
+        migrate_join_tables(["bundle_lenders"])
+
+KPI_KEYS = [
+    "farmers",
+    "sacks_delivered",
+    "delivered_kg",
+    "delivered_value",
+    "debt_outstanding",
+    "internal_outstanding",
+    "bundles_unfunded",
+    "bundles_partially_funded",
+    "bundles_funded",
+    "bundles_paid",
+    "lender_available",
+    "lender_exposure",
+    "invoices_settled",
+    "invoiced_amount",
+]
+
+# Each write to the source tables adjusts the matching kpi rows by a delta, so
+# the dashboard reads a handful of rows instead of scanning sacks/tokens/bundles.
+KPI_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS kpi_farmers_insert AFTER INSERT ON farmers
+    BEGIN
+        UPDATE kpi SET value = value + 1 WHERE key = 'farmers';
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS kpi_sacks_insert AFTER INSERT ON sacks
+    BEGIN
+        UPDATE kpi SET value = value + 1 WHERE key = 'sacks_delivered';
+        UPDATE kpi SET value = value + NEW.weight_kg WHERE key = 'delivered_kg';
+        UPDATE kpi SET value = value + NEW.value_paid WHERE key = 'delivered_value';
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS kpi_tokens_insert AFTER INSERT ON tokens
+    BEGIN
+        UPDATE kpi SET value = value + NEW.amount
+         WHERE key = CASE NEW.token_type WHEN 'debt' THEN 'debt_outstanding' ELSE 'internal_outstanding' END;
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS kpi_bundles_insert AFTER INSERT ON bundles
+    BEGIN
+        UPDATE kpi SET value = value + 1 WHERE key = 'bundles_' || replace(NEW.status, ' ', '_');
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS kpi_bundles_status AFTER UPDATE OF status ON bundles
+    WHEN OLD.status IS NOT NEW.status
+    BEGIN
+        UPDATE kpi SET value = value - 1 WHERE key = 'bundles_' || replace(OLD.status, ' ', '_');
+        UPDATE kpi SET value = value + 1 WHERE key = 'bundles_' || replace(NEW.status, ' ', '_');
+        UPDATE kpi SET value = value + (
+            CASE WHEN NEW.status = 'paid' THEN -1 WHEN OLD.status = 'paid' THEN 1 ELSE 0 END
+        ) * (SELECT COALESCE(SUM(amount), 0) FROM bundle_lenders WHERE bundle_id = NEW.id)
+         WHERE key = 'lender_exposure';
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS kpi_bundle_lenders_insert AFTER INSERT ON bundle_lenders
+    WHEN (SELECT status FROM bundles WHERE id = NEW.bundle_id) IS NOT 'paid'
+    BEGIN
+        UPDATE kpi SET value = value + NEW.amount WHERE key = 'lender_exposure';
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS kpi_lenders_insert AFTER INSERT ON lenders
+    BEGIN
+        UPDATE kpi SET value = value + NEW.position WHERE key = 'lender_available';
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS kpi_lenders_position AFTER UPDATE OF position ON lenders
+    BEGIN
+        UPDATE kpi SET value = value + NEW.position - OLD.position WHERE key = 'lender_available';
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS kpi_invoices_insert AFTER INSERT ON invoices
+    BEGIN
+        UPDATE kpi SET value = value + 1 WHERE key = 'invoices_settled';
+        UPDATE kpi SET value = value + NEW.amount_paid WHERE key = 'invoiced_amount';
+    END;
+    """,
+]
+
+# Tables whose writes are logged to the changes table, with the expression
+# that identifies a row (composite keys are joined with '/')
+CDC_TABLES = {
+    "farmers":        "{r}.id",
+    "sacks":          "{r}.id",
+    "bag_sacks":      "{r}.bag_id || '/' || {r}.sack_id",
+    "batch_bags":     "{r}.batch_id || '/' || {r}.bag_id",
+    "bundles":        "{r}.id",
+    "bundle_lenders": "{r}.id",
+    "tokens":         "{r}.id",
+    "invoices":       "{r}.id",
+}
+
+def _cdc_trigger_sql(cursor):
+    """
+    Builds the change-capture triggers from each table's current columns.
+    Only triggers that are missing or out of date (a column was added) are
+    returned, as DROP + CREATE pairs, so an unchanged schema costs no DDL.
+    """
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'cdc_%'")
+    existing = dict(cursor.fetchall())
+    statements = []
+    for table, key_expr in CDC_TABLES.items():
+        cursor.execute(f"PRAGMA table_info({table})")
+        columns = [row[1] for row in cursor.fetchall()]
+        for op, event, ref in (("insert", "INSERT", "NEW"), ("update", "UPDATE", "NEW"), ("delete", "DELETE", "OLD")):
+            name = f"cdc_{table}_{op}"
+            row_json = ", ".join(f"'{c}', {ref}.{c}" for c in columns)
+            create_sql = (
+                f"CREATE TRIGGER {name} AFTER {event} ON {table} BEGIN "
+                f"INSERT INTO changes (table_name, op, row_key, data) "
+                f"VALUES ('{table}', '{op}', {key_expr.format(r=ref)}, json_object({row_json})); END"
+            )
+            if existing.get(name) != create_sql:
+                statements.append(f"DROP TRIGGER IF EXISTS {name}")
+                statements.append(create_sql)
+    return statements
 
-def create_farmer(first_name, last_name, email, country, city, gender, phone_number):
+def rebuild_kpis():
+    """
+    Recomputes every kpi row from the source tables. Only needed for migration
+    or repair; the kpi triggers keep the table current on every write.
+    """
     conn = get_connection()
     cursor = conn.cursor()
+    totals = dict.fromkeys(KPI_KEYS, 0.0)
+
+    cursor.execute("SELECT COUNT(*) FROM farmers")
+    totals["farmers"] = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(*), COALESCE(SUM(weight_kg), 0), COALESCE(SUM(value_paid), 0) FROM sacks")
+    totals["sacks_delivered"], totals["delivered_kg"], totals["delivered_value"] = cursor.fetchone()
+    cursor.execute("""
+        SELECT token_type, COALESCE(SUM(amount), 0) FROM (
+            SELECT token_type, amount FROM tokens
+            UNION ALL
+            SELECT token_type, amount FROM archived_token_totals
+        ) GROUP BY token_type
+    """)
+    for token_type, amount in cursor.fetchall():
+        totals["debt_outstanding" if token_type == "debt" else "internal_outstanding"] = amount
+    cursor.execute("""
+        SELECT status, COUNT(*) FROM bundles GROUP BY status
+        UNION ALL
+        SELECT 'paid', COUNT(*) FROM archived_entities WHERE entity_type = 'bundle'
+    """)
+    for status, count in cursor.fetchall():
+        key = "bundles_" + status.replace(" ", "_")
+        if key in totals:
+            totals[key] += count
+    cursor.execute("""
+        SELECT COALESCE(SUM(bl.amount), 0)
+          FROM bundle_lenders bl
+          JOIN bundles b ON bl.bundle_id = b.id
+         WHERE b.status != 'paid'
+    """)
+    totals["lender_exposure"] = cursor.fetchone()[0]
+    cursor.execute("SELECT COALESCE(SUM(position), 0) FROM lenders")
+    totals["lender_available"] = cursor.fetchone()[0]
+    cursor.execute("""
+        SELECT COUNT(*), COALESCE(SUM(amount_paid), 0) FROM (
+            SELECT amount_paid FROM invoices
+            UNION ALL
+            SELECT amount FROM archived_entities WHERE entity_type = 'invoice'
+        )
+    """)
+    totals["invoices_settled"], totals["invoiced_amount"] = cursor.fetchone()
+
+    cursor.executemany(
+        "INSERT OR REPLACE INTO kpi (key, value) VALUES (?, ?)",
+        list(totals.items())
+    )
+    conn.commit()
+    conn.close()
+
+def get_kpis():
+    """Returns a dict of every dashboard KPI, read from the kpi table."""
+    conn = get_read_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT key, value FROM kpi")
+    rows = cursor.fetchall()
+    conn.close()
+    kpis = dict.fromkeys(KPI_KEYS, 0.0)
+    kpis.update(dict(rows))
+    return kpis
+
+def rebuild_delivery_rollup(start_date=None, end_date=None):
+    """
+    Re-aggregates delivery_daily_rollup from sacks for delivery dates between
+    start_date and end_date inclusive ('YYYY-MM-DD'; either may be None for an
+    open range). Rows outside the range are left untouched.
+    """
+    sack_where, rollup_where, params = [], [], []
+    if start_date:
+        sack_where.append("delivered_at >= ?")
+        rollup_where.append("date >= ?")
+        params.append(str(start_date))
+    if end_date:
+        sack_where.append("delivered_at < DATE(?, '+1 day')")
+        rollup_where.append("date <= ?")
+        params.append(str(end_date))
+    sack_filter = ("WHERE " + " AND ".join(sack_where)) if sack_where else ""
+    rollup_filter = ("WHERE " + " AND ".join(rollup_where)) if rollup_where else ""
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"DELETE FROM delivery_daily_rollup {rollup_filter}", params)
+    cursor.execute(f"""
+        INSERT INTO delivery_daily_rollup (date, warehouse, farmer_id, sack_count, weight_kg, value_paid)
+        SELECT DATE(delivered_at), COALESCE(warehouse, ''), farmer_id,
+               COUNT(*), SUM(weight_kg), SUM(value_paid)
+          FROM sacks
+          {sack_filter}
+         GROUP BY DATE(delivered_at), COALESCE(warehouse, ''), farmer_id
+    """, params)
+    conn.commit()
+    conn.close()
+
+def get_delivery_rollup(start_date=None, end_date=None, warehouse=None, farmer_id=None):
+    """
+    Range scan over delivery_daily_rollup. Returns a DataFrame of
+    date, warehouse, farmer_id, sack_count, weight_kg, value_paid.
+    """
+    where, params = [], []
+    if start_date:
+        where.append("date >= ?")
+        params.append(str(start_date))
+    if end_date:
+        where.append("date <= ?")
+        params.append(str(end_date))
+    if warehouse is not None:
+        where.append("warehouse = ?")
+        params.append(warehouse)
+    if farmer_id is not None:
+        where.append("farmer_id = ?")
+        params.append(farmer_id)
+    conn = get_read_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT date, warehouse, farmer_id, sack_count, weight_kg, value_paid
+          FROM delivery_daily_rollup
+          {("WHERE " + " AND ".join(where)) if where else ""}
+         ORDER BY date
+    """, params)
+    rows = cursor.fetchall()
+    cols = [d[0] for d in cursor.description]
+    conn.close()
+    return pd.DataFrame(rows, columns=cols)
+
+def get_daily_intake_by_warehouse(start_date=None, end_date=None):
+    """Returns a DataFrame of date, warehouse, sack_count, weight_kg, value_paid."""
+    where, params = [], []
+    if start_date:
+        where.append("date >= ?")
+        params.append(str(start_date))
+    if end_date:
+        where.append("date <= ?")
+        params.append(str(end_date))
+    conn = get_read_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT date, warehouse,
+               SUM(sack_count) AS sack_count,
+               SUM(weight_kg)  AS weight_kg,
+               SUM(value_paid) AS value_paid
+          FROM delivery_daily_rollup
+          {("WHERE " + " AND ".join(where)) if where else ""}
+         GROUP BY date, warehouse
+         ORDER BY date, warehouse
+    """, params)
+    rows = cursor.fetchall()
+    cols = [d[0] for d in cursor.description]
+    conn.close()
+    return pd.DataFrame(rows, columns=cols)
+
+def get_farmer_delivery_trend(farmer_id, start_date=None, end_date=None):
+    """Returns a DataFrame of date, sack_count, weight_kg, value_paid for one farmer."""
+    params = [farmer_id]
+    where = ""
+    if start_date:
+        where += " AND date >= ?"
+        params.append(str(start_date))
+    if end_date:
+        where += " AND date <= ?"
+        params.append(str(end_date))
+    conn = get_read_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT date,
+               SUM(sack_count) AS sack_count,
+               SUM(weight_kg)  AS weight_kg,
+               SUM(value_paid) AS value_paid
+          FROM delivery_daily_rollup
+         WHERE farmer_id = ?{where}
+         GROUP BY date
+         ORDER BY date
+    """, params)
+    rows = cursor.fetchall()
+    cols = [d[0] for d in cursor.description]
+    conn.close()
+    return pd.DataFrame(rows, columns=cols)
+
+def rebuild_sack_lineage():
+    """
+    Recomputes the sack_lineage closure table from bag_sacks, batch_bags,
+    bundle_sacks and invoices (archived ones included). Only needed for
+    migration or repair; the write functions keep it up to date incrementally.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    invoices_sql = "SELECT id, covered_batches FROM main.invoices"
+    if os.path.exists(archive_path()):
+        cursor.execute("ATTACH DATABASE ? AS archive", (archive_path(),))
+        invoices_sql += " UNION SELECT id, covered_batches FROM archive.invoices"
+    cursor.execute("DELETE FROM sack_lineage")
+    cursor.execute("""
+        INSERT OR IGNORE INTO sack_lineage (sack_id, entity_type, entity_id)
+        SELECT sack_id, 'bag', bag_id FROM bag_sacks
+    """)
+    cursor.execute("""
+        INSERT OR IGNORE INTO sack_lineage (sack_id, entity_type, entity_id)
+        SELECT bs.sack_id, 'batch', bb.batch_id
+          FROM batch_bags bb
+          JOIN bag_sacks bs ON bb.bag_id = bs.bag_id
+    """)
+    cursor.execute("""
+        INSERT OR IGNORE INTO sack_lineage (sack_id, entity_type, entity_id)
+        SELECT sack_id, 'bundle', bundle_id FROM bundle_sacks
+    """)
+    cursor.execute(invoices_sql)
+    for invoice_id, covered in cursor.fetchall():
+        for batch_id in json.loads(covered):
+            _link_lineage_from(cursor, "batch", batch_id, "invoice", invoice_id)
+    conn.commit()
+    conn.close()
+
+def _link_lineage_from(cursor, parent_type, parent_id, entity_type, entity_id):
+    """Links every sack already under (parent_type, parent_id) to a new downstream entity."""
+    cursor.execute("""
+        INSERT OR IGNORE INTO sack_lineage (sack_id, entity_type, entity_id)
+        SELECT sack_id, ?, ?
+          FROM sack_lineage
+         WHERE entity_type = ? AND entity_id = ?
+    """, (entity_type, entity_id, parent_type, parent_id))
+
+def _join_table_current(cursor, table):
+    """True if table already has the surrogate-key layout of JOIN_TABLE_SQL (AUTOINCREMENT included)."""
+    cursor.execute(f"PRAGMA main.table_info({table})")
+    if "id" not in [row[1] for row in cursor.fetchall()]:
+        return False
+    if "AUTOINCREMENT" not in JOIN_TABLE_SQL[table]:
+        return True
+    cursor.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    return "AUTOINCREMENT" in cursor.fetchone()[0].upper()
+
+def migrate_join_tables(tables=None):
+    """
+    Converts the join tables (all of JOIN_TABLE_SQL, or just those named in
+    tables) from the old composite primary key to the surrogate-key layout,
+    keeping every row's existing rowid as its id, and gives bundle_lenders
+    its AUTOINCREMENT key. Tables already converted are skipped, and all of
+    them convert in one transaction. Returns the names of the tables rebuilt.
+    """
+    conn = get_connection()
+    conn.isolation_level = None  # DDL has to be inside the explicit transaction
+    cursor = conn.cursor()
+    # Ids already moved to the archive must not be issued again either
+    archived_max = {}
+    if os.path.exists(archive_path()):
+        cursor.execute("ATTACH DATABASE ? AS archive", (archive_path(),))
+        cursor.execute("SELECT name FROM archive.sqlite_master WHERE type = 'table'")
+        for (table,) in cursor.fetchall():
+            if table in JOIN_TABLE_SQL:
+                cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM archive.{table}")
+                archived_max[table] = cursor.fetchone()[0]
+    # Triggers on other tables (e.g. the kpi ones) name the table being
+    # swapped; without this the RENAME rejects them while it is briefly gone
+    cursor.execute("PRAGMA legacy_alter_table = ON")
+    rebuilt = []
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        for table, create_sql in JOIN_TABLE_SQL.items():
+            if tables is not None and table not in tables:
+                continue
+            if _join_table_current(cursor, table):
+                continue
+            cursor.execute(f"PRAGMA main.table_info({table})")
+            columns = [row[1] for row in cursor.fetchall() if row[1] != "id"]
+            staging = f"{table}_migrating"
+            cursor.execute(f"DROP TABLE IF EXISTS main.{staging}")
+            cursor.execute(create_sql.format(name=f"main.{staging}"))
+            cursor.execute(f"""
+                INSERT INTO main.{staging} (id, {', '.join(columns)})
+                SELECT rowid, {', '.join(columns)} FROM main.{table} ORDER BY rowid
+            """)
+            if "AUTOINCREMENT" in create_sql and archived_max.get(table):
+                cursor.execute("""
+                    UPDATE main.sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?
+                """, (archived_max[table], staging))
+                if cursor.rowcount == 0:
+                    cursor.execute("INSERT INTO main.sqlite_sequence (name, seq) VALUES (?, ?)",
+                                   (staging, archived_max[table]))
+            # Drops the table's old indexes and its kpi / change-capture triggers with it
+            cursor.execute(f"DROP TABLE main.{table}")
+            cursor.execute(f"ALTER TABLE main.{staging} RENAME TO {table}")
+            rebuilt.append(table)
+        if rebuilt:
+            for index_sql in JOIN_TABLE_INDEXES:
+                cursor.execute(index_sql)
+            for trigger_sql in KPI_TRIGGERS:
+                cursor.execute(trigger_sql)
+            for trigger_sql in _cdc_trigger_sql(cursor):
+                cursor.execute(trigger_sql)
+        cursor.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return rebuilt
+
+@write_op
+def create_farmer(cursor, first_name, last_name, email, country, city, gender, phone_number):
     farmer_id = generate_id("farmer")
     cursor.execute("""
         INSERT INTO farmers (id, first_name, last_name, email, country, city, gender, phone_number)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?)
     """, (farmer_id, first_name, last_name, email, country, city, gender, phone_number))
-    conn.commit()
-    conn.close()
+    return farmer_id
+
+FARMER_FIELDS = ["first_name", "last_name", "email", "country", "city", "gender", "phone_number"]
+
+@write_op
+def create_farmers(cursor, farmers):
+    """
+    Registers many farmers in one transaction.
+    farmers: list of dicts keyed by FARMER_FIELDS (missing fields are stored as NULL)
+    Returns the new farmer ids in input order.
+    """
+    farmer_ids = [generate_id("farmer") for _ in farmers]
+    cursor.executemany("""
+        INSERT INTO farmers (id, first_name, last_name, email, country, city, gender, phone_number)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (fid, *(f.get(field) for field in FARMER_FIELDS))
+        for fid, f in zip(farmer_ids, farmers)
+    ])
+    return farmer_ids
 
 def get_all_farmers():
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT id, first_name, last_name, email, country, city, gender, phone_number, created_at
@@ -226,11 +988,12 @@ def get_all_farmers():
     return pd.DataFrame(rows, columns=col_names)
 
 def generate_id(prefix):
-    return f"{prefix}_{uuid.uuid4().hex}"
+    """prefix_ plus a time-ordered ULID (database/ids.py), e.g. sack_01jae5v3w8k2m9q4r7t0xyzabc"""
+    return f"{prefix}_{new_ulid()}"
 
 
 def get_farmer_list():
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id, first_name, last_name FROM farmers ORDER BY last_name ASC")
     rows = cursor.fetchall()
@@ -238,10 +1001,8 @@ def get_farmer_list():
     return [(row[0], f"{row[1]} {row[2]}") for row in rows]
 
 
-def create_sack_and_mint_token(farmer_id, weight_kg, value_paid, warehouse, delivered_at=None):
-    conn = get_connection()
-    cursor = conn.cursor()
-
+@write_op
+def create_sack_and_mint_token(cursor, farmer_id, weight_kg, value_paid, warehouse, delivered_at=None):
     sack_id = generate_id("sack")
     if not delivered_at:
         cursor.execute("""
@@ -260,12 +1021,101 @@ def create_sack_and_mint_token(farmer_id, weight_kg, value_paid, warehouse, deli
         VALUES (?, 'debt', ?, ?)
     """, (farmer_id, value_paid, f"Debt token minted for sack {sack_id}"))
 
-    conn.commit()
-    conn.close()
     return sack_id
 
+# Keeps IN (...) lists well under SQLite's bound-parameter limit
+IN_CHUNK_SIZE = 500
+
+def _existing_ids(cursor, table, column, values):
+    """Subset of values present in table.column, looked up in chunks."""
+    values = list(values)
+    found = set()
+    for i in range(0, len(values), IN_CHUNK_SIZE):
+        chunk = values[i:i + IN_CHUNK_SIZE]
+        cursor.execute(f"""
+            SELECT {column} FROM {table} WHERE {column} IN ({",".join("?" * len(chunk))})
+        """, chunk)
+        found.update(r[0] for r in cursor.fetchall())
+    return found
+
+@write_op
+def create_sacks_and_mint_tokens(cursor, deliveries):
+    """
+    Records many sack deliveries and their debt tokens in one transaction.
+    deliveries: list of dicts with farmer_id, weight_kg, value_paid, warehouse
+                and optionally delivered_at (defaults to now)
+    Returns the new sack ids in input order. Raises ValueError, writing
+    nothing, if any farmer_id is unknown.
+    """
+    farmer_ids = {d["farmer_id"] for d in deliveries}
+    unknown = farmer_ids - _existing_ids(cursor, "farmers", "id", farmer_ids)
+    if unknown:
+        raise ValueError(f"Unknown farmer_id: {', '.join(sorted(unknown))}")
+    return _insert_sacks_with_tokens(cursor, deliveries)
+
+def _insert_sacks_with_tokens(cursor, deliveries):
+    sack_ids = [generate_id("sack") for _ in deliveries]
+    cursor.executemany("""
+        INSERT INTO sacks (id, farmer_id, weight_kg, value_paid, delivered_at, warehouse, debt_token_minted)
+        VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?, 1)
+    """, [
+        (sid, d["farmer_id"], d["weight_kg"], d["value_paid"], d.get("delivered_at"), d["warehouse"])
+        for sid, d in zip(sack_ids, deliveries)
+    ])
+    cursor.executemany("""
+        INSERT INTO tokens (farmer_id, token_type, amount, description)
+        VALUES (?, 'debt', ?, ?)
+    """, [
+        (d["farmer_id"], d["value_paid"], f"Debt token minted for sack {sid}")
+        for sid, d in zip(sack_ids, deliveries)
+    ])
+
+    return sack_ids
+
+@write_op
+def apply_offline_deliveries(cursor, device_id, deliveries):
+    """
+    Applies deliveries recorded offline on a field device, in one transaction.
+    Each delivery carries a device-generated client_id; one already applied
+    (a retried upload) is reported again instead of being recorded twice.
+    deliveries: list of dicts with client_id plus the create_sacks_and_mint_tokens fields
+    Returns {"applied": {client_id: sack_id}, "duplicates": {client_id: sack_id},
+             "rejected": {client_id: reason}}.
+    """
+    result = {"applied": {}, "duplicates": {}, "rejected": {}}
+
+    # Same client_id twice in one upload: keep the first
+    unique = {}
+    for d in deliveries:
+        unique.setdefault(d["client_id"], d)
+
+    client_ids = list(unique)
+    for i in range(0, len(client_ids), IN_CHUNK_SIZE):
+        chunk = client_ids[i:i + IN_CHUNK_SIZE]
+        cursor.execute(f"""
+            SELECT client_id, sack_id FROM sync_receipts
+            WHERE client_id IN ({",".join("?" * len(chunk))})
+        """, chunk)
+        result["duplicates"].update(cursor.fetchall())
+
+    pending = [d for cid, d in unique.items() if cid not in result["duplicates"]]
+    known_farmers = _existing_ids(cursor, "farmers", "id", {d["farmer_id"] for d in pending})
+    new = []
+    for d in pending:
+        if d["farmer_id"] in known_farmers:
+            new.append(d)
+        else:
+            result["rejected"][d["client_id"]] = f"Unknown farmer_id {d['farmer_id']}"
+
+    sack_ids = _insert_sacks_with_tokens(cursor, new)
+    cursor.executemany("""
+        INSERT INTO sync_receipts (client_id, device_id, sack_id) VALUES (?, ?, ?)
+    """, [(d["client_id"], device_id, sid) for d, sid in zip(new, sack_ids)])
+    result["applied"] = {d["client_id"]: sid for d, sid in zip(new, sack_ids)}
+    return result
+
 def get_sacks_by_farmer(farmer_id):
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT id, weight_kg, value_paid, warehouse, delivered_at
@@ -280,7 +1130,7 @@ def get_sacks_by_farmer(farmer_id):
 
 
 def get_unbagged_sacks():
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT s.id, f.first_name || ' ' || f.last_name AS farmer_name,
@@ -295,77 +1145,140 @@ def get_unbagged_sacks():
     conn.close()
     return pd.DataFrame(rows, columns=col_names)
 
-def create_bag_with_sacks(sack_allocations):
-    conn = get_connection()
+@write_op
+def create_bag_with_sacks(cursor, sack_allocations):
+    return _insert_bag(cursor, sack_allocations)
+
+# Weight left over from float rounding when a sack was split, not a remainder
+BAGGED_EPS_KG = 1e-6
+
+def get_unbagged_sacks_grouped():
+    """
+    (sack_id, kg not yet in a bag, warehouse, delivery_date) for every sack
+    with weight left to bag. A sack split across bags only partly bagged (a
+    run stopped between them) is returned with its remainder.
+    """
+    conn = get_read_connection()
     cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, remaining_kg, warehouse, delivery_date FROM (
+            SELECT s.id,
+                   s.weight_kg - COALESCE((SELECT SUM(bs.allocated_weight_kg)
+                                             FROM bag_sacks bs WHERE bs.sack_id = s.id), 0) AS remaining_kg,
+                   s.warehouse, DATE(s.delivered_at) AS delivery_date, s.delivered_at
+            FROM sacks s
+        )
+        WHERE remaining_kg > ?
+        ORDER BY warehouse, delivery_date, delivered_at ASC
+    """, (BAGGED_EPS_KG,))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
 
+def _insert_bag(cursor, sack_allocations):
     bag_id = generate_id("bag")
     cursor.execute("INSERT INTO bags (id) VALUES (?)", (bag_id,))
-
     for sack_id, allocated_weight in sack_allocations:
         cursor.execute("""
             INSERT INTO bag_sacks (bag_id, sack_id, allocated_weight_kg)
             VALUES (?, ?, ?)
         """, (bag_id, sack_id, allocated_weight))
-
-
-    conn.commit()
-    conn.close()
+        cursor.execute("""
+            INSERT OR IGNORE INTO sack_lineage (sack_id, entity_type, entity_id)
+            VALUES (?, 'bag', ?)
+        """, (sack_id, bag_id))
     return bag_id
 
-def get_unbagged_sacks_grouped():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT s.id, s.weight_kg, s.warehouse, DATE(s.delivered_at) AS delivery_date
-        FROM sacks s
-        WHERE s.id NOT IN (SELECT sack_id FROM bag_sacks)
-        ORDER BY s.warehouse, delivery_date, delivered_at ASC
-    """)
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
-
-
-def auto_fill_bags():
-    sacks = get_unbagged_sacks_grouped()
+@write_op
+def create_planned_bags(cursor, bags):
+    """
+    Creates a group's planned bags (lists of (sack_id, kg)) in one
+    transaction, so a sack split across them is bagged in full or not at all.
+    If another run has bagged any of the sacks since the plan was made,
+    nothing is written and [] is returned; the next run picks them up.
+    """
+    planned = {}
+    for allocations in bags:
+        for sack_id, kg in allocations:
+            planned[sack_id] = planned.get(sack_id, 0) + kg
+    sack_ids = list(planned)
+    for i in range(0, len(sack_ids), IN_CHUNK_SIZE):
+        chunk = sack_ids[i:i + IN_CHUNK_SIZE]
+        cursor.execute(f"""
+            SELECT s.id, s.weight_kg - COALESCE(SUM(bs.allocated_weight_kg), 0)
+              FROM sacks s LEFT JOIN bag_sacks bs ON bs.sack_id = s.id
+             WHERE s.id IN ({",".join("?" * len(chunk))})
+             GROUP BY s.id
+        """, chunk)
+        remaining = dict(cursor.fetchall())
+        if any(planned[sack_id] > remaining.get(sack_id, 0) + BAGGED_EPS_KG for sack_id in chunk):
+            return []
+    return [_insert_bag(cursor, allocations) for allocations in bags]
+
+
+def plan_bags(mode="greedy"):
+    """
+    The bags auto_fill_bags(mode=mode) would create right now, without
+    writing anything: {(warehouse, date): [[(sack_id, kg), ...], ...]}.
+    mode: a key of BAG_PACKING_MODES ('greedy' or 'best_fit').
+    """
+    if mode not in BAG_PACKING_MODES:
+        raise ValueError(f"Unknown packing mode '{mode}'")
+    pack = BAG_PACKING_MODES[mode]
+    grouped = group_sacks_for_bagging(get_unbagged_sacks_grouped())
+    return {key: pack(sack_list) for key, sack_list in grouped.items()}
 
-    # Group by (warehouse, delivery_date)
-    grouped = {}
-    for sack_id, weight, warehouse, date in sacks:
-        key = (warehouse, date)
-        grouped.setdefault(key, []).append((sack_id, weight))
+def preview_bag_packing(modes=tuple(BAG_PACKING_MODES)):
+    """
+    {mode: bag_packing_stats} for packing every unbagged sack with each mode,
+    so the modes can be compared before any bag is created.
+    """
+    grouped = group_sacks_for_bagging(get_unbagged_sacks_grouped())
+    preview = {}
+    for mode in modes:
+        pack = BAG_PACKING_MODES[mode]
+        preview[mode] = bag_packing_stats([bag for sacks in grouped.values() for bag in pack(sacks)])
+    return preview
+
+def auto_fill_bags(progress=None, mode="greedy"):
+    """
+    Packs every unbagged sack into 63 kg bags per (warehouse, date).
+    mode: 'greedy' fills bags in delivery order, splitting a sack whenever it
+          does not fit; 'best_fit' uses the same number of bags but splits far
+          fewer sacks (see allocation.pack_sacks_best_fit).
+    progress: optional callback(fraction, message), called after each group.
+    Each group is committed whole, and only weight not yet in a bag is packed,
+    so a run that stops partway can simply be run again.
+    """
+    planned = plan_bags(mode)
 
     created_bag_ids = []
-
-    for (warehouse, date), sack_list in grouped.items():
-        allocations = []
-        current_weight = 0
-
-        for sack_id, weight in sack_list:
-            remaining = weight
-            while remaining > 0:
-                space_left = 63 - current_weight
-                if space_left <= 0:
-                    if allocations:
-                        bag_id = create_bag_with_sacks(allocations)
-                        created_bag_ids.append(bag_id)
-                    allocations = []
-                    current_weight = 0
-                    space_left = 63
-                portion = min(space_left, remaining)
-                allocations.append((sack_id, portion))
-                current_weight += portion
-                remaining -= portion
-
-        if allocations:
-            bag_id = create_bag_with_sacks(allocations)
-            created_bag_ids.append(bag_id)
+    for i, bags in enumerate(planned.values(), 1):
+        created_bag_ids.extend(create_planned_bags(bags))
+        if progress:
+            progress(i / len(planned), f"{len(created_bag_ids)} bags created")
 
     return created_bag_ids
 
+def get_bag_packing_stats(bag_ids):
+    """bag_packing_stats (bags, split sacks, fill ratios) for bags already in the database."""
+    bag_ids = list(bag_ids)
+    conn = get_read_connection()
+    cursor = conn.cursor()
+    contents = {}
+    for i in range(0, len(bag_ids), IN_CHUNK_SIZE):
+        chunk = bag_ids[i:i + IN_CHUNK_SIZE]
+        cursor.execute(f"""
+            SELECT bag_id, sack_id, allocated_weight_kg FROM bag_sacks
+            WHERE bag_id IN ({",".join("?" * len(chunk))})
+        """, chunk)
+        for bag_id, sack_id, kg in cursor.fetchall():
+            contents.setdefault(bag_id, []).append((sack_id, kg))
+    conn.close()
+    return bag_packing_stats(list(contents.values()))
+
 def get_all_bags():
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT id, created_at
@@ -377,7 +1290,7 @@ def get_all_bags():
     return rows
 
 def get_sacks_for_bag(bag_id):
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT
@@ -419,14 +1332,20 @@ def get_sacks_for_bag(bag_id):
     return df
 
 def get_unbatched_bags():
-    conn = get_connection()
+    """
+    DataFrame of id, weight_kg, created_at, warehouse for every bag not yet in
+    a batch. warehouse is 'Mixed' for a bag holding sacks from several.
+    """
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("""
       SELECT b.id,
              SUM(bs.allocated_weight_kg) AS weight_kg,
-             b.created_at
+             b.created_at,
+             CASE WHEN COUNT(DISTINCT s.warehouse) > 1 THEN 'Mixed' ELSE MIN(s.warehouse) END AS warehouse
       FROM bags b
       LEFT JOIN bag_sacks bs ON b.id = bs.bag_id
+      LEFT JOIN sacks s ON bs.sack_id = s.id
       LEFT JOIN batch_bags bb ON b.id = bb.bag_id
       WHERE bb.batch_id IS NULL
       GROUP BY b.id
@@ -434,19 +1353,32 @@ def get_unbatched_bags():
     """)
     rows = cursor.fetchall()
     conn.close()
-    return pd.DataFrame(rows, columns=["id","weight_kg","created_at"])
+    return pd.DataFrame(rows, columns=["id","weight_kg","created_at","warehouse"])
+
+PRODUCT_TYPES = ("butter", "liquor", "powder")
 
 # 2. New: create_batch_with_bags()
-def create_batch_with_bags(bag_ids, product_type):
-    conn = get_connection()
-    cursor = conn.cursor()
+@write_op
+def create_batch_with_bags(cursor, bag_ids, product_type, weight_kg=None):
+    """
+    weight_kg: total weight of the bags when the caller already knows it
+    (e.g. from plan_batches); looked up otherwise.
+    """
+    if product_type not in PRODUCT_TYPES:
+        raise ValueError(f"Unknown product type '{product_type}'")
     batch_id = generate_id("batch")
 
     # compute total MT
-    df = get_unbatched_bags()
-    df_sel = df[df["id"].isin(bag_ids)]
-    total_kg = df_sel["weight_kg"].sum()
-    weight_mt = total_kg / 1000.0
+    if weight_kg is None:
+        weight_kg = 0.0
+        for i in range(0, len(bag_ids), IN_CHUNK_SIZE):
+            chunk = bag_ids[i:i + IN_CHUNK_SIZE]
+            cursor.execute(f"""
+                SELECT COALESCE(SUM(allocated_weight_kg), 0) FROM bag_sacks
+                 WHERE bag_id IN ({",".join("?" * len(chunk))})
+            """, chunk)
+            weight_kg += cursor.fetchone()[0]
+    weight_mt = weight_kg / 1000.0
 
     cursor.execute("""
       INSERT INTO batches (id, weight_mt, product_type)
@@ -458,14 +1390,13 @@ def create_batch_with_bags(bag_ids, product_type):
           INSERT INTO batch_bags (batch_id, bag_id)
           VALUES (?, ?)
         """, (batch_id, bid))
+        _link_lineage_from(cursor, "bag", bid, "batch", batch_id)
 
-    conn.commit()
-    conn.close()
     return batch_id
 
 # 3. New: get_all_batches()
 def get_all_batches():
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id, weight_mt, product_type, created_at FROM batches ORDER BY created_at DESC")
     rows = cursor.fetchall()
@@ -473,18 +1404,25 @@ def get_all_batches():
     return pd.DataFrame(rows, columns=["id","weight_mt","product_type","created_at"])
 
 # 4. Update: create_warrant_receipt()
-def create_warrant_receipt(receipt_type, covered_ids):
-    conn = get_connection()
+def create_warrant_receipt(receipt_type, covered_ids, receipt_id=None, progress=None):
+    """
+    receipt_id: optional pre-assigned id (lets a resumed job detect a finished receipt)
+    progress: optional callback(fraction, message), called after each covered bag/batch.
+    The valuation is read first; only the receipt itself is a write.
+    """
+    conn = get_read_connection()
     cursor = conn.cursor()
-    receipt_id = generate_id("warrant")
+    receipt_id = receipt_id or generate_id("warrant")
 
     total_value = 0.0
     if receipt_type == "pre-processing":
-        for bag_id in covered_ids:
+        for i, bag_id in enumerate(covered_ids, 1):
             df = get_sacks_for_bag(bag_id)
             total_value += df["allocated_value"].sum()
+            if progress:
+                progress(i / len(covered_ids), f"Valued {i} of {len(covered_ids)} bags")
     else:  # post-processing on batches
-        for batch_id in covered_ids:
+        for i, batch_id in enumerate(covered_ids, 1):
             # sum value across all bags in batch
             cursor.execute("""
               SELECT bs.sack_id
@@ -497,20 +1435,23 @@ def create_warrant_receipt(receipt_type, covered_ids):
                 cursor.execute("SELECT weight_kg, value_paid FROM sacks WHERE id = ?", (sack_id,))
                 w, v = cursor.fetchone()
                 total_value += v  # assume full-value on post
-    covered_json = json.dumps(covered_ids)
+            if progress:
+                progress(i / len(covered_ids), f"Valued {i} of {len(covered_ids)} batches")
+    conn.close()
+    return record_warrant_receipt(receipt_id, receipt_type, covered_ids, float(total_value))
+
+@write_op
+def record_warrant_receipt(cursor, receipt_id, receipt_type, covered_ids, total_value):
     cursor.execute("""
       INSERT INTO warrant_receipts (id, type, covered_ids, total_value)
       VALUES (?, ?, ?, ?)
-    """, (receipt_id, receipt_type, covered_json, total_value))
-
-    conn.commit()
-    conn.close()
+    """, (receipt_id, receipt_type, json.dumps(covered_ids), total_value))
     return receipt_id
 
 
 
 def get_warrant_receipts_by_type(receipt_type):
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT id, bags_covered
@@ -523,46 +1464,55 @@ def get_warrant_receipts_by_type(receipt_type):
     return [{"id": r[0], "bags": json.loads(r[1])} for r in rows]
 
 
-def auto_fill_batches():
+def plan_batches(group_by=None, min_fill=0.0):
+    """
+    The batches auto_fill_batches would create right now, without writing.
+    Unbatched bags are packed into 60 MT batches first-fit-decreasing
+    (allocation.pack_bags_ffd).
+    group_by: None to mix all bags, or 'warehouse' to only batch bags
+              from the same warehouse together
+    min_fill: batches filled below this fraction of 60 MT are left out, so
+              their bags wait for later deliveries
+    Returns a list of dicts: group, bag_ids, weight_kg, fill
+    """
+    if group_by not in (None, "warehouse"):
+        raise ValueError(f"Unknown batch grouping '{group_by}'")
+    df = get_unbatched_bags()
+    df["weight_kg"] = df["weight_kg"].fillna(0.0)
+    groups = df.groupby("warehouse", dropna=False) if group_by else [(None, df)]
+
+    planned = []
+    for group, bags in groups:
+        weights = dict(zip(bags["id"], bags["weight_kg"]))
+        for bag_ids in pack_bags_ffd(list(weights.items())):
+            weight_kg = float(sum(weights[b] for b in bag_ids))
+            fill = weight_kg / BATCH_CAPACITY_KG
+            if fill >= min_fill:
+                planned.append({"group": group, "bag_ids": bag_ids, "weight_kg": weight_kg, "fill": fill})
+    return planned
+
+def auto_fill_batches(progress=None, product_type="liquor", group_by=None, min_fill=0.0):
     """
-    Groups all unbatched bags into 60 MT batches automatically.
-    Any residual (<60 MT) stays unbatched.
+    Groups unbatched bags into 60 MT batches of the given product type, as
+    planned by plan_batches(group_by, min_fill).
+    progress: optional callback(fraction, message), called after each batch.
     """
-    df = get_unbatched_bags()  # returns DataFrame with columns ["id","weight_kg","created_at"]
-    # convert to list of (bag_id, weight_kg)
-    bag_list = list(df[["id","weight_kg"]].itertuples(index=False, name=None))
+    if product_type not in PRODUCT_TYPES:
+        raise ValueError(f"Unknown product type '{product_type}'")
+    planned = plan_batches(group_by, min_fill)
 
     created_batches = []
-    current_batch = []
-    current_kg = 0
-
-    for bag_id, kg in bag_list:
-        # if adding this bag would exceed 60 000 kg, close current batch
-        if current_kg + kg > 60000:
-            if current_batch:
-                batch_id = create_batch_with_bags(current_batch, product_type="liquor")  # or default
-                created_batches.append(batch_id)
-            current_batch = []
-            current_kg = 0
-        # if a single bag >60000, put it in its own batch
-        if kg > 60000:
-            big_batch_id = create_batch_with_bags([(bag_id, kg)], product_type="liquor")
-            created_batches.append(big_batch_id)
-            continue
-        # otherwise add to current
-        current_batch.append(bag_id)
-        current_kg += kg
-
-    # flush final
-    if current_batch:
-        batch_id = create_batch_with_bags(current_batch, product_type="liquor")
+    for batch in planned:
+        batch_id = create_batch_with_bags(batch["bag_ids"], product_type, weight_kg=batch["weight_kg"])
         created_batches.append(batch_id)
+        if progress:
+            progress(len(created_batches) / len(planned), f"{len(created_batches)} batches created")
 
     return created_batches
 
 
 def get_all_warrant_receipts():
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT id, type, issued_at, covered_ids, total_value
@@ -583,34 +1533,47 @@ def get_covered_ids_by_type(receipt_type):
     return covered
 
 
-def create_lender(wallet_address, initial_position):
+@write_op
+def create_lender(cursor, wallet_address, initial_position):
     """Register a new lender with a lending position."""
-    conn = get_connection()
-    cursor = conn.cursor()
     lender_id = generate_id("lender")
     cursor.execute("""
         INSERT INTO lenders (id, wallet_address, position, created_at)
         VALUES (?, ?, ?, CURRENT_TIMESTAMP)
     """, (lender_id, wallet_address, initial_position))
-    conn.commit()
-    conn.close()
     return lender_id
 
-def update_lender_position(lender_id, new_position):
-    """Updates the lending position for a given lender."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE lenders SET position = ? WHERE id = ?",
-        (new_position, lender_id)
-    )
-    conn.commit()
-    conn.close()
+@write_op
+def update_lender_position(cursor, lender_id, new_position, expected_position=None):
+    """
+    Updates the lending position for a given lender. With expected_position
+    (the position the caller last saw) the update only happens if nothing
+    has changed it since, e.g. a funding from another session; otherwise
+    ValueError, and the caller should reload and try again.
+    """
+    if new_position < 0:
+        raise ValueError("Position cannot be negative")
+    if expected_position is None:
+        cursor.execute(
+            "UPDATE lenders SET position = ? WHERE id = ?",
+            (new_position, lender_id)
+        )
+    else:
+        cursor.execute(
+            "UPDATE lenders SET position = ? WHERE id = ? AND ABS(position - ?) <= ?",
+            (new_position, lender_id, expected_position, FUNDING_EPS)
+        )
+    if cursor.rowcount == 0:
+        cursor.execute("SELECT position FROM lenders WHERE id = ?", (lender_id,))
+        pos = cursor.fetchone()
+        if pos is None:
+            raise ValueError(f"Lender {lender_id} not found")
+        raise ValueError(f"Position changed to {pos[0]:,.2f} since it was read; reload and try again")
 
 
 def get_all_lenders():
     """Return a DataFrame of all lenders including their remaining positions."""
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT id, wallet_address, position, created_at
@@ -622,76 +1585,193 @@ def get_all_lenders():
     conn.close()
     return pd.DataFrame(rows, columns=cols)
 
+# A bundle's value (its sacks) and what lenders have put in so far, each
+# summed on its own so neither total is multiplied by the other's rows
+BUNDLE_TOTALS_SQL = """
+    COALESCE((
+        SELECT SUM(s.value_paid)
+        FROM bundle_sacks bs
+        JOIN sacks s ON bs.sack_id = s.id
+        WHERE bs.bundle_id = b.id
+    ), 0.0) AS total_bundle_value,
+    COALESCE((
+        SELECT SUM(bl.amount)
+        FROM bundle_lenders bl
+        WHERE bl.bundle_id = b.id
+    ), 0.0) AS funded_amount
+"""
+
+# Funding within a kobo of the value counts as full
+FUNDING_EPS = 0.005
+
 def get_unfunded_bundles():
     """
     Return a DataFrame of bundles that are still 'unfunded' or 'partially funded',
     along with their total value and current funded amount.
     """
-    conn = get_connection()
-    # Using pd.read_sql_query for more concise aggregation and DataFrame creation
-    df = pd.read_sql_query("""
+    conn = get_read_connection()
+    df = pd.read_sql_query(f"""
         SELECT
             b.id,
             b.filter_type,
             b.filter_value,
             b.interest_rate,
             b.status,
-            -- Calculate total value of the bundle by summing the value_paid of its constituent sacks
-            COALESCE(SUM(s.value_paid), 0) AS total_bundle_value,
-            -- Calculate the total amount funded for this bundle
-            COALESCE(SUM(bl.amount), 0) AS funded_amount
+            b.created_at,
+            {BUNDLE_TOTALS_SQL}
         FROM bundles b
-        JOIN bundle_sacks bs ON b.id = bs.bundle_id -- Join to get sacks in the bundle
-        JOIN sacks s ON bs.sack_id = s.id           -- Join to get sack details (value_paid)
-        LEFT JOIN bundle_lenders bl ON b.id = bl.bundle_id -- LEFT JOIN to include bundles with no funding yet
-        WHERE b.status = 'unfunded' OR b.status = 'partially funded' -- Include both unfunded and partially funded bundles
-        GROUP BY b.id, b.filter_type, b.filter_value, b.interest_rate, b.status -- Group by all non-aggregated columns
+        WHERE b.status IN ('unfunded', 'partially funded')
+          AND EXISTS (SELECT 1 FROM bundle_sacks bs WHERE bs.bundle_id = b.id)
         ORDER BY b.id
     """, conn)
     conn.close()
     return df
 
 
-def fund_bundle(lender_id, bundle_id, amount):
+@write_op
+def fund_bundle(cursor, lender_id, bundle_id, amount):
     """
-    Record a lender’s funding of a bundle, decrement their position,
-    and mark the bundle as funded.
+    Record a lender’s funding of a bundle, decrement their position, and
+    mark the bundle 'funded' or 'partially funded' by what it now holds.
+    The position is only taken if it still covers the amount (checked in
+    the UPDATE itself), and the bundle must still need that much.
+    Returns the funding's bundle_lenders row id.
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    # check position
-    cursor.execute("SELECT position FROM lenders WHERE id = ?", (lender_id,))
-    pos = cursor.fetchone()
-    if pos is None:
-        conn.close()
-        raise ValueError(f"Lender {lender_id} not found")
-    if amount > pos[0]:
-        conn.close()
+    if amount <= 0:
+        raise ValueError("Funding amount must be positive")
+    cursor.execute("""
+        UPDATE lenders
+        SET position = position - ?
+        WHERE id = ? AND position >= ? - ?
+    """, (amount, lender_id, amount, FUNDING_EPS))
+    if cursor.rowcount == 0:
+        cursor.execute("SELECT position FROM lenders WHERE id = ?", (lender_id,))
+        pos = cursor.fetchone()
+        if pos is None:
+            raise ValueError(f"Lender {lender_id} not found")
         raise ValueError(f"Amount exceeds lender's available position ({pos[0]})")
 
+    bundle = _bundle_totals(cursor, [bundle_id]).get(bundle_id)
+    if bundle is None:
+        raise ValueError(f"Bundle {bundle_id} not found")
+    status, value, funded = bundle
+    if status not in ("unfunded", "partially funded"):
+        raise ValueError(f"Bundle {bundle_id} is already {status}")
+    if amount > value - funded + FUNDING_EPS:
+        raise ValueError(f"Bundle {bundle_id} only needs {max(0.0, value - funded):,.2f}")
+
     # record funding
     cursor.execute("""
         INSERT INTO bundle_lenders (bundle_id, lender_id, amount)
         VALUES (?, ?, ?)
     """, (bundle_id, lender_id, amount))
+    funding_id = cursor.lastrowid
+    _refresh_bundle_status(cursor, [bundle_id])
+    return funding_id
 
-    # decrement position
-    cursor.execute("""
+
+def plan_bundle_funding(rule="pro_rata", lender_ids=None, bundle_ids=None):
+    """
+    Proposes how to spread every lender's available position over the
+    bundles still short of their value, by one of allocation.FUNDING_RULES
+    (see allocate_funding). lender_ids / bundle_ids optionally restrict who
+    lends and what gets funded. Nothing is written; pass the result to
+    fund_bundles.
+    Returns [(lender_id, bundle_id, amount)].
+    """
+    lenders = get_all_lenders()
+    if lender_ids is not None:
+        lenders = lenders[lenders["id"].isin(lender_ids)]
+    bundles = get_unfunded_bundles().sort_values(["created_at", "id"], kind="stable")
+    if bundle_ids is not None:
+        bundles = bundles[bundles["id"].isin(bundle_ids)]
+    need = bundles["total_bundle_value"] - bundles["funded_amount"]
+    return allocate_funding(
+        list(zip(lenders["id"], lenders["position"])),
+        list(zip(bundles["id"], need, bundles["interest_rate"])),
+        rule,
+    )
+
+def _bundle_totals(cursor, bundle_ids):
+    """{bundle_id: (status, total_bundle_value, funded_amount)}, looked up in chunks."""
+    bundle_ids = list(bundle_ids)
+    found = {}
+    for i in range(0, len(bundle_ids), IN_CHUNK_SIZE):
+        chunk = bundle_ids[i:i + IN_CHUNK_SIZE]
+        cursor.execute(f"""
+            SELECT b.id, b.status, {BUNDLE_TOTALS_SQL}
+            FROM bundles b
+            WHERE b.id IN ({",".join("?" * len(chunk))})
+        """, chunk)
+        found.update((r[0], r[1:]) for r in cursor.fetchall())
+    return found
+
+def _refresh_bundle_status(cursor, bundle_ids):
+    """Sets each bundle's status from what it has been funded against its value (paid bundles are left alone)."""
+    updates = []
+    for bundle_id, (status, value, funded) in _bundle_totals(cursor, bundle_ids).items():
+        if status == "paid":
+            continue
+        if value > 0 and funded >= value - FUNDING_EPS:
+            new_status = "funded"
+        elif funded > 0:
+            new_status = "partially funded"
+        else:
+            new_status = "unfunded"
+        if new_status != status:
+            updates.append((new_status, bundle_id))
+    cursor.executemany("UPDATE bundles SET status = ? WHERE id = ?", updates)
+
+@write_op
+def fund_bundles(cursor, allocations):
+    """
+    Writes a funding plan (plan_bundle_funding) in one transaction: a
+    bundle_lenders row per (lender_id, bundle_id, amount), each lender's
+    position reduced by its total, and each bundle marked 'funded' or
+    'partially funded'. Raises ValueError, writing nothing, if a lender no
+    longer has the position or a bundle no longer needs the money (e.g. it
+    was funded since the plan was made).
+    Returns {"rows", "lenders", "bundles", "amount"}.
+    """
+    allocations = [(l, b, float(a)) for l, b, a in allocations]
+    if any(a < 0 for _, _, a in allocations):
+        raise ValueError("Funding amounts cannot be negative")
+    allocations = [(l, b, a) for l, b, a in allocations if a > 0]
+    lender_totals, bundle_totals = {}, {}
+    for lender_id, bundle_id, amount in allocations:
+        lender_totals[lender_id] = lender_totals.get(lender_id, 0.0) + amount
+        bundle_totals[bundle_id] = bundle_totals.get(bundle_id, 0.0) + amount
+
+    positions = _lookup(cursor, "SELECT id, position FROM lenders WHERE id IN ({marks})", lender_totals)
+    for lender_id, total in lender_totals.items():
+        if lender_id not in positions:
+            raise ValueError(f"Lender {lender_id} not found")
+        if total > positions[lender_id] + FUNDING_EPS:
+            raise ValueError(f"Lender {lender_id} is asked for {total:,.2f} but has {positions[lender_id]:,.2f}")
+    bundles = _bundle_totals(cursor, bundle_totals)
+    for bundle_id, total in bundle_totals.items():
+        if bundle_id not in bundles:
+            raise ValueError(f"Bundle {bundle_id} not found")
+        status, value, funded = bundles[bundle_id]
+        if status not in ("unfunded", "partially funded") or total > value - funded + FUNDING_EPS:
+            raise ValueError(f"Bundle {bundle_id} only needs {max(0.0, value - funded):,.2f}; rebuild the plan")
+
+    cursor.executemany("""
+        INSERT INTO bundle_lenders (bundle_id, lender_id, amount)
+        VALUES (?, ?, ?)
+    """, [(b, l, a) for l, b, a in allocations])
+    cursor.executemany("""
         UPDATE lenders
         SET position = position - ?
         WHERE id = ?
-    """, (amount, lender_id))
-
-    # mark bundle funded
-    cursor.execute("""
-        UPDATE bundles
-        SET status = 'funded'
-        WHERE id = ?
-    """, (bundle_id,))
-
-    conn.commit()
-    conn.close()
+    """, [(total, lender_id) for lender_id, total in lender_totals.items()])
+    _refresh_bundle_status(cursor, bundle_totals)
+    return {
+        "rows": len(allocations),
+        "lenders": len(lender_totals),
+        "bundles": len(bundle_totals),
+        "amount": sum(lender_totals.values()),
+    }
 
 
 def get_eligible_sacks_for_bundling(filter_type=None, filter_value=None):
@@ -699,43 +1779,33 @@ def get_eligible_sacks_for_bundling(filter_type=None, filter_value=None):
     Returns a DataFrame of unique sack IDs whose bags have a pre‐processing warrant
     and which have not yet been put in any bundle. Optionally filter by a farmer attribute.
     """
-    conn = get_connection()
-    # 1) Gather all pre‐processing‐covered bag IDs
-    cursor = conn.cursor()
-    cursor.execute("""
-      SELECT covered_ids
-      FROM warrant_receipts
-      WHERE type='pre-processing';
-    """)
-    covered = []
-    for (j,) in cursor.fetchall():
-        covered += json.loads(j)
-    covered = list(set(covered))
-    if not covered:
-        conn.close()
-        return pd.DataFrame(columns=["id","farmer_name","weight_kg","value_paid"])
-
-    # 2) Build the SQL with DISTINCT and exclusion of already-bundled sacks
-    placeholders = ",".join("?" for _ in covered)
-    query = f"""
+    # Bags covered by a pre-processing warrant, expanded from the receipts'
+    # JSON inside the query (no bound-parameter limit on how many) and joined
+    # from first so only their sacks are visited
+    query = """
+      WITH covered_bags (bag_id) AS (
+        SELECT DISTINCT covered.value
+        FROM warrant_receipts wr, json_each(wr.covered_ids) covered
+        WHERE wr.type = 'pre-processing'
+      )
       SELECT DISTINCT
         s.id AS id,
         f.first_name || ' ' || f.last_name AS farmer_name,
         s.weight_kg,
         s.value_paid,
         f.gender
-      FROM bag_sacks bs
-      JOIN sacks s   ON bs.sack_id = s.id
-      JOIN farmers f ON s.farmer_id = f.id
-      WHERE bs.bag_id IN ({placeholders})
-        AND s.id NOT IN (
+      FROM covered_bags cb
+      JOIN bag_sacks bs ON bs.bag_id = cb.bag_id
+      JOIN sacks s      ON bs.sack_id = s.id
+      JOIN farmers f    ON s.farmer_id = f.id
+      WHERE s.id NOT IN (
           SELECT sack_id
           FROM bundle_sacks
         )
     """
-    params = covered
+    params = []
 
-    # 3) Optionally filter by farmer attribute
+    # Optionally filter by farmer attribute
     if filter_type and filter_value:
         # Add a check for valid filter_type to prevent SQL injection
         if filter_type in ["country", "city", "gender", "farmer_name"]: # Ensure 'gender' is allowed
@@ -751,7 +1821,7 @@ def get_eligible_sacks_for_bundling(filter_type=None, filter_value=None):
             # You might want to raise an error or return an empty DataFrame here
             # For now, we'll just skip applying this specific filter.
 
-    conn = get_connection()
+    conn = get_read_connection()
     df = pd.read_sql_query(query, conn, params=params)
     conn.close()
     print("Rows fetched:", len(df), "Unique sacks:", df["id"].nunique())
@@ -759,39 +1829,73 @@ def get_eligible_sacks_for_bundling(filter_type=None, filter_value=None):
     # print("Rows fetched after de-dupe:", len(df), "Unique sacks:", df["id"].nunique())
     return df
 
-def create_bundle(filter_type, filter_value, interest_rate, sack_ids):
-    """Create a new bundle and attach matched sacks."""
-    conn = get_connection()
-    cursor = conn.cursor()
+def _insert_bundle(cursor, filter_type, filter_value, interest_rate, sack_ids):
     bundle_id = generate_id("bundle")
     cursor.execute("""
       INSERT INTO bundles (id, filter_type, filter_value, interest_rate, status)
       VALUES (?, ?, ?, ?, 'unfunded')
     """, (bundle_id, filter_type, filter_value, interest_rate))
-    for sid in sack_ids:
-        cursor.execute("""
-          INSERT INTO bundle_sacks (bundle_id, sack_id)
-          VALUES (?, ?)
-        """, (bundle_id, sid))
-    conn.commit()
-    conn.close()
+    cursor.executemany("""
+      INSERT INTO bundle_sacks (bundle_id, sack_id)
+      VALUES (?, ?)
+    """, [(bundle_id, sid) for sid in sack_ids])
+    cursor.executemany("""
+      INSERT OR IGNORE INTO sack_lineage (sack_id, entity_type, entity_id)
+      VALUES (?, 'bundle', ?)
+    """, [(sid, bundle_id) for sid in sack_ids])
     return bundle_id
 
+@write_op
+def create_bundle(cursor, filter_type, filter_value, interest_rate, sack_ids):
+    """Create a new bundle and attach matched sacks."""
+    return _insert_bundle(cursor, filter_type, filter_value, interest_rate, sack_ids)
+
+def plan_target_bundles(target_value, tolerance=0.02, count=1, filter_type=None, filter_value=None):
+    """
+    Picks eligible sacks (get_eligible_sacks_for_bundling with the same
+    filter) for up to count bundles, each worth target_value within
+    +/- tolerance (a fraction of the target), using the subset-sum
+    approximation in allocation.select_target_value. Stops early once the
+    sacks left cannot make another bundle within tolerance.
+    Returns a list of dicts: sack_ids, sacks, value
+    """
+    df = get_eligible_sacks_for_bundling(filter_type, filter_value)
+    ids = df["id"].to_numpy()
+    values = df["value_paid"].to_numpy(dtype=float)
+    available = np.ones(len(ids), dtype=bool)
+
+    plans = []
+    for _ in range(count):
+        pool = np.flatnonzero(available)
+        picked, total = select_target_value(values[pool], target_value)
+        if not len(picked) or target_value - total > tolerance * target_value:
+            break
+        plans.append({"sack_ids": ids[pool[picked]].tolist(), "sacks": len(picked), "value": total})
+        available[pool[picked]] = False
+    return plans
+
+@write_op
+def create_bundles(cursor, filter_type, filter_value, interest_rate, sack_id_lists):
+    """
+    Creates one bundle per list of sack ids, all in one transaction.
+    Raises ValueError, creating none, if a sack is listed twice or is
+    already in a bundle (e.g. bundled by someone else since the plan).
+    Returns the new bundle ids.
+    """
+    all_ids = [sid for sack_ids in sack_id_lists for sid in sack_ids]
+    if len(set(all_ids)) != len(all_ids):
+        raise ValueError("A sack is listed in more than one bundle")
+    taken = _existing_ids(cursor, "bundle_sacks", "sack_id", all_ids)
+    if taken:
+        raise ValueError(f"{len(taken)} sack(s) were bundled in the meantime; rebuild the plan")
+    return [
+        _insert_bundle(cursor, filter_type, filter_value, interest_rate, sack_ids)
+        for sack_ids in sack_id_lists
+    ]
 
-def create_tip(farmer_id, amount, description="Tip"):
-    conn = get_connection()
-    cursor = conn.cursor()
-    tip_id = generate_id("tip")
-    cursor.execute("""
-      INSERT INTO tips (id, farmer_id, amount, created_at)
-      VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-    """, (tip_id, farmer_id, amount))
-    conn.commit()
-    conn.close()
-    return tip_id
 
 def get_all_bundles_with_details():
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
 
     # Get all bundles
@@ -870,9 +1974,9 @@ def get_all_bundles_with_details():
 
         if total == 0: # Bundle might have no sacks or 0 value sacks
             return 'unfunded' # Or 'empty_bundle' if you want a distinct status
-        elif funded >= total:
+        elif funded >= total - FUNDING_EPS:
             return 'funded'
-        elif funded > 0 and funded < total:
+        elif funded > 0:
             return 'partially funded'
         else: # funded is 0 and total > 0
             return 'unfunded'
@@ -882,12 +1986,15 @@ def get_all_bundles_with_details():
     conn.close()
     return df_bundles
 
-def get_all_tokens():
-    conn = get_connection()
+TOKEN_COLUMNS = ["id", "farmer_id", "token_type", "amount", "created_at", "description"]
+
+def get_all_tokens(include_archive=False):
+    """Token history, newest first; include_archive adds archived seasons."""
+    source, attach = _listing_source("tokens", TOKEN_COLUMNS, include_archive)
+    conn = get_read_connection(attach)
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, farmer_id, token_type, amount, created_at, description
-        FROM tokens
+    cursor.execute(f"""
+        SELECT * FROM ({source})
         ORDER BY created_at DESC
     """)
     rows = cursor.fetchall()
@@ -896,59 +2003,52 @@ def get_all_tokens():
     return pd.DataFrame(rows, columns=cols)
 
 def get_token_balance_by_farmer(farmer_id):
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
+    # Archived tokens still count, through their per-farmer totals
     cursor.execute("""
-        SELECT token_type, SUM(amount) AS balance
-        FROM tokens
-        WHERE farmer_id = ?
+        SELECT token_type, SUM(amount) AS balance FROM (
+            SELECT token_type, amount FROM tokens WHERE farmer_id = ?
+            UNION ALL
+            SELECT token_type, amount FROM archived_token_totals WHERE farmer_id = ?
+        )
         GROUP BY token_type
-    """, (farmer_id,))
+    """, (farmer_id, farmer_id))
     rows = cursor.fetchall()
     conn.close()
     return pd.DataFrame(rows, columns=["token_type","balance"])
 
-def mint_internal_tokens(farmer_id, amount, description):
-    conn = get_connection()
-    cursor = conn.cursor()
+@write_op
+def mint_internal_tokens(cursor, farmer_id, amount, description):
     cursor.execute("""
         INSERT INTO tokens (farmer_id, token_type, amount, description)
         VALUES (?, 'internal', ?, ?)
     """, (farmer_id, amount, description))
-    conn.commit()
-    conn.close()
 
-def burn_debt_tokens(farmer_id, amount, description):
-    conn = get_connection()
-    cursor = conn.cursor()
+@write_op
+def burn_debt_tokens(cursor, farmer_id, amount, description):
     cursor.execute("""
         INSERT INTO tokens (farmer_id, token_type, amount, description)
         VALUES (?, 'debt', ?, ?)
     """, (farmer_id, -abs(amount), description))
-    conn.commit()
-    conn.close()
 
 
-def burn_internal_tokens(farmer_id, amount, description):
+@write_op
+def burn_internal_tokens(cursor, farmer_id, amount, description):
     """
     Inserts a negative‐amount ‘internal’ token to reduce the farmer’s internal balance.
     """
-    conn = get_connection()
-    cursor = conn.cursor()
     cursor.execute("""
         INSERT INTO tokens (farmer_id, token_type, amount, description)
         VALUES (?, 'internal', ?, ?)
     """, (farmer_id, -abs(amount), description))
-    conn.commit()
-    conn.close()
 
-def create_tip(farmer_id, amount, description="Tip"):
+@write_op
+def create_tip(cursor, farmer_id, amount, description="Tip"):
     """
     Records a tip and mints the same amount of internal tokens.
     """
     tip_id = generate_id("tip")
-    conn = get_connection()
-    cursor = conn.cursor()
 
     # 1) Record tip
     cursor.execute("""
@@ -962,15 +2062,13 @@ def create_tip(farmer_id, amount, description="Tip"):
         VALUES (?, 'internal', ?, ?)
     """, (farmer_id, amount, f"Tip {tip_id}: {description}"))
 
-    conn.commit()
-    conn.close()
     return tip_id
 
 def get_all_tips():
     """
     Returns a DataFrame of all tips, with farmer names.
     """
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT
@@ -991,8 +2089,12 @@ def get_all_tips():
 
 def get_sacks_for_batch(batch_id):
     """Returns DataFrame with sack_id, farmer_id, farmer_name, allocated_value for a batch."""
-    conn = get_connection()
-    cursor = conn.cursor()
+    conn = get_read_connection()
+    df = _sacks_for_batch(conn.cursor(), batch_id)
+    conn.close()
+    return df
+
+def _sacks_for_batch(cursor, batch_id):
     cursor.execute("""
         SELECT
           s.id      AS sack_id,
@@ -1008,9 +2110,7 @@ def get_sacks_for_batch(batch_id):
     """, (batch_id,))
     rows = cursor.fetchall()
     cols = [d[0] for d in cursor.description]
-    conn.close()
-    df = pd.DataFrame(rows, columns=cols)
-    return df
+    return pd.DataFrame(rows, columns=cols)
 
 
 def get_lenders_for_batch(batch_id):
@@ -1018,34 +2118,42 @@ def get_lenders_for_batch(batch_id):
     Returns list of dicts: {
       lender_id, principal_amount, interest_rate
     }
-    for all lenders who funded any bundle whose sacks appear in this batch.
+    for all lenders who funded any bundle whose sacks appear in this batch
+    and which has not been paid back yet.
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    conn = get_read_connection()
+    lenders = _lenders_for_batch(conn.cursor(), batch_id)
+    conn.close()
+    return lenders
+
+def _lenders_for_batch(cursor, batch_id):
     cursor.execute("""
-      SELECT DISTINCT bl.lender_id, bl.amount, b.interest_rate
+      SELECT bl.lender_id, SUM(bl.amount), b.interest_rate
       FROM bundle_lenders bl
-      JOIN bundle_sacks bs ON bl.bundle_id = bs.bundle_id
-      JOIN batch_bags bb   ON bs.sack_id IN (
-         SELECT bs2.sack_id
-         FROM batch_bags bb2
-         JOIN bag_sacks bs2 ON bb2.bag_id = bs2.bag_id
-         WHERE bb2.batch_id = ?
-      )
       JOIN bundles b ON bl.bundle_id = b.id
+      WHERE b.status != 'paid'
+        AND bl.bundle_id IN (
+         SELECT bnd.entity_id
+         FROM sack_lineage bat
+         JOIN sack_lineage bnd
+           ON bnd.sack_id = bat.sack_id AND bnd.entity_type = 'bundle'
+         WHERE bat.entity_type = 'batch' AND bat.entity_id = ?
+      )
+      GROUP BY bl.bundle_id, bl.lender_id
     """, (batch_id,))
     rows = cursor.fetchall()
-    conn.close()
     return [{"lender_id": r[0], "principal": r[1], "interest_rate": r[2]} for r in rows]
 
 
-def get_or_create_ecowise_farmer():
+@write_op
+def get_or_create_ecowise_farmer(cursor):
     """
     Ensures there is exactly one farmer record named “EcoWise Enterprise”,
     and returns its id.
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    return _ecowise_farmer_id(cursor)
+
+def _ecowise_farmer_id(cursor):
     cursor.execute("""
         SELECT id
           FROM farmers
@@ -1061,23 +2169,117 @@ def get_or_create_ecowise_farmer():
             INSERT INTO farmers (id, first_name, last_name)
             VALUES (?, 'EcoWise', 'Enterprise')
         """, (eco_id,))
-        conn.commit()
-    conn.close()
     return eco_id
 
 
-def create_invoice(batch_ids, amount_paid, percent_to_farmers):
+def get_settlement_inputs(batch_ids):
+    """
+    Loads what settle_invoice needs for each batch: the value every farmer
+    contributed and the lenders who funded bundles containing its sacks.
+    """
+    conn = get_read_connection()
+    inputs = _settlement_inputs(conn.cursor(), batch_ids)
+    conn.close()
+    return inputs
+
+def _settlement_inputs(cursor, batch_ids):
+    inputs = []
+    for batch_id in batch_ids:
+        sacks_df = _sacks_for_batch(cursor, batch_id)
+        farmer_values = sacks_df.groupby("farmer_id")["allocated_value"].sum().to_dict()
+        inputs.append({
+            "batch_id": batch_id,
+            "farmer_values": farmer_values,
+            "lenders": _lenders_for_batch(cursor, batch_id),
+        })
+    return inputs
+
+
+SIMULATION_COLUMNS = ["role", "id", "name", "debt_burned", "bonus", "repayment", "received"]
+
+def _lookup(cursor, sql, values):
+    """Runs sql, whose IN list is written as {marks}, over values in chunks; returns its (key, value) rows as a dict."""
+    values = list(values)
+    found = {}
+    for i in range(0, len(values), IN_CHUNK_SIZE):
+        chunk = values[i:i + IN_CHUNK_SIZE]
+        cursor.execute(sql.format(marks=",".join("?" * len(chunk))), chunk)
+        found.update(cursor.fetchall())
+    return found
+
+def simulate_invoice(batch_ids, amount_paid, percent_to_farmers, inputs=None):
+    """
+    Dry run of create_invoice: runs the same settle_invoice engine and writes
+    nothing. inputs is get_settlement_inputs(batch_ids), passed in to reuse it
+    across repeated previews (e.g. while a slider moves); loaded when omitted.
+
+    Returns a DataFrame with one row per farmer, lender and EcoWise:
+    role, id, name, debt_burned, bonus, repayment, received
+    (received = bonus + repayment, the money that actually moves).
+    """
+    if inputs is None:
+        inputs = get_settlement_inputs(batch_ids)
+    totals = settlement_totals(settle_invoice(inputs, amount_paid, percent_to_farmers))
+
+    farmer_ids = set()
+    lender_ids = set()
+    for batch in inputs:
+        farmer_ids.update(batch["farmer_values"])
+        lender_ids.update(l["lender_id"] for l in batch["lenders"])
+
+    conn = get_read_connection()
+    cursor = conn.cursor()
+    farmer_names = _lookup(cursor, """
+        SELECT id, first_name || ' ' || last_name FROM farmers WHERE id IN ({marks})
+    """, farmer_ids)
+    lender_wallets = _lookup(cursor, """
+        SELECT id, wallet_address FROM lenders WHERE id IN ({marks})
+    """, lender_ids)
+    conn.close()
+
+    rows = []
+    for farmer_id in sorted(farmer_ids, key=lambda f: farmer_names.get(f, f)):
+        burned = totals["burns"].get(farmer_id, 0.0)
+        bonus = totals["bonuses"].get(farmer_id, 0.0)
+        rows.append(("farmer", farmer_id, farmer_names.get(farmer_id), burned, bonus, 0.0, bonus))
+    for lender_id in sorted(lender_ids):
+        repaid = totals["lender_payments"].get(lender_id, 0.0)
+        rows.append(("lender", lender_id, lender_wallets.get(lender_id), 0.0, 0.0, repaid, repaid))
+    rows.append(("ecowise", None, "EcoWise Enterprise", 0.0, totals["to_ecowise"], 0.0, totals["to_ecowise"]))
+    return pd.DataFrame(rows, columns=SIMULATION_COLUMNS)
+
+@write_op
+def create_invoice(cursor, batch_ids, amount_paid, percent_to_farmers, invoice_id=None):
     """
     batch_ids: list of batch_id strings
     amount_paid: total invoice amount
     percent_to_farmers: integer 0–100
+    invoice_id: optional pre-assigned id (lets a resumed job detect a finished invoice)
+
+    Everything is written in one write_op, so an interrupted run leaves no
+    partial settlement behind, and the settlement is worked out under the
+    same write lock so no other write can change it before it is applied. An
+    invoice_id that already exists is returned without settling anything twice.
     """
-    eco_id = get_or_create_ecowise_farmer()
-    conn = get_connection()
-    cursor = conn.cursor()
-    invoice_id = generate_id("invoice")
+    eco_id = _ecowise_farmer_id(cursor)
+    invoice_id = invoice_id or generate_id("invoice")
+    return _apply_invoice(cursor, eco_id, invoice_id, batch_ids, amount_paid, percent_to_farmers)
 
-    # 1) Record invoice
+def _apply_invoice(cursor, eco_id, invoice_id, batch_ids, amount_paid, percent_to_farmers):
+    cursor.execute("""
+        SELECT EXISTS (SELECT 1 FROM invoices WHERE id = ?)
+            OR EXISTS (SELECT 1 FROM archived_entities WHERE entity_type = 'invoice' AND entity_id = ?)
+    """, (invoice_id, invoice_id))
+    if cursor.fetchone()[0]:
+        return invoice_id
+
+    # 1) Work out every burn, repayment and bonus up front, on this cursor so
+    # the writes of earlier ops in the same group (fundings, paid bundles) count
+    settlement = settle_invoice(
+        _settlement_inputs(cursor, batch_ids), amount_paid, percent_to_farmers
+    )
+
+    # 2) Record invoice
     cursor.execute("""
       INSERT INTO invoices
         (id, amount_paid, amount_remaining, percent_to_farmers, covered_batches)
@@ -1089,119 +2291,77 @@ def create_invoice(batch_ids, amount_paid, percent_to_farmers):
       percent_to_farmers / 100.0,
       json.dumps(batch_ids)
     ))
-    conn.commit()
-
-    remaining = amount_paid
-
-    # 2) Process each batch in order
     for batch_id in batch_ids:
-        if remaining <= 0:
-            break
-
-        # -- load all sacks & their allocated_value for this batch
-        sacks_df = get_sacks_for_batch(batch_id)
-        batch_value = sacks_df["allocated_value"].sum()
+        _link_lineage_from(cursor, "batch", batch_id, "invoice", invoice_id)
 
-        # how much of 'remaining' applies to this batch
-        allocate = min(remaining, batch_value)
-        remaining -= allocate
+    # 3) Apply each batch's share
+    for entry in settlement:
+        batch_id = entry["batch_id"]
 
         # -- burn debt tokens for farmers pro rata
-        for farmer_id, group in sacks_df.groupby("farmer_id"):
-            farmer_value = group["allocated_value"].sum()
-            burn_amt = allocate * (farmer_value / batch_value)
+        for farmer_id, burn_amt in entry["burns"].items():
             cursor.execute("""
               INSERT INTO tokens (farmer_id, token_type, amount, description)
               VALUES (?, 'debt', ?, ?)
             """, (farmer_id, -burn_amt, f"Invoice {invoice_id}: debt burn for batch {batch_id}"))
 
-        # -- repay lenders principal + interest pro rata
-        lenders = get_lenders_for_batch(batch_id)
-        total_principal = sum(l["principal"] for l in lenders)
-        paid_to_lenders = 0.0
-        for l in lenders:
-            frac = l["principal"] / total_principal
-            pay_principal = allocate * frac
-            pay_interest  = pay_principal * l["interest_rate"] / 100.0
-            pay_total     = pay_principal + pay_interest
-            paid_to_lenders += pay_total
-
-            # credit back lender position
+        # -- credit back lender positions with principal + interest
+        for lender_id, pay_total in entry["lender_payments"].items():
             cursor.execute("""
               UPDATE lenders
               SET position = position + ?
               WHERE id = ?
-            """, (pay_total, l["lender_id"]))
+            """, (pay_total, lender_id))
 
-        # -- mark related bundles as paid
+        # -- mark related bundles as paid (their lenders are repaid only once:
+        # _lenders_for_batch leaves out bundles already paid)
         cursor.execute("""
           UPDATE bundles
           SET status = 'paid'
-          WHERE id IN (
-            SELECT DISTINCT bs.bundle_id
-            FROM bundle_sacks bs
-            JOIN batch_bags bb ON bs.sack_id IN (
-              SELECT bs2.sack_id
-              FROM batch_bags bb2
-              JOIN bag_sacks bs2 ON bb2.bag_id = bs2.bag_id
-              WHERE bb2.batch_id = ?
-            )
+          WHERE status != 'paid' AND id IN (
+            SELECT bnd.entity_id
+            FROM sack_lineage bat
+            JOIN sack_lineage bnd
+              ON bnd.sack_id = bat.sack_id AND bnd.entity_type = 'bundle'
+            WHERE bat.entity_type = 'batch' AND bat.entity_id = ?
           )
         """, (batch_id,))
 
-        # -- allocate remainder
-        remainder_after_lenders = allocate - paid_to_lenders
-        if remainder_after_lenders < 0:
-            remainder_after_lenders = 0
-
-        to_farmers = remainder_after_lenders * (percent_to_farmers / 100.0)
-        to_ecowise = remainder_after_lenders - to_farmers
-
         # a) credit farmers pro rata if there's anything left
-        if to_farmers > 0:
-            for farmer_id, group in sacks_df.groupby("farmer_id"):
-                farmer_value = group["allocated_value"].sum()
-                fam_amt = to_farmers * (farmer_value / batch_value)
-                cursor.execute("""
-                  INSERT INTO tokens (farmer_id, token_type, amount, description)
-                  VALUES (?, 'internal', ?, ?)
-                """, (
-                    farmer_id,
-                    fam_amt,
-                    f"Invoice {invoice_id}: bonus for batch {batch_id}"
-                ))
+        for farmer_id, fam_amt in entry["bonuses"].items():
+            cursor.execute("""
+              INSERT INTO tokens (farmer_id, token_type, amount, description)
+              VALUES (?, 'internal', ?, ?)
+            """, (
+                farmer_id,
+                fam_amt,
+                f"Invoice {invoice_id}: bonus for batch {batch_id}"
+            ))
 
         # b) credit EcoWise only if there's remainder
-        if to_ecowise > 0:
+        if entry["to_ecowise"] > 0:
             cursor.execute("""
               INSERT INTO tokens (farmer_id, token_type, amount, description)
               VALUES (?, 'internal', ?, ?)
             """, (
                 eco_id,
-                to_ecowise,
+                entry["to_ecowise"],
                 f"Invoice {invoice_id}: EcoWise remainder for batch {batch_id}"
             ))
 
-        conn.commit()
-
-    conn.close()
     return invoice_id
 
-def get_all_invoices():
+INVOICE_COLUMNS = ["id", "amount_paid", "amount_remaining", "percent_to_farmers", "covered_batches", "created_at"]
+
+def get_all_invoices(include_archive=False):
     """
-    Returns a DataFrame of all invoices.
+    Returns a DataFrame of all invoices; include_archive adds archived seasons.
     """
-    conn = get_connection()
+    source, attach = _listing_source("invoices", INVOICE_COLUMNS, include_archive)
+    conn = get_read_connection(attach)
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT
-            id,
-            amount_paid,
-            amount_remaining,
-            percent_to_farmers,
-            covered_batches,
-            created_at
-        FROM invoices
+    cursor.execute(f"""
+        SELECT * FROM ({source})
         ORDER BY created_at DESC
     """)
     rows = cursor.fetchall()
@@ -1214,7 +2374,7 @@ def get_sack_ownership(sack_id):
     """
     Returns the farmer who delivered this sack plus the sack’s weight, original value, and delivery time.
     """
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT 
@@ -1243,7 +2403,7 @@ def get_bags_for_sack(sack_id):
     """
     Returns a DataFrame of all bags that include this sack.
     """
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT b.id AS bag_id,
@@ -1262,7 +2422,7 @@ def get_batches_for_sack(sack_id):
     """
     Returns a DataFrame of all distinct batches (60MT) that include any bag containing this sack.
     """
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT DISTINCT              -- ADDED LINES START HERE
@@ -1270,48 +2430,86 @@ def get_batches_for_sack(sack_id):
                bat.product_type,
                bat.weight_mt,
                bat.created_at
-          FROM batch_bags bb
-          JOIN batches bat ON bb.batch_id = bat.id
-         WHERE bb.bag_id IN (
-             SELECT bs.bag_id
-               FROM bag_sacks bs
-              WHERE bs.sack_id = ?
-         )
+          FROM sack_lineage sl
+          JOIN batches bat ON sl.entity_id = bat.id
+         WHERE sl.sack_id = ? AND sl.entity_type = 'batch'
       ORDER BY bat.created_at       -- ADDED LINES STOP HERE
     """, (sack_id,))
     rows = cursor.fetchall()
     conn.close()
     return pd.DataFrame(rows, columns=["batch_id","product_type","weight_mt","created_at"])
 
-def get_bundles_for_sack(sack_id):
+BUNDLE_COLUMNS = ["id", "filter_type", "filter_value", "interest_rate", "status", "created_at"]
+
+def get_bundles_for_sack(sack_id, include_archive=False):
     """
-    Returns a DataFrame of all distinct financing bundles that include this sack.
+    Returns a DataFrame of all distinct financing bundles that include this sack;
+    include_archive adds archived (paid, past-season) bundles.
     """
-    conn = get_connection()
+    source, attach = _listing_source("bundles", BUNDLE_COLUMNS, include_archive)
+    conn = get_read_connection(attach)
     cursor = conn.cursor()
-    cursor.execute("""
+    cursor.execute(f"""
         SELECT DISTINCT              -- ADDED LINES START HERE
                bnd.id           AS bundle_id,
                bnd.filter_type,
                bnd.filter_value,
                bnd.interest_rate,
-               bnd.status
-          FROM bundle_sacks bs
-          JOIN bundles bnd ON bs.bundle_id = bnd.id
-         WHERE bs.sack_id = ?
+               bnd.status{", bnd.archived" if include_archive else ""}
+          FROM sack_lineage sl
+          JOIN ({source}) bnd ON sl.entity_id = bnd.id
+         WHERE sl.sack_id = ? AND sl.entity_type = 'bundle'
     """, (sack_id,))
     rows = cursor.fetchall()
+    cols = [d[0] for d in cursor.description]
+    conn.close()
+    return pd.DataFrame(rows, columns=cols)  # ADDED LINES STOP HERE
+
+
+def get_sack_lineage(sack_id, include_archive=False):
+    """
+    Returns a DataFrame of every downstream entity (bag, batch, bundle, invoice)
+    this sack has ended up in, read straight from the sack_lineage closure table.
+    Bundles and invoices that have been archived are left out unless
+    include_archive, which also adds an `archived` column. (The closure rows
+    themselves stay in the hot database, like bag_sacks and bundle_sacks.)
+    """
+    conn = get_read_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT sl.entity_type, sl.entity_id{", ae.entity_id IS NOT NULL AS archived" if include_archive else ""}
+          FROM sack_lineage sl
+          LEFT JOIN archived_entities ae
+            ON ae.entity_type = sl.entity_type AND ae.entity_id = sl.entity_id
+         WHERE sl.sack_id = ?{"" if include_archive else " AND ae.entity_id IS NULL"}
+         ORDER BY sl.entity_type, sl.entity_id
+    """, (sack_id,))
+    rows = cursor.fetchall()
+    cols = [d[0] for d in cursor.description]
+    conn.close()
+    return pd.DataFrame(rows, columns=cols)
+
+def get_sack_ids_for_entity(entity_type, entity_id):
+    """
+    Returns a list of every sack ID upstream of a bag, batch, bundle or invoice.
+    """
+    conn = get_read_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT sack_id
+          FROM sack_lineage
+         WHERE entity_type = ? AND entity_id = ?
+    """, (entity_type, entity_id))
+    rows = cursor.fetchall()
     conn.close()
-    return pd.DataFrame(rows, columns=[
-        "bundle_id","filter_type","filter_value","interest_rate","status"
-    ])  # ADDED LINES STOP HERE
+    return [row[0] for row in rows]
 
 
 def get_all_sack_ids():
     """
     Returns a list of every sack ID in the system, most recent first.
     """
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id FROM sacks ORDER BY delivered_at DESC")
     rows = cursor.fetchall()
@@ -1325,7 +2523,7 @@ def get_farmer_profile(farmer_id):
       - total_weight: sum of weight_kg across their sacks
       - total_value: sum of value_paid across their sacks
     """
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     # Basic demographics
     cursor.execute("""
@@ -1367,16 +2565,15 @@ def get_batch_contributors(batch_id):
     and the warehouses those sacks came from.
     """
     import pandas as pd
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT DISTINCT
           s.farmer_id,
           s.warehouse
-        FROM batch_bags bb
-        JOIN bag_sacks  bs ON bb.bag_id = bs.bag_id
-        JOIN sacks      s  ON bs.sack_id = s.id
-        WHERE bb.batch_id = ?
+        FROM sack_lineage sl
+        JOIN sacks        s  ON sl.sack_id = s.id
+        WHERE sl.entity_type = 'batch' AND sl.entity_id = ?
     """, (batch_id,))
     rows = cursor.fetchall()
     conn.close()
@@ -1386,7 +2583,7 @@ def get_all_farmer_ids():
     """
     Returns a list of all farmer IDs, most recent first.
     """
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT id
@@ -1402,7 +2599,7 @@ def get_all_bag_ids():
     """
     Returns a list of all bag IDs, most recent first.
     """
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT id
@@ -1418,7 +2615,7 @@ def get_all_batch_ids():
     """
     Returns a list of all batch IDs, most recent first.
     """
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT id
@@ -1427,4 +2624,8 @@ def get_all_batch_ids():
     """)
     rows = cursor.fetchall()
     conn.close()
-    return [row[0] for row in rows]
\ No newline at end of file
+    return [row[0] for row in rows]
+
+
+# Time every public function above when instrumentation is switched on
+instrumentation.instrument_module(globals())
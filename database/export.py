@@ -0,0 +1,327 @@
+# database/export.py
+
+import csv
+import io
+import json
+import tempfile
+
+from database.db import get_read_connection, BUNDLE_TOTALS_SQL
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is offered only when pyarrow is installed
+    pa = pq = None
+
+# Rows pulled from SQLite per fetchmany() call
+EXPORT_CHUNK_SIZE = 5000
+
+# Exports larger than this spill from memory to a temp file on disk
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+BATCH_PROVENANCE_COLUMNS = [
+    "batch_id", "bag_id", "sack_id", "farmer_id", "farmer_name", "country", "city",
+    "gender", "warehouse", "sack_weight_kg", "allocated_weight_kg", "value_paid",
+    "delivered_at",
+]
+
+# sacks.farmer_id is declared INTEGER but holds text ids. Comparing it with
+# farmers.id as-is applies numeric affinity, which rules out the farmers
+# primary key and scans farmers for every row; the CAST keeps both sides TEXT.
+BATCH_PROVENANCE_QUERY = """
+    SELECT
+        bb.batch_id,
+        bs.bag_id,
+        s.id                                AS sack_id,
+        f.id                                AS farmer_id,
+        f.first_name || ' ' || f.last_name  AS farmer_name,
+        f.country,
+        f.city,
+        f.gender,
+        s.warehouse,
+        s.weight_kg                         AS sack_weight_kg,
+        bs.allocated_weight_kg,
+        s.value_paid,
+        s.delivered_at
+    FROM batch_bags bb
+    JOIN bag_sacks bs ON bb.bag_id = bs.bag_id
+    JOIN sacks s      ON bs.sack_id = s.id
+    JOIN farmers f    ON f.id = CAST(s.farmer_id AS TEXT)
+    WHERE bb.batch_id = ?
+    ORDER BY bs.bag_id, s.id
+"""
+
+
+# Full-table exports for the listing pages. Each is ordered by its primary key
+# so SQLite walks the index instead of sorting the whole table first.
+TABLE_EXPORTS = {
+    "farmers": """
+        SELECT id, first_name, last_name, email, country, city, gender, phone_number, created_at
+        FROM farmers
+        ORDER BY id
+    """,
+    "sacks": """
+        SELECT
+            s.id                                AS sack_id,
+            s.farmer_id,
+            f.first_name || ' ' || f.last_name  AS farmer_name,
+            s.weight_kg,
+            s.value_paid,
+            s.warehouse,
+            s.delivered_at
+        FROM sacks s
+        LEFT JOIN farmers f ON f.id = CAST(s.farmer_id AS TEXT)
+        ORDER BY s.id
+    """,
+    "tokens": """
+        SELECT id, farmer_id, token_type, amount, created_at, description
+        FROM tokens
+        ORDER BY id
+    """,
+    "tips": """
+        SELECT id, farmer_id, amount, created_at
+        FROM tips
+        ORDER BY id
+    """,
+    "bundles": f"""
+        SELECT
+            b.id AS bundle_id,
+            b.filter_type,
+            b.filter_value,
+            b.interest_rate,
+            b.status,
+            b.created_at,
+            {BUNDLE_TOTALS_SQL}
+        FROM bundles b
+        ORDER BY b.id
+    """,
+    "lenders": """
+        SELECT
+            l.id,
+            l.wallet_address,
+            l.position,
+            COALESCE((SELECT SUM(bl.amount) FROM bundle_lenders bl WHERE bl.lender_id = l.id), 0.0) AS funded_amount,
+            l.created_at
+        FROM lenders l
+        ORDER BY l.id
+    """,
+    "invoices": """
+        SELECT id, amount_paid, amount_remaining, percent_to_farmers, covered_batches, created_at
+        FROM invoices
+        ORDER BY id
+    """,
+}
+
+
+def iter_query(query, params=(), chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Runs a query on a pooled read connection and yields the column names
+    once, followed by lists of at most chunk_size rows. SQLite steps the
+    statement lazily, so only one chunk is ever held in memory, and the whole
+    export comes from one snapshot however long the download takes.
+    """
+    conn = get_read_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.arraysize = chunk_size
+        cursor.execute(query, params)
+        yield [d[0] for d in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def iter_batch_provenance(batch_ids, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields the provenance column names, then chunks of
+    (batch, bag, sack, farmer, warehouse, weight, value, delivered_at) rows
+    for each batch in turn.
+    """
+    yield list(BATCH_PROVENANCE_COLUMNS)
+    for batch_id in batch_ids:
+        chunks = iter_query(BATCH_PROVENANCE_QUERY, (batch_id,), chunk_size)
+        next(chunks)
+        for rows in chunks:
+            yield rows
+
+
+def to_csv_chunks(row_chunks):
+    """Turns an iter_query-style generator into UTF-8 encoded CSV chunks."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for i, chunk in enumerate(row_chunks):
+        if i == 0:
+            writer.writerow(chunk)
+        else:
+            writer.writerows(chunk)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate(0)
+
+
+def to_jsonl_chunks(row_chunks):
+    """Turns an iter_query-style generator into UTF-8 encoded JSON Lines chunks."""
+    columns = None
+    for chunk in row_chunks:
+        if columns is None:
+            columns = chunk
+            continue
+        lines = [json.dumps(dict(zip(columns, row)), default=str) for row in chunk]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class _ParquetSink(io.RawIOBase):
+    """Write-only file for ParquetWriter whose bytes are drained after each chunk."""
+
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._parts.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+# Parquet types of the exported columns that are not strings, from the
+# columns' declared types. The schema has to be fixed before the first row
+# group is written, and a chunk's values cannot be trusted to show it (a
+# COALESCE(..., 0) of an unfunded bundle looks like an integer).
+EXPORT_COLUMN_TYPES = {
+    "weight_kg": "float64",
+    "sack_weight_kg": "float64",
+    "allocated_weight_kg": "float64",
+    "value_paid": "float64",
+    "amount": "float64",
+    "interest_rate": "float64",
+    "total_bundle_value": "float64",
+    "funded_amount": "float64",
+    "position": "float64",
+    "amount_paid": "float64",
+    "amount_remaining": "float64",
+    "percent_to_farmers": "float64",
+}
+
+# Per-export exceptions to EXPORT_COLUMN_TYPES
+TABLE_EXPORT_TYPES = {
+    "tokens": {"id": "int64"},
+}
+
+
+def _arrow_schema(columns, types=None):
+    types = dict(EXPORT_COLUMN_TYPES, **(types or {}))
+    return pa.schema([pa.field(name, pa.type_for_alias(types.get(name, "string"))) for name in columns])
+
+
+def to_parquet_chunks(row_chunks, types=None):
+    """
+    Turns an iter_query-style generator into Parquet bytes, one row group per
+    chunk. Bytes are handed on as each row group is written, so only one chunk
+    is ever held in memory.
+    types: column name -> Arrow type alias, on top of EXPORT_COLUMN_TYPES
+    """
+    sink = _ParquetSink()
+    chunks = iter(row_chunks)
+    schema = _arrow_schema(next(chunks, []), types)
+    writer = pq.ParquetWriter(sink, schema)
+    for chunk in chunks:
+        arrays = []
+        for i, field in enumerate(schema):
+            values = [r[i] for r in chunk]
+            if pa.types.is_string(field.type):
+                values = [None if v is None else str(v) for v in values]
+            arrays.append(pa.array(values, type=field.type))
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+EXPORT_FORMATS = {
+    "csv":   (to_csv_chunks,   "text/csv",             "csv"),
+    "jsonl": (to_jsonl_chunks, "application/x-ndjson", "jsonl"),
+}
+if pq is not None:
+    EXPORT_FORMATS["parquet"] = (to_parquet_chunks, "application/vnd.apache.parquet", "parquet")
+
+
+def _encode(fmt, row_chunks, types=None):
+    encoder = EXPORT_FORMATS[fmt][0]
+    if encoder is to_parquet_chunks:
+        return encoder(row_chunks, types)
+    return encoder(row_chunks)
+
+
+def stream_batch_provenance(batch_ids, fmt="csv", chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields encoded chunks of the batch provenance export in the given format."""
+    return _encode(fmt, iter_batch_provenance(batch_ids, chunk_size))
+
+
+def stream_table(table, fmt="csv", chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields encoded chunks of one of the TABLE_EXPORTS in the given format."""
+    return _encode(fmt, iter_query(TABLE_EXPORTS[table], chunk_size=chunk_size), TABLE_EXPORT_TYPES.get(table))
+
+
+def spool_export(chunks):
+    """
+    Writes encoded chunks to a temp file that only spills to disk past
+    SPOOL_MAX_BYTES, and returns it rewound so it can be handed to
+    st.download_button as a file-like object.
+    """
+    f = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    for chunk in chunks:
+        f.write(chunk)
+    f.seek(0)
+    return f
+
+
+def write_export(chunks, path):
+    """Streams encoded chunks straight to a file on disk."""
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(
+        description="Export farmer-level batch provenance, or a whole listing with --table."
+    )
+    parser.add_argument("batch_ids", nargs="*")
+    parser.add_argument("--table", choices=sorted(TABLE_EXPORTS))
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--out", help="Output file (defaults to stdout)")
+    parser.add_argument("--db", help="SQLite file (defaults to the app's database)")
+    args = parser.parse_args()
+    if bool(args.table) == bool(args.batch_ids):
+        parser.error("give either batch ids or --table")
+    if args.db:
+        from database import db
+        db.DB_PATH = args.db
+
+    if args.table:
+        chunks = stream_table(args.table, args.format)
+    else:
+        chunks = stream_batch_provenance(args.batch_ids, args.format)
+    if args.out:
+        write_export(chunks, args.out)
+    else:
+        for chunk in chunks:
+            sys.stdout.buffer.write(chunk)
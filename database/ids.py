@@ -0,0 +1,99 @@
+# database/ids.py
+#
+# Time-ordered ids. Each id is the entity prefix followed by a 26-character
+# ULID: 48 bits of millisecond timestamp then 80 random bits, written in
+# lowercase Crockford base32 (whose alphabet is in ASCII order), so ids sort by
+# creation time as plain strings:
+#
+#   sack_01jae5v3w8k2m9q4r7t0xyzabc
+#
+# New rows therefore land at the right-hand edge of every TEXT primary key and
+# foreign-key index instead of at random pages, and the keys are 6 characters
+# shorter than the previous prefix + uuid4 hex. Ids made in the same
+# millisecond by this process stay ordered (the random part is incremented).
+# Older uuid4-hex ids remain valid keys; they just carry no timestamp.
+
+import os
+import time
+import threading
+
+ENCODING = "0123456789abcdefghjkmnpqrstvwxyz"
+_DECODING = {c: i for i, c in enumerate(ENCODING)}
+ULID_LENGTH = 26
+
+_RANDOM_BITS = 80
+_RANDOM_MAX = (1 << _RANDOM_BITS) - 1
+
+_lock = threading.Lock()
+_last_ms = 0
+_last_random = 0
+
+
+def _encode(value):
+    chars = []
+    for _ in range(ULID_LENGTH):
+        chars.append(ENCODING[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def new_ulid(now_ms=None):
+    """A 26-character time-ordered id; monotonic within this process."""
+    global _last_ms, _last_random
+    with _lock:
+        ms = int(time.time() * 1000) if now_ms is None else now_ms
+        if ms <= _last_ms:
+            # Same millisecond (or the clock stepped back): keep the order
+            ms = _last_ms
+            rand = _last_random + 1
+            if rand > _RANDOM_MAX:
+                ms += 1
+                rand = int.from_bytes(os.urandom(10), "big")
+        else:
+            rand = int.from_bytes(os.urandom(10), "big")
+        _last_ms, _last_random = ms, rand
+    return _encode((ms << _RANDOM_BITS) | rand)
+
+
+def ulid_timestamp_ms(value):
+    """
+    Creation time (Unix milliseconds) of a prefixed or bare ULID, or None for
+    ids in another format (e.g. the older uuid4-hex ids).
+    """
+    ulid = value.rsplit("_", 1)[-1]
+    if len(ulid) != ULID_LENGTH:
+        return None
+    n = 0
+    for c in ulid[:10]:
+        if c not in _DECODING:
+            return None
+        n = (n << 5) | _DECODING[c]
+    # The first 10 characters hold 2 padding bits and the 48-bit timestamp
+    return n
+
+
+if __name__ == "__main__":
+    # Migrate an existing database to the surrogate-key join tables:
+    #   python -m database.ids migrate [--db PATH] [--vacuum]
+    import sys
+    import argparse
+
+    from database import db
+
+    parser = argparse.ArgumentParser(description="EcoWise id and key-layout maintenance.")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--db", help="SQLite file (defaults to the app's database)")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="Also VACUUM afterwards to repack indexes fragmented by random ids (locks the database)")
+    args = parser.parse_args()
+    if args.db:
+        db.DB_PATH = args.db
+    db.create_tables()
+    rebuilt = db.migrate_join_tables()
+    print(f"Rebuilt: {', '.join(rebuilt) or 'nothing, already migrated'}")
+    if args.vacuum:
+        conn = db.get_connection()
+        conn.execute("VACUUM")
+        conn.close()
+        print("Vacuumed")
+    sys.exit(0)
@@ -0,0 +1,355 @@
+# database/instrumentation.py
+#
+# Opt-in query instrumentation for database/db.py. When enabled, connections
+# come from InstrumentedConnection, every public db function is timed, and
+# statements slower than the threshold are appended to a slow-query log along
+# with their EXPLAIN QUERY PLAN. Enable with ECOWISE_PROFILE_DB=1 or enable().
+
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+import functools
+import weakref
+from collections import deque
+from datetime import datetime, timezone
+
+import pandas as pd
+
+SLOW_QUERY_LOG = os.environ.get(
+    "ECOWISE_SLOW_QUERY_LOG",
+    os.path.join(os.path.dirname(__file__), "slow_queries.log")
+)
+
+_lock = threading.Lock()
+_local = threading.local()
+
+_state = {
+    "enabled": os.environ.get("ECOWISE_PROFILE_DB", "") not in ("", "0"),
+    "slow_ms": float(os.environ.get("ECOWISE_SLOW_QUERY_MS", "100")),
+    "connection_opens": 0,
+}
+_function_stats = {}
+_statement_stats = {}
+
+
+def is_enabled():
+    return _state["enabled"]
+
+
+def enable(slow_ms=None):
+    """Turns instrumentation on for the whole process."""
+    if slow_ms is not None:
+        _state["slow_ms"] = float(slow_ms)
+    _state["enabled"] = True
+
+
+def disable():
+    _state["enabled"] = False
+
+
+def get_slow_threshold_ms():
+    return _state["slow_ms"]
+
+
+def set_slow_threshold_ms(slow_ms):
+    _state["slow_ms"] = float(slow_ms)
+
+
+def reset():
+    """Clears all collected statistics (the slow-query log file is left alone)."""
+    with _lock:
+        _function_stats.clear()
+        _statement_stats.clear()
+        _state["connection_opens"] = 0
+
+
+def _normalize(sql):
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+def _call_stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _bump_function_frames(field, amount):
+    for frame in _call_stack():
+        frame[field] += amount
+
+
+def _thread_totals():
+    totals = getattr(_local, "totals", None)
+    if totals is None:
+        totals = _local.totals = {"statements": 0, "rows": 0, "connections": 0, "db_s": 0.0}
+    return totals
+
+
+def thread_counters():
+    """
+    Running totals of statements, rows, connections and statement time for the
+    calling thread. Diff two snapshots to attribute work to a block of code.
+    """
+    return dict(_thread_totals())
+
+
+# --- Statement tracking ---
+
+class _Statement:
+    __slots__ = ("sql", "params", "many", "elapsed", "rows", "function", "done")
+
+    def __init__(self, sql, params, many):
+        self.sql = sql
+        self.params = params
+        self.many = many
+        self.elapsed = 0.0
+        self.rows = 0
+        stack = _call_stack()
+        self.function = stack[-1]["name"] if stack else None
+        self.done = False
+
+
+def _finish(cursor, stmt):
+    if stmt is None or stmt.done:
+        return
+    stmt.done = True
+    key = _normalize(stmt.sql)
+    with _lock:
+        s = _statement_stats.get(key)
+        if s is None:
+            s = _statement_stats[key] = {
+                "sql": key, "calls": 0, "total_s": 0.0, "max_s": 0.0, "rows": 0, "functions": set()
+            }
+        s["calls"] += 1
+        s["total_s"] += stmt.elapsed
+        s["max_s"] = max(s["max_s"], stmt.elapsed)
+        s["rows"] += stmt.rows
+        if stmt.function:
+            s["functions"].add(stmt.function)
+    _bump_function_frames("statements", 1)
+    _bump_function_frames("rows", stmt.rows)
+    totals = _thread_totals()
+    totals["statements"] += 1
+    totals["rows"] += stmt.rows
+    totals["db_s"] += stmt.elapsed
+    if stmt.elapsed * 1000 >= _state["slow_ms"]:
+        _log_slow(cursor.connection, stmt)
+
+
+def _explain(conn, stmt):
+    if stmt.many:
+        return None
+    try:
+        raw = sqlite3.Cursor.execute(sqlite3.Cursor(conn), "EXPLAIN QUERY PLAN " + stmt.sql, stmt.params)
+        return [row[-1] for row in raw.fetchall()]
+    except sqlite3.Error as e:
+        return [f"<EXPLAIN failed: {e}>"]
+
+
+def _log_slow(conn, stmt):
+    entry = {
+        "ts": datetime.now(timezone.utc).isoformat(),
+        "function": stmt.function,
+        "elapsed_ms": round(stmt.elapsed * 1000, 3),
+        "rows": stmt.rows,
+        "sql": _normalize(stmt.sql),
+        "plan": _explain(conn, stmt),
+    }
+    with _lock:
+        with open(SLOW_QUERY_LOG, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """sqlite3 cursor that times each statement from execute() through its last fetch."""
+
+    _stmt = None
+
+    def _timed(self, fn, *args):
+        t0 = time.perf_counter()
+        try:
+            return fn(self, *args)
+        finally:
+            if self._stmt is not None:
+                self._stmt.elapsed += time.perf_counter() - t0
+
+    def execute(self, sql, parameters=()):
+        _finish(self, self._stmt)
+        self._stmt = _Statement(sql, parameters, False)
+        result = self._timed(sqlite3.Cursor.execute, sql, parameters)
+        if self.description is None:
+            _finish(self, self._stmt)
+        return result
+
+    def executemany(self, sql, seq_of_parameters):
+        _finish(self, self._stmt)
+        self._stmt = _Statement(sql, None, True)
+        result = self._timed(sqlite3.Cursor.executemany, sql, seq_of_parameters)
+        _finish(self, self._stmt)
+        return result
+
+    def fetchone(self):
+        row = self._timed(sqlite3.Cursor.fetchone)
+        if self._stmt is not None:
+            if row is None:
+                _finish(self, self._stmt)
+            else:
+                self._stmt.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._timed(sqlite3.Cursor.fetchmany, size)
+        if self._stmt is not None:
+            self._stmt.rows += len(rows)
+            if len(rows) < size:
+                _finish(self, self._stmt)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(sqlite3.Cursor.fetchall)
+        if self._stmt is not None:
+            self._stmt.rows += len(rows)
+            _finish(self, self._stmt)
+        return rows
+
+    def __next__(self):
+        try:
+            row = self._timed(sqlite3.Cursor.__next__)
+        except StopIteration:
+            _finish(self, self._stmt)
+            raise
+        if self._stmt is not None:
+            self._stmt.rows += 1
+        return row
+
+    def close(self):
+        _finish(self, self._stmt)
+        super().close()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection whose cursors are InstrumentedCursor instances."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cursors = weakref.WeakSet()
+        with _lock:
+            _state["connection_opens"] += 1
+        _bump_function_frames("connections", 1)
+        _thread_totals()["connections"] += 1
+
+    def cursor(self, factory=InstrumentedCursor):
+        cur = super().cursor(factory)
+        self._cursors.add(cur)
+        return cur
+
+    def finish_cursors(self):
+        """Records the statements still open on this connection's cursors."""
+        for cur in list(self._cursors):
+            _finish(cur, cur._stmt)
+
+    def close(self):
+        self.finish_cursors()
+        super().close()
+
+
+def connect(path, **kwargs):
+    return sqlite3.connect(path, factory=InstrumentedConnection, **kwargs)
+
+
+# --- Function tracking ---
+
+def instrument(fn):
+    """Wraps a db function so calls, wall time, statements, rows and connection opens are attributed to it."""
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not _state["enabled"]:
+            return fn(*args, **kwargs)
+        stack = _call_stack()
+        frame = {"name": fn.__name__, "statements": 0, "rows": 0, "connections": 0}
+        stack.append(frame)
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - t0
+            stack.pop()
+            with _lock:
+                s = _function_stats.get(fn.__name__)
+                if s is None:
+                    s = _function_stats[fn.__name__] = {
+                        "function": fn.__name__, "calls": 0, "total_s": 0.0, "max_s": 0.0,
+                        "statements": 0, "rows": 0, "connections": 0
+                    }
+                s["calls"] += 1
+                s["total_s"] += elapsed
+                s["max_s"] = max(s["max_s"], elapsed)
+                s["statements"] += frame["statements"]
+                s["rows"] += frame["rows"]
+                s["connections"] += frame["connections"]
+
+    wrapper.__wrapped_by_instrumentation__ = True
+    return wrapper
+
+
+def instrument_module(namespace, skip=("get_connection", "generate_id")):
+    """Wraps every public function defined in a module's namespace (pass globals())."""
+    module_name = namespace["__name__"]
+    for name, obj in list(namespace.items()):
+        if (
+            callable(obj)
+            and getattr(obj, "__module__", None) == module_name
+            and not name.startswith("_")
+            and name not in skip
+            and not isinstance(obj, type)
+            and not getattr(obj, "__wrapped_by_instrumentation__", False)
+        ):
+            namespace[name] = instrument(obj)
+
+
+# --- Reporting ---
+
+def get_function_stats():
+    """DataFrame of per-function totals, slowest first."""
+    with _lock:
+        rows = [dict(s) for s in _function_stats.values()]
+    cols = ["function", "calls", "total_s", "avg_ms", "max_s", "statements", "rows", "connections"]
+    df = pd.DataFrame(rows, columns=[c for c in cols if c != "avg_ms"])
+    df["avg_ms"] = (df["total_s"] / df["calls"] * 1000) if not df.empty else []
+    return df[cols].sort_values("total_s", ascending=False).reset_index(drop=True)
+
+
+def get_statement_stats():
+    """DataFrame of per-SQL-statement totals, slowest first."""
+    with _lock:
+        rows = [dict(s, functions=", ".join(sorted(s["functions"]))) for s in _statement_stats.values()]
+    cols = ["sql", "calls", "total_s", "avg_ms", "max_s", "rows", "functions"]
+    df = pd.DataFrame(rows, columns=[c for c in cols if c != "avg_ms"])
+    df["avg_ms"] = (df["total_s"] / df["calls"] * 1000) if not df.empty else []
+    return df[cols].sort_values("total_s", ascending=False).reset_index(drop=True)
+
+
+def get_summary():
+    with _lock:
+        return {
+            "enabled": _state["enabled"],
+            "slow_ms": _state["slow_ms"],
+            "connection_opens": _state["connection_opens"],
+            "statements": sum(s["calls"] for s in _statement_stats.values()),
+            "rows": sum(s["rows"] for s in _statement_stats.values()),
+        }
+
+
+def read_slow_log(limit=200):
+    """Returns the most recent slow-query log entries, newest first."""
+    if not os.path.exists(SLOW_QUERY_LOG):
+        return []
+    with open(SLOW_QUERY_LOG) as f:
+        lines = deque(f, maxlen=limit)
+    return [json.loads(line) for line in reversed(lines) if line.strip()]
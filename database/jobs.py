@@ -0,0 +1,369 @@
+# database/jobs.py
+#
+# Background runner for the long pipeline operations (auto-bagging, auto-batching,
+# invoices, bulk warrant receipts). Work is queued in the jobs table and picked
+# up by a small pool of worker threads, so the Streamlit script only enqueues and
+# polls. A job left 'running' by a process that died is re-queued once its
+# heartbeat goes stale; every handler is safe to run again from the top.
+
+import os
+import json
+import time
+import threading
+import traceback
+
+import pandas as pd
+
+from database.db import (
+    write_op,
+    get_connection,
+    generate_id,
+    auto_fill_bags,
+    get_bag_packing_stats,
+    auto_fill_batches,
+    create_invoice,
+    create_warrant_receipt,
+)
+
+JOB_WORKERS = int(os.environ.get("ECOWISE_JOB_WORKERS", "2"))
+
+# Idle workers look for new work at least this often
+JOB_POLL_INTERVAL_S = 1.0
+
+# Running jobs refresh heartbeat_at this often; one silent for JOB_STALE_AFTER_S
+# is assumed to belong to a dead process and is queued again
+JOB_HEARTBEAT_S = 10
+JOB_STALE_AFTER_S = 60
+
+# A job that keeps dying mid-run is failed after this many starts
+JOB_MAX_ATTEMPTS = 3
+
+ACTIVE_STATUSES = ("queued", "running")
+
+JOB_HANDLERS = {}
+
+_wakeup = threading.Event()
+_start_lock = threading.Lock()
+_workers = []
+_running = set()
+_running_lock = threading.Lock()
+
+
+def job_handler(kind):
+    """Registers fn(job) as the handler for jobs of this kind."""
+
+    def register(fn):
+        JOB_HANDLERS[kind] = fn
+        return fn
+
+    return register
+
+
+class Job:
+    """What a handler sees of its job: params, a resumable state dict and progress reporting."""
+
+    def __init__(self, job_id, kind, params, state):
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        self.state = state
+
+    # Both go through write_op like the handler's own writes, so they queue
+    # behind the group-commit writer instead of failing on its lock
+    def progress(self, fraction, message=None):
+        set_job_progress(self.id, max(0.0, min(1.0, fraction)), message)
+
+    def checkpoint(self, **values):
+        """Merges values into the job's state and persists it before carrying on."""
+        self.state.update(values)
+        set_job_state(self.id, json.dumps(self.state))
+
+
+@write_op
+def set_job_progress(cursor, job_id, fraction, message=None):
+    cursor.execute("""
+        UPDATE jobs
+        SET progress = ?, message = COALESCE(?, message), heartbeat_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    """, (fraction, message, job_id))
+
+
+@write_op
+def set_job_state(cursor, job_id, state_json):
+    cursor.execute("""
+        UPDATE jobs SET state = ?, heartbeat_at = CURRENT_TIMESTAMP WHERE id = ?
+    """, (state_json, job_id))
+
+
+# --- Handlers ---
+
+@job_handler("auto_fill_bags")
+def _run_auto_fill_bags(job):
+    # Each (warehouse, date) group commits whole and only weight not yet in a
+    # bag is packed, so a rerun continues where the last one stopped
+    bag_ids = auto_fill_bags(progress=job.progress, mode=job.params.get("mode", "greedy"))
+    return {"bag_ids": bag_ids, "stats": get_bag_packing_stats(bag_ids)}
+
+
+@job_handler("auto_fill_batches")
+def _run_auto_fill_batches(job):
+    return {"batch_ids": auto_fill_batches(
+        progress=job.progress,
+        product_type=job.params.get("product_type", "liquor"),
+        group_by=job.params.get("group_by"),
+        min_fill=job.params.get("min_fill", 0.0),
+    )}
+
+
+def _exists(table, row_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {table} WHERE id = ?)", (row_id,))
+    found = cursor.fetchone()[0]
+    conn.close()
+    return bool(found)
+
+
+@job_handler("create_invoice")
+def _run_create_invoice(job):
+    # The invoice id is fixed before any money moves; create_invoice is a single
+    # transaction, so on resume the invoice either exists in full or not at all
+    if "invoice_id" not in job.state:
+        job.checkpoint(invoice_id=generate_id("invoice"))
+    invoice_id = job.state["invoice_id"]
+    if not _exists("invoices", invoice_id):
+        job.progress(0.1, "Settling invoice")
+        create_invoice(
+            job.params["batch_ids"],
+            job.params["amount_paid"],
+            job.params["percent_to_farmers"],
+            invoice_id=invoice_id
+        )
+    return {"invoice_id": invoice_id}
+
+
+@job_handler("create_warrant_receipt")
+def _run_create_warrant_receipt(job):
+    if "receipt_id" not in job.state:
+        job.checkpoint(receipt_id=generate_id("warrant"))
+    receipt_id = job.state["receipt_id"]
+    if not _exists("warrant_receipts", receipt_id):
+        create_warrant_receipt(
+            job.params["receipt_type"],
+            job.params["covered_ids"],
+            receipt_id=receipt_id,
+            progress=job.progress
+        )
+    return {"receipt_id": receipt_id}
+
+
+# --- Queue ---
+
+def enqueue_job(kind, params=None):
+    """Queues a job and makes sure this process has workers to run it. Returns the job id."""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind '{kind}'")
+    job_id = insert_job(generate_id("job"), kind, json.dumps(params or {}))
+    start_workers()
+    _wakeup.set()
+    return job_id
+
+
+@write_op
+def insert_job(cursor, job_id, kind, params_json):
+    cursor.execute("""
+        INSERT INTO jobs (id, kind, params, message) VALUES (?, ?, ?, 'Queued')
+    """, (job_id, kind, params_json))
+    return job_id
+
+
+def _row_to_job(columns, row):
+    job = dict(zip(columns, row))
+    for field in ("params", "state", "result"):
+        job[field] = json.loads(job[field]) if job[field] else None
+    return job
+
+
+def get_job(job_id):
+    """Returns the job as a dict (JSON fields decoded), or None."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+    row = cursor.fetchone()
+    columns = [d[0] for d in cursor.description]
+    conn.close()
+    return _row_to_job(columns, row) if row else None
+
+
+def get_recent_jobs(limit=20):
+    conn = get_connection()
+    df = pd.read_sql_query("""
+        SELECT id, kind, status, progress, message, attempts, created_at, started_at, finished_at, error
+        FROM jobs
+        ORDER BY created_at DESC, rowid DESC
+        LIMIT ?
+    """, conn, params=(limit,))
+    conn.close()
+    return df
+
+
+def recover_stale_jobs(stale_after_s=JOB_STALE_AFTER_S):
+    """
+    Re-queues running jobs whose heartbeat stopped (their process died), or fails
+    them once they have used up JOB_MAX_ATTEMPTS. Returns how many were touched.
+    """
+    with _running_lock:
+        mine = list(_running)
+    return requeue_stale_jobs(stale_after_s, mine)
+
+
+@write_op
+def requeue_stale_jobs(cursor, stale_after_s, mine):
+    """recover_stale_jobs' write; mine are this process's running jobs, which are never stale."""
+    cursor.execute(f"""
+        UPDATE jobs
+        SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+            error = CASE WHEN attempts >= ? THEN 'Interrupted too many times' ELSE error END,
+            finished_at = CASE WHEN attempts >= ? THEN CURRENT_TIMESTAMP ELSE NULL END,
+            message = CASE WHEN attempts >= ? THEN 'Failed' ELSE 'Interrupted, will resume' END
+        WHERE status = 'running'
+          AND COALESCE(heartbeat_at, started_at) < DATETIME('now', ?)
+          AND id NOT IN ({",".join("?" * len(mine))})
+    """, (*[JOB_MAX_ATTEMPTS] * 4, f"-{int(stale_after_s)} seconds", *mine))
+    return cursor.rowcount
+
+
+def _claim_next():
+    """Moves the oldest claimable queued job to 'running'. Returns a Job or None."""
+    row = claim_next_job()
+    if row is None:
+        return None
+    job_id, kind, params, state = row
+    return Job(job_id, kind, json.loads(params), json.loads(state))
+
+
+@write_op
+def claim_next_job(cursor):
+    """
+    Moves the oldest queued job to 'running', skipping kinds that already have
+    a job running (two auto-fills at once would double-pack). The SELECT and
+    UPDATE share the write lock, so no other worker or process can claim the
+    same job in between. Returns (id, kind, params, state) or None.
+    """
+    cursor.execute("""
+        SELECT id, kind, params, state FROM jobs
+        WHERE status = 'queued'
+          AND kind NOT IN (SELECT kind FROM jobs WHERE status = 'running')
+        ORDER BY created_at, rowid
+        LIMIT 1
+    """)
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    cursor.execute("""
+        UPDATE jobs
+        SET status = 'running', attempts = attempts + 1, message = 'Starting',
+            started_at = COALESCE(started_at, CURRENT_TIMESTAMP),
+            heartbeat_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    """, (row[0],))
+    return list(row)
+
+
+def _finish(job, status, result=None, error=None):
+    finish_job(job.id, status, json.dumps(result) if result is not None else None, error)
+
+
+@write_op
+def finish_job(cursor, job_id, status, result_json=None, error=None):
+    cursor.execute("""
+        UPDATE jobs
+        SET status = ?, result = ?, error = ?, finished_at = CURRENT_TIMESTAMP,
+            progress = CASE WHEN ? = 'succeeded' THEN 1.0 ELSE progress END,
+            message = ?
+        WHERE id = ?
+    """, (
+        status,
+        result_json,
+        error,
+        status,
+        "Done" if status == "succeeded" else "Failed",
+        job_id
+    ))
+
+
+def run_next_job():
+    """Claims and runs one queued job in the calling thread. Returns its id, or None if the queue is empty."""
+    job = _claim_next()
+    if job is None:
+        return None
+    with _running_lock:
+        _running.add(job.id)
+    try:
+        handler = JOB_HANDLERS.get(job.kind)
+        if handler is None:
+            raise ValueError(f"Unknown job kind '{job.kind}'")
+        _finish(job, "succeeded", result=handler(job))
+    except Exception:
+        _finish(job, "failed", error=traceback.format_exc())
+    finally:
+        with _running_lock:
+            _running.discard(job.id)
+    return job.id
+
+
+# --- Workers ---
+
+def _worker_loop():
+    while True:
+        try:
+            if run_next_job() is None:
+                _wakeup.wait(JOB_POLL_INTERVAL_S)
+                _wakeup.clear()
+        except Exception:
+            # Database briefly unavailable (locked, being restored); try again shortly
+            traceback.print_exc()
+            time.sleep(JOB_POLL_INTERVAL_S)
+
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(JOB_HEARTBEAT_S)
+        with _running_lock:
+            ids = list(_running)
+        try:
+            if ids:
+                touch_jobs(ids)
+            recover_stale_jobs()
+        except Exception:
+            traceback.print_exc()
+
+
+@write_op
+def touch_jobs(cursor, job_ids):
+    cursor.execute(f"""
+        UPDATE jobs SET heartbeat_at = CURRENT_TIMESTAMP
+        WHERE id IN ({",".join("?" * len(job_ids))})
+    """, job_ids)
+
+
+def start_workers(count=JOB_WORKERS):
+    """Starts this process's worker threads once; later calls are no-ops."""
+    with _start_lock:
+        if _workers:
+            return
+        recover_stale_jobs()
+        for i in range(count):
+            t = threading.Thread(target=_worker_loop, name=f"ecowise-job-worker-{i}", daemon=True)
+            t.start()
+            _workers.append(t)
+        t = threading.Thread(target=_heartbeat_loop, name="ecowise-job-heartbeat", daemon=True)
+        t.start()
+        _workers.append(t)
+
+
+if __name__ == "__main__":
+    # Drain the queue from the command line: python -m database.jobs
+    recover_stale_jobs()
+    while run_next_job():
+        pass
@@ -0,0 +1,141 @@
+# database/readpool.py
+#
+# Read-only connections for reports and listings. A connection is opened with
+# mode=ro and PRAGMA query_only, maps the file with mmap, and is kept in a small
+# idle pool between uses. Each checkout starts one read transaction that lasts
+# until close(), so every statement a report runs sees the same committed
+# snapshot: a settlement committing halfway through a report shows up either
+# entirely or not at all.
+#
+# The database runs in WAL mode (db.create_tables turns it on), so an open
+# snapshot does not block writers and writers do not block it. Under a
+# rollback journal the same code still gives a consistent read, but it holds
+# the shared lock for the length of the report.
+#
+# close() on a pooled connection ends its transaction and hands it back instead
+# of closing it, so callers keep the usual get_..._connection() / close() shape.
+
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+
+READ_POOL_SIZE = 8
+READ_MMAP_BYTES = 256 * 1024 * 1024
+
+
+def _ro_uri(path):
+    return f"file:{pathname2url(os.path.abspath(path))}?mode=ro"
+
+
+class _Pooled:
+    """Mixed in ahead of a sqlite3.Connection class; see ReadPool._class_for."""
+
+    _pool = None
+    _key = None
+    _schemas = ("main",)
+    _checked_out = False
+
+    def close(self):
+        if self._pool is None:
+            super().close()
+        elif self._checked_out:
+            self._checked_out = False
+            self._pool._release(self)
+
+    def discard(self):
+        self._pool = None
+        super().close()
+
+
+class ReadPool:
+    """
+    Idle read-only connections keyed by database file. There is no limit on
+    connections checked out at once, so a reader never waits for the pool;
+    only READ_POOL_SIZE idle ones are kept.
+    """
+
+    def __init__(self, size=READ_POOL_SIZE, mmap_bytes=READ_MMAP_BYTES):
+        self.size = size
+        self.mmap_bytes = mmap_bytes
+        self._lock = threading.Lock()
+        self._idle = []
+        self._classes = {}
+        self.stats = {"opened": 0, "reused": 0}
+
+    def _class_for(self, base):
+        cls = self._classes.get(base)
+        if cls is None:
+            cls = self._classes[base] = type(f"Pooled{base.__name__}", (_Pooled, base), {})
+        return cls
+
+    def _file_key(self, path, base, attach):
+        # Inodes are part of the key so a database file that was deleted and
+        # recreated at the same path is not served from the old one
+        files = []
+        for schema, file_path in [("main", path)] + sorted((attach or {}).items()):
+            st = os.stat(file_path)
+            files.append((schema, os.path.abspath(file_path), st.st_dev, st.st_ino))
+        return (tuple(files), base)
+
+    def _open(self, path, key, base, attach):
+        conn = sqlite3.connect(
+            _ro_uri(path), uri=True, check_same_thread=False, isolation_level=None, factory=self._class_for(base)
+        )
+        for schema, file_path in sorted((attach or {}).items()):
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (_ro_uri(file_path),))
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_bytes)}")
+        conn._schemas = ["main"] + sorted(attach or {})
+        conn._key = key
+        conn._pool = self
+        with self._lock:
+            self.stats["opened"] += 1
+        return conn
+
+    def acquire(self, path, base=sqlite3.Connection, attach=None):
+        """
+        A read-only connection to path with its snapshot already taken.
+        attach maps schema names to further database files opened alongside
+        it (read-only too, and in the same snapshot).
+        """
+        key = self._file_key(path, base, attach)
+        conn = None
+        with self._lock:
+            for i in range(len(self._idle) - 1, -1, -1):
+                if self._idle[i]._key == key:
+                    conn = self._idle.pop(i)
+                    self.stats["reused"] += 1
+                    break
+        if conn is None:
+            conn = self._open(path, key, base, attach)
+        conn._checked_out = True
+        # The snapshot is fixed by the first read, so take it now rather than
+        # at whichever statement the caller happens to run first
+        conn.execute("BEGIN")
+        for schema in conn._schemas:
+            conn.execute(f"SELECT 1 FROM {schema}.sqlite_master LIMIT 1").fetchall()
+        return conn
+
+    def _release(self, conn):
+        try:
+            finish = getattr(conn, "finish_cursors", None)
+            if finish is not None:
+                finish()
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+        except sqlite3.Error:
+            conn.discard()
+            return
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.discard()
+
+    def clear(self):
+        """Closes every idle connection (e.g. before replacing the database file)."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.discard()
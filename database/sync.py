@@ -0,0 +1,119 @@
+# database/sync.py
+#
+# Delta sync for offline field-agent devices. A device keeps the seq of the
+# last change it has seen (its cursor) and pulls only what changed since then
+# from the change feed (database/changes.py): farmers added, edited or removed,
+# and warehouses that appeared. Deliveries recorded offline are pushed back in
+# bulk through db.apply_offline_deliveries, which is idempotent per client_id.
+#
+# A device with no cursor, or whose cursor predates the retained feed (changes
+# were pruned) or comes from another database, gets a full snapshot instead.
+
+import json
+
+from database.db import get_read_connection, apply_offline_deliveries
+
+SYNC_PAGE_SIZE = 5000
+
+# Farmer columns sent to devices
+SYNC_FARMER_COLUMNS = ["id", "first_name", "last_name", "country", "city", "gender", "phone_number"]
+
+
+def _farmer_rows(farmers):
+    return [[f.get(c) for c in SYNC_FARMER_COLUMNS] for f in farmers]
+
+
+def _snapshot(cursor, head):
+    cursor.execute(f"SELECT {', '.join(SYNC_FARMER_COLUMNS)} FROM farmers ORDER BY id")
+    farmers = [list(r) for r in cursor.fetchall()]
+    cursor.execute("""
+        SELECT DISTINCT warehouse FROM sacks WHERE warehouse IS NOT NULL AND warehouse != '' ORDER BY warehouse
+    """)
+    warehouses = [r[0] for r in cursor.fetchall()]
+    return {
+        "cursor": head,
+        "snapshot": True,
+        "has_more": False,
+        "farmer_columns": SYNC_FARMER_COLUMNS,
+        "farmers": farmers,
+        "deleted_farmers": [],
+        "warehouses": warehouses,
+    }
+
+
+def export_delta(since=None, limit=SYNC_PAGE_SIZE):
+    """
+    Everything a device needs to catch up from cursor `since` (None for a
+    device that has never synced).
+
+    Returns a dict:
+        cursor           seq to send next time
+        snapshot         True if farmers is the complete list (replace, don't merge)
+        has_more         True if the device should pull again straight away
+        farmer_columns   column names for the rows in farmers
+        farmers          [[...], ...] farmers to insert or overwrite
+        deleted_farmers  [farmer_id, ...]
+        warehouses       warehouse names first seen in this window
+    """
+    conn = get_read_connection()
+    cursor = conn.cursor()
+    try:
+        # head and the rows below come from the same snapshot, so nothing can
+        # later appear at or below head that this pull did not see.
+        # sqlite_sequence keeps the highest seq ever issued, even after the
+        # feed is pruned.
+        cursor.execute("SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'changes'), 0)")
+        head = cursor.fetchone()[0]
+        cursor.execute("SELECT COALESCE(MIN(seq), ?) FROM changes", (head + 1,))
+        oldest = cursor.fetchone()[0]
+
+        if since is None or since < oldest - 1 or since > head:
+            return _snapshot(cursor, head)
+
+        cursor.execute("""
+            SELECT seq, table_name, op, row_key, data
+            FROM changes
+            WHERE seq > ? AND seq <= ? AND table_name IN ('farmers', 'sacks')
+            ORDER BY seq
+            LIMIT ?
+        """, (since, head, limit))
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    has_more = len(rows) == limit
+    new_cursor = rows[-1][0] if has_more else head
+
+    # Only the latest state of each farmer matters
+    farmers = {}
+    deleted = set()
+    warehouses = set()
+    for seq, table, op, key, data in rows:
+        if table == "farmers":
+            if op == "delete":
+                farmers.pop(key, None)
+                deleted.add(key)
+            else:
+                farmers[key] = json.loads(data)
+                deleted.discard(key)
+        elif op == "insert":
+            warehouse = json.loads(data).get("warehouse")
+            if warehouse:
+                warehouses.add(warehouse)
+
+    return {
+        "cursor": new_cursor,
+        "snapshot": False,
+        "has_more": has_more,
+        "farmer_columns": SYNC_FARMER_COLUMNS,
+        "farmers": _farmer_rows(farmers.values()),
+        "deleted_farmers": sorted(deleted),
+        "warehouses": sorted(warehouses),
+    }
+
+
+def apply_deliveries(device_id, deliveries):
+    """Applies a device's offline deliveries; see db.apply_offline_deliveries."""
+    if not deliveries:
+        return {"applied": {}, "duplicates": {}, "rejected": {}}
+    return apply_offline_deliveries(device_id, deliveries)
@@ -0,0 +1,195 @@
+# database/writer.py
+#
+# Group-commit writer. One thread owns one SQLite connection; callers hand it
+# write operations through a queue and get results back through futures. Ops
+# that arrive within a short window share one transaction and one commit, each
+# inside its own savepoint so a failing op only rolls back itself. A group that
+# hits SQLITE_BUSY is rolled back and retried with exponential backoff.
+# run_immediate gives a single op the same treatment without the thread.
+
+import time
+import queue
+import random
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+# How long the writer waits for more ops after the first one of a group
+GROUP_WINDOW_S = 0.005
+GROUP_MAX_OPS = 200
+
+BUSY_RETRIES = 8
+BUSY_BACKOFF_S = 0.01
+
+_SQLITE_BUSY_CODES = (5, 6)  # SQLITE_BUSY, SQLITE_LOCKED
+
+
+def is_busy_error(e):
+    if not isinstance(e, sqlite3.OperationalError):
+        return False
+    code = getattr(e, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in _SQLITE_BUSY_CODES
+    msg = str(e).lower()
+    return "locked" in msg or "busy" in msg
+
+
+def run_immediate(connect, fn, *args, busy_retries=BUSY_RETRIES, busy_backoff_s=BUSY_BACKOFF_S, **kwargs):
+    """
+    Runs fn(cursor, *args, **kwargs) alone in a BEGIN IMMEDIATE transaction on
+    a new connection and commits it. Taking the write lock up front means fn's
+    reads cannot go stale before its writes land. SQLITE_BUSY rolls back and
+    retries with exponential backoff, up to busy_retries times; any other
+    error rolls back and is raised.
+    """
+    for attempt in range(busy_retries + 1):
+        conn = connect()
+        conn.isolation_level = None  # explicit BEGIN/COMMIT below
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            result = fn(cursor, *args, **kwargs)
+            cursor.execute("COMMIT")
+            return result
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if not is_busy_error(e) or attempt == busy_retries:
+                raise
+        finally:
+            conn.close()
+        time.sleep(busy_backoff_s * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+class _Op:
+    __slots__ = ("fn", "args", "kwargs", "future")
+
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    """
+    connect: callable returning a new sqlite3 connection (the writer sets it to
+    manage its own transactions).
+    Submitted ops are called as fn(cursor, *args, **kwargs) and must not commit.
+    """
+
+    def __init__(self, connect, window_s=GROUP_WINDOW_S, max_ops=GROUP_MAX_OPS,
+                 busy_retries=BUSY_RETRIES, busy_backoff_s=BUSY_BACKOFF_S):
+        self._connect = connect
+        self.window_s = window_s
+        self.max_ops = max_ops
+        self.busy_retries = busy_retries
+        self.busy_backoff_s = busy_backoff_s
+        self._queue = queue.Queue()
+        self._thread = None
+        self.stats = {"ops": 0, "groups": 0, "busy_retries": 0, "failed_groups": 0}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ecowise-group-commit", daemon=True)
+            self._thread.start()
+        return self
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self, timeout=None):
+        """Finishes everything already queued, then stops the thread."""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, fn, *args, **kwargs):
+        """Queues fn(cursor, *args, **kwargs); returns a Future for its result."""
+        op = _Op(fn, args, kwargs)
+        self._queue.put(op)
+        return op.future
+
+    def call(self, fn, *args, **kwargs):
+        """submit() and wait for the result (re-raising the op's exception)."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    # --- writer thread ---
+
+    def _next_group(self):
+        first = self._queue.get()
+        if first is _STOP:
+            return None, True
+        group = [first]
+        deadline = time.monotonic() + self.window_s
+        while len(group) < self.max_ops:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                op = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if op is _STOP:
+                return group, True
+            group.append(op)
+        return group, False
+
+    def _run(self):
+        conn = self._connect()
+        conn.isolation_level = None  # explicit BEGIN/COMMIT below
+        try:
+            stopping = False
+            while not stopping:
+                group, stopping = self._next_group()
+                if group:
+                    group = [op for op in group if op.future.set_running_or_notify_cancel()]
+                    if group:
+                        self._commit_group(conn, group)
+        finally:
+            conn.close()
+
+    def _commit_group(self, conn, group):
+        cursor = conn.cursor()
+        for attempt in range(self.busy_retries + 1):
+            outcomes = []
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                for op in group:
+                    cursor.execute("SAVEPOINT op")
+                    try:
+                        result = op.fn(cursor, *op.args, **op.kwargs)
+                    except Exception as e:
+                        if is_busy_error(e):
+                            raise
+                        cursor.execute("ROLLBACK TO op")
+                        cursor.execute("RELEASE op")
+                        outcomes.append((op, None, e))
+                    else:
+                        cursor.execute("RELEASE op")
+                        outcomes.append((op, result, None))
+                cursor.execute("COMMIT")
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                if is_busy_error(e) and attempt < self.busy_retries:
+                    self.stats["busy_retries"] += 1
+                    time.sleep(self.busy_backoff_s * (2 ** attempt) * random.uniform(0.5, 1.5))
+                    continue
+                self.stats["failed_groups"] += 1
+                for op in group:
+                    op.future.set_exception(e)
+                return
+
+            self.stats["groups"] += 1
+            self.stats["ops"] += len(group)
+            for op, result, error in outcomes:
+                if error is None:
+                    op.future.set_result(result)
+                else:
+                    op.future.set_exception(error)
+            return
@@ -1,9 +1,16 @@
 # main.py
 
 import streamlit as st
-from database.db import create_tables
+from database.db import create_tables, start_group_commit
 create_tables()
 
+# Writes from every session share one writer thread and its group commits
+start_group_commit()
+
+# Background workers for queued pipeline jobs; also resumes any a previous run left unfinished
+from database.jobs import start_workers
+start_workers()
+
 # Import Views
 from views.token_management import run_token_management
 from views.farmers import run_farmers
@@ -11,13 +18,20 @@ from views.cocoa_delivery import run_cocoa_delivery
 from views.lender import run_lender_management
 from views.tips import run_tips
 from views.qr_codes import run_qr_codes
-# from views.dashboard import run_dashboard
+from views.diagnostics import run_diagnostics
+from views.profiler import render_profile_sidebar
+from views.dashboard import run_dashboard
 
 
 def main():
 	st.set_page_config(page_title="EcoWise Internal App", layout="wide")
 	st.title("EcoWise Internal Platform")
 
+	# Hidden page, not in the menu: open the app with ?page=diagnostics
+	if st.query_params.get("page") == "diagnostics":
+		run_diagnostics()
+		return
+
 	menu = [
 		"Home",
 		"Token Management",
@@ -53,6 +67,8 @@ def main():
 	elif choice == "Dashboard":
 		run_dashboard()
 
+	render_profile_sidebar()
+
 
 if __name__ == '__main__':
 	main()
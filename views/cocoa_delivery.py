@@ -7,32 +7,39 @@ from database.db import (
     get_farmer_list,
     create_sack_and_mint_token,
     get_unbagged_sacks,
+    preview_bag_packing,
     create_bag_with_sacks,
-    auto_fill_bags,
     get_all_bags,
     get_sacks_for_bag,
-    create_warrant_receipt,
     get_all_warrant_receipts,
     get_warrant_receipts_by_type,
     get_unbatched_bags,
     create_batch_with_bags,
-    auto_fill_batches,
+    plan_batches,
+    PRODUCT_TYPES,
     get_all_batches,
     get_sacks_for_batch,
     get_covered_ids_by_type,
-    create_invoice,
     get_all_invoices,
+    get_settlement_inputs,
+    simulate_invoice,
     get_sack_ownership,
     get_bags_for_sack,
     get_batches_for_sack,
     get_bundles_for_sack,
     get_all_sack_ids
 )
+from database.changes import latest_seq
+from database.export import EXPORT_FORMATS, stream_batch_provenance, spool_export
+from views.profiler import profile_page, profiled_tabs
+from views.exports import table_export
+from views.job_status import start_job, job_active, job_panel
 
+@profile_page
 def run_cocoa_delivery():
     st.title("Cocoa Delivery")
 
-    tab1, tab2, tab3, tab4 ,tab5, tab6, tab7 = st.tabs([
+    tab1, tab2, tab3, tab4 ,tab5, tab6, tab7 = profiled_tabs([
         "📥 Record Sack Delivery",
         "📦 Aggregate Sacks into Bags",
         "🧾 View Bags + Contributions",
@@ -92,15 +99,38 @@ def run_cocoa_delivery():
         st.write("Unbagged Sacks (cumulative weights help manage 63kg limit):")
         st.dataframe(df[["id", "farmer_name", "weight_kg", "value_paid", "warehouse", "delivered_at", "cumulative_weight"]], use_container_width=True)
 
-        if st.button("Auto-Fill and Aggregate All Eligible Sacks"):
-            bag_ids = auto_fill_bags()
-            if bag_ids:
-                st.success(f"✅ Created {len(bag_ids)} bag(s):")
-                for bid in bag_ids:
-                    st.write(bid)
-                st.rerun()
-            else:
-                st.info("No eligible sacks found for auto-fill.")
+        packing_labels = {
+            "greedy": "Greedy (delivery order)",
+            "best_fit": "Best fit (fewest split sacks)",
+        }
+        packing_mode = st.radio(
+            "Packing Mode", list(packing_labels), format_func=packing_labels.get,
+            horizontal=True, key="bag_packing_mode"
+        )
+        if not df.empty:
+            preview = preview_bag_packing()
+            st.dataframe(pd.DataFrame([
+                {
+                    "Mode": packing_labels[mode],
+                    "Bags": p["bags"],
+                    "Split Sacks": p["split_sacks"],
+                    "Bag-Sack Rows": p["bag_sack_rows"],
+                    "Avg Fill": f"{p['avg_fill']:.1%}",
+                    "Min Fill": f"{p['min_fill']:.1%}",
+                }
+                for mode, p in preview.items()
+            ]), use_container_width=True, hide_index=True)
+
+        if st.button("Auto-Fill and Aggregate All Eligible Sacks", disabled=job_active("bag_job")):
+            start_job("bag_job", "auto_fill_bags", {"mode": packing_mode})
+        job_panel(
+            "bag_job",
+            lambda r: (
+                f"✅ Created {len(r['bag_ids'])} bag(s): {r['stats']['split_sacks']} split sack(s), "
+                f"average fill {r['stats']['avg_fill']:.1%}."
+            ) if r.get("bag_ids")
+            else "No eligible sacks found for auto-fill."
+        )
 
 
 
@@ -195,6 +225,24 @@ def run_cocoa_delivery():
                 df_batches[["id", "product_type", "weight_mt", "batch_value", "created_at"]],
                 use_container_width=True
             )
+
+            st.markdown("**Export Batch Provenance**")
+            export_batches = st.multiselect(
+                "Select batches to export", df_batches["id"].tolist(),
+                key="provenance_export_batches"
+            )
+            export_fmt = st.selectbox(
+                "Format", list(EXPORT_FORMATS.keys()), key="provenance_export_fmt"
+            )
+            if export_batches:
+                _, mime, ext = EXPORT_FORMATS[export_fmt]
+                st.download_button(
+                    "Download Provenance",
+                    data=lambda: spool_export(stream_batch_provenance(export_batches, export_fmt)),
+                    file_name=f"batch_provenance.{ext}",
+                    mime=mime,
+                    key="provenance_export_btn"
+                )
         st.markdown("---")
         st.markdown("**Unallocated Bags**")
         # Your manual & auto—batching controls below:
@@ -203,7 +251,9 @@ def run_cocoa_delivery():
             st.info("No unbatched bags available.")
         else:
             df["weight_mt"] = (df["weight_kg"]/1000).round(2)
-            st.dataframe(df[["id","weight_mt","created_at"]], use_container_width=True)
+            st.dataframe(df[["id","weight_mt","warehouse","created_at"]], use_container_width=True)
+
+            product_type = st.selectbox("Product Type", PRODUCT_TYPES, index=PRODUCT_TYPES.index("liquor"), key="batch_product_type")
 
             # Manual
             chosen = st.multiselect(
@@ -216,22 +266,46 @@ def run_cocoa_delivery():
                 if tot_kg > 60000:
                     st.error("Exceeds 60 MT.")
                 elif st.button("Create Batch", key="batch_manual_btn3"):
-                    batch_id = create_batch_with_bags(chosen, product_type="liquor")
+                    batch_id = create_batch_with_bags(chosen, product_type=product_type)
                     st.success(f"Created batch `{batch_id}`")
                     st.rerun()
 
             st.markdown("---")
 
             # Auto‐fill
-            if st.button("Auto-Fill into Batches", key="batch_auto_btn2"):
-                new_bs = auto_fill_batches()
-                if new_bs:
-                    st.success(f"Created {len(new_bs)} batch(es):")
-                    for b in new_bs:
-                        st.write(f"• {b}")
-                    st.rerun()
-                else:
-                    st.info("No eligible bags to batch.")
+            c1, c2 = st.columns(2)
+            by_warehouse = c1.checkbox("Keep warehouses separate", key="batch_by_warehouse")
+            min_fill_pct = c2.slider(
+                "Leave batches under this fill unbatched (%)", min_value=0, max_value=100, value=0,
+                key="batch_min_fill"
+            )
+            group_by = "warehouse" if by_warehouse else None
+            proposed = plan_batches(group_by, min_fill_pct / 100.0)
+            if proposed:
+                st.markdown(f"**Proposed Batches** ({len(proposed)})")
+                st.dataframe(pd.DataFrame([
+                    {
+                        "Warehouse": b["group"] if group_by else "Any",
+                        "Bags": len(b["bag_ids"]),
+                        "Weight (MT)": round(b["weight_kg"] / 1000, 3),
+                        "Fill": f"{b['fill']:.2%}",
+                    }
+                    for b in proposed
+                ]), use_container_width=True, hide_index=True)
+            else:
+                st.info("No batch reaches the minimum fill yet.")
+
+            if st.button("Auto-Fill into Batches", key="batch_auto_btn2", disabled=job_active("batch_job") or not proposed):
+                start_job("batch_job", "auto_fill_batches", {
+                    "product_type": product_type,
+                    "group_by": group_by,
+                    "min_fill": min_fill_pct / 100.0,
+                })
+        job_panel(
+            "batch_job",
+            lambda r: f"Created {len(r['batch_ids'])} batch(es): " + ", ".join(r["batch_ids"])
+            if r.get("batch_ids") else "No eligible bags to batch."
+        )
 
     # --- Tab 5: CMA Warrant Receipts (bags or batches) ---
     with tab5:
@@ -258,14 +332,12 @@ def run_cocoa_delivery():
             st.info(f"No eligible items for {wr_type}.")
         else:
             sel = st.multiselect(label, eligible, key="wr_sel")
-            if st.button("Issue Receipt", key="wr_issue_btn"):
+            if st.button("Issue Receipt", key="wr_issue_btn", disabled=job_active("wr_job")):
                 if not sel:
                     st.error("Pick at least one.")
                 else:
-                    rid = create_warrant_receipt(wr_type, sel)
-                    st.success(f"Issued `{rid}` covering {len(sel)} item(s).")
-                    # ADD st.rerun() AFTER THE ACTION
-                    st.rerun()
+                    start_job("wr_job", "create_warrant_receipt", {"receipt_type": wr_type, "covered_ids": sel})
+        job_panel("wr_job", lambda r: f"Issued `{r['receipt_id']}`.")
 
         st.markdown("---")
         dfwr = get_all_warrant_receipts()
@@ -288,56 +360,70 @@ def run_cocoa_delivery():
                     key="invoice_batches"
                 )
 
-                # --- ADDED CODE STARTS HERE ---
-                total_selected_value = 0.0
-                if selected_batches:
-                    # Filter df_batches to only include selected ones and sum their total_value
-                    filtered_batches_df = df_batches[df_batches['id'].isin(selected_batches)]
-                    # --- ADDED CODE: SAFELY ACCESS 'total_value' ---
-                    if 'total_value' in filtered_batches_df.columns:
-                        total_selected_value = filtered_batches_df['total_value'].sum()
-                    else:
-                        st.warning(
-                            "Warning: 'total_value' column not found for selected batches. Running sum might be inaccurate.")
-                        # This warning indicates an underlying data preparation issue.
-                        # You might want to inspect your batch creation or sack value allocation if this warning appears frequently.
-                # --- END ADDED CODE ---
+                # Inputs for the settlement engine, kept while the selection and
+                # the data are unchanged so editing the amounts only re-runs the
+                # arithmetic. Any funding, invoice or bagging change (from any
+                # session) advances the change feed and reloads them.
+                cache_key = (tuple(selected_batches), latest_seq())
+                cached = st.session_state.get("invoice_inputs")
+                if cached is None or cached[0] != cache_key:
+                    cached = (cache_key, get_settlement_inputs(selected_batches))
+                    st.session_state["invoice_inputs"] = cached
+                settlement_inputs = cached[1]
+                total_selected_value = sum(sum(b["farmer_values"].values()) for b in settlement_inputs)
 
                 st.markdown(f"**Total Value of Selected Batches:** ₦{total_selected_value:,.2f}")
-                # --- ADDED CODE ENDS HERE ---
 
                 amt_paid = st.number_input(
                     "Total Amount Paid", min_value=0.0, step=100.0, key="invoice_amt"
                 )
-                pct_to_farmers = st.number_input(
+                pct_to_farmers = st.slider(
                     "Percent of Remainder to Farmers",
                     min_value=0, max_value=100, step=1,
                     key="invoice_pct"
                 )
 
-                if st.button("Create Invoice", key="invoice_create_btn"):
+                if selected_batches and amt_paid > 0:
+                    preview = simulate_invoice(selected_batches, amt_paid, pct_to_farmers, inputs=settlement_inputs)
+                    by_role = preview.groupby("role")["received"].sum()
+                    c1, c2, c3, c4 = st.columns(4)
+                    c1.metric("Lender Repayments", f"₦{by_role.get('lender', 0.0):,.2f}")
+                    c2.metric("Farmer Bonuses", f"₦{by_role.get('farmer', 0.0):,.2f}")
+                    c3.metric("To EcoWise", f"₦{by_role.get('ecowise', 0.0):,.2f}")
+                    c4.metric("Unallocated", f"₦{max(0.0, amt_paid - total_selected_value):,.2f}")
+                    st.caption(f"Debt burned: ₦{preview['debt_burned'].sum():,.2f}. Preview only; nothing is written until the invoice is created.")
+                    st.dataframe(preview, use_container_width=True, hide_index=True)
+
+                if st.button("Create Invoice", key="invoice_create_btn", disabled=job_active("invoice_job")):
                     if not selected_batches:
                         st.error("Pick at least one batch.")
                     elif amt_paid <= 0:
                         st.error("Amount must be positive.")
                     else:
-                        inv_id = create_invoice(selected_batches, amt_paid, pct_to_farmers)
-                        st.success(f"Invoice `{inv_id}` created for {len(selected_batches)} batch(es).")
+                        start_job("invoice_job", "create_invoice", {
+                            "batch_ids": selected_batches,
+                            "amount_paid": amt_paid,
+                            "percent_to_farmers": pct_to_farmers
+                        })
+                job_panel("invoice_job", lambda r: f"Invoice `{r['invoice_id']}` created.")
 
         with subtab2:
-            df_inv = get_all_invoices()
+            include_archive = st.checkbox("Include archived seasons", key="invoices_include_archive")
+            df_inv = get_all_invoices(include_archive)
             if df_inv.empty:
                 st.info("No invoices issued yet.")
             else:
                 df_inv["covered_batches"] = df_inv["covered_batches"].apply(lambda j: ", ".join(json.loads(j)))
                 df_inv["percent_to_farmers"] = (df_inv["percent_to_farmers"] * 100).round(2).astype(str) + "%"
                 st.dataframe(df_inv, use_container_width=True)
+                table_export("invoices")
     with tab7:
         st.subheader("Track a Sack Through the Process")
 
         sack_ids = get_all_sack_ids()
         chosen = st.selectbox("Select Sack ID", sack_ids, key="track_sack_select")
         manual = st.text_input("or paste Sack ID here", key="track_sack_input")
+        include_archive = st.checkbox("Include archived seasons", key="track_sack_archive")
 
         if st.button("Search", key="track_sack_btn"):
             raw_manual = manual.strip()
@@ -379,7 +465,7 @@ def run_cocoa_delivery():
                     st.dataframe(df_batches, use_container_width=True)
 
                 # 4) Bundles
-                df_bundles = get_bundles_for_sack(sack_id)
+                df_bundles = get_bundles_for_sack(sack_id, include_archive)
                 if df_bundles.empty:
                     st.info("This sack has not been included in any financing bundle.")
                 else:
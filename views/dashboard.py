@@ -0,0 +1,90 @@
+# views/dashboard.py
+
+import streamlit as st
+import pandas as pd
+from datetime import date, timedelta
+from database.db import (
+    get_kpis,
+    get_daily_intake_by_warehouse,
+    get_farmer_delivery_trend,
+    get_farmer_list
+)
+from views.profiler import profile_page
+
+@profile_page
+def run_dashboard():
+    st.title("Dashboard")
+
+    kpis = get_kpis()
+
+    st.subheader("Deliveries")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Registered Farmers", f"{kpis['farmers']:,.0f}")
+    col2.metric("Sacks Delivered", f"{kpis['sacks_delivered']:,.0f}")
+    col3.metric("Delivered Tonnage", f"{kpis['delivered_kg'] / 1000:,.2f} MT")
+    col4.metric("Value Paid to Farmers", f"₦{kpis['delivered_value']:,.2f}")
+
+    st.subheader("Tokens")
+    col1, col2 = st.columns(2)
+    col1.metric("Outstanding Debt Tokens", f"{kpis['debt_outstanding']:,.2f}")
+    col2.metric("Outstanding Internal Tokens", f"{kpis['internal_outstanding']:,.2f}")
+
+    st.subheader("Bundles & Lenders")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Unfunded Bundles", f"{kpis['bundles_unfunded']:,.0f}")
+    col2.metric("Partially Funded", f"{kpis['bundles_partially_funded']:,.0f}")
+    col3.metric("Funded Bundles", f"{kpis['bundles_funded']:,.0f}")
+    col4.metric("Paid Bundles", f"{kpis['bundles_paid']:,.0f}")
+
+    df_status = pd.DataFrame({
+        "status": ["unfunded", "partially funded", "funded", "paid"],
+        "bundles": [
+            kpis["bundles_unfunded"], kpis["bundles_partially_funded"],
+            kpis["bundles_funded"], kpis["bundles_paid"]
+        ]
+    })
+    st.bar_chart(df_status, x="status", y="bundles")
+
+    col1, col2 = st.columns(2)
+    col1.metric("Lender Exposure (unpaid bundles)", f"₦{kpis['lender_exposure']:,.2f}")
+    col2.metric("Lender Capital Available", f"₦{kpis['lender_available']:,.2f}")
+
+    st.subheader("Invoices")
+    col1, col2 = st.columns(2)
+    col1.metric("Invoices Settled", f"{kpis['invoices_settled']:,.0f}")
+    col2.metric("Total Invoiced", f"₦{kpis['invoiced_amount']:,.2f}")
+
+    st.markdown("---")
+    st.subheader("Delivery Trends")
+
+    date_range = st.date_input(
+        "Delivery date range",
+        value=(date.today() - timedelta(days=365), date.today()),
+        key="dashboard_date_range"
+    )
+    if not isinstance(date_range, (tuple, list)) or len(date_range) != 2:
+        st.info("Pick a start and end date.")
+        return
+    start_date, end_date = date_range
+
+    df_intake = get_daily_intake_by_warehouse(start_date.isoformat(), end_date.isoformat())
+    if df_intake.empty:
+        st.info("No deliveries in this range.")
+    else:
+        st.markdown("**Daily Intake by Warehouse (kg)**")
+        df_chart = df_intake.pivot(index="date", columns="warehouse", values="weight_kg").fillna(0)
+        st.line_chart(df_chart)
+
+    farmers = get_farmer_list()
+    if farmers:
+        farmer_options = {label: fid for fid, label in farmers}
+        selected_label = st.selectbox(
+            "Farmer delivery trend", list(farmer_options.keys()), key="dashboard_farmer_trend"
+        )
+        df_trend = get_farmer_delivery_trend(
+            farmer_options[selected_label], start_date.isoformat(), end_date.isoformat()
+        )
+        if df_trend.empty:
+            st.info("This farmer has no deliveries in this range.")
+        else:
+            st.line_chart(df_trend.set_index("date")[["weight_kg"]])
@@ -0,0 +1,81 @@
+# views/diagnostics.py
+#
+# Hidden page, reached with ?page=diagnostics. Not listed in the sidebar menu.
+
+import streamlit as st
+import pandas as pd
+from database import instrumentation
+from database.db import get_group_commit_stats
+
+
+def run_diagnostics():
+    st.title("Diagnostics")
+
+    enabled = st.toggle(
+        "Record database statistics",
+        value=instrumentation.is_enabled(),
+        key="diag_enabled",
+        help="Applies to every session on this server process."
+    )
+    if enabled and not instrumentation.is_enabled():
+        instrumentation.enable()
+    elif not enabled and instrumentation.is_enabled():
+        instrumentation.disable()
+
+    slow_ms = st.number_input(
+        "Slow query threshold (ms)",
+        min_value=0.0,
+        step=10.0,
+        value=float(instrumentation.get_slow_threshold_ms()),
+        key="diag_slow_ms"
+    )
+    if slow_ms != instrumentation.get_slow_threshold_ms():
+        instrumentation.set_slow_threshold_ms(slow_ms)
+
+    if st.button("Reset Statistics", key="diag_reset_btn"):
+        instrumentation.reset()
+        st.rerun()
+
+    summary = instrumentation.get_summary()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Connections Opened", summary["connection_opens"])
+    col2.metric("Statements Executed", summary["statements"])
+    col3.metric("Rows Returned", summary["rows"])
+
+    gc_stats = get_group_commit_stats()
+    if gc_stats is not None:
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Group Commits", gc_stats["groups"])
+        col2.metric("Writes Committed", gc_stats["ops"])
+        col3.metric("Busy Retries", gc_stats["busy_retries"])
+        col4.metric("Failed Groups", gc_stats["failed_groups"])
+
+    tab1, tab2, tab3 = st.tabs(["Functions", "Statements", "Slow Query Log"])
+
+    with tab1:
+        df = instrumentation.get_function_stats()
+        if df.empty:
+            st.info("No database calls recorded yet.")
+        else:
+            st.dataframe(df, use_container_width=True)
+
+    with tab2:
+        df = instrumentation.get_statement_stats()
+        if df.empty:
+            st.info("No statements recorded yet.")
+        else:
+            st.dataframe(df, use_container_width=True)
+
+    with tab3:
+        entries = instrumentation.read_slow_log()
+        if not entries:
+            st.info(f"No statements slower than {summary['slow_ms']:.0f} ms logged yet.")
+        else:
+            st.caption(instrumentation.SLOW_QUERY_LOG)
+            df = pd.DataFrame(entries)[["ts", "function", "elapsed_ms", "rows", "sql"]]
+            st.dataframe(df, use_container_width=True)
+            for entry in entries[:20]:
+                with st.expander(f"{entry['elapsed_ms']:.1f} ms — {entry['function']}"):
+                    st.code(entry["sql"], language="sql")
+                    if entry.get("plan"):
+                        st.code("\n".join(entry["plan"]))
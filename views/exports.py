@@ -0,0 +1,27 @@
+# views/exports.py
+#
+# Download buttons for the full-table exports in database/export.py. Nothing is
+# read until the button is clicked: download_button takes a callable, which
+# streams the table in chunks from one read snapshot into a spooled temp file,
+# so neither rendering the page nor the download loads the table in memory.
+
+import streamlit as st
+
+from database.export import EXPORT_FORMATS, stream_table, spool_export
+
+
+def table_export(table, label=None):
+    """Format picker and download button for one of export.TABLE_EXPORTS."""
+    col_fmt, col_btn = st.columns([1, 3])
+    fmt = col_fmt.selectbox(
+        "Export format", list(EXPORT_FORMATS.keys()),
+        key=f"{table}_export_fmt", label_visibility="collapsed"
+    )
+    _, mime, ext = EXPORT_FORMATS[fmt]
+    col_btn.download_button(
+        label or f"Download all {table}",
+        data=lambda: spool_export(stream_table(table, fmt)),
+        file_name=f"{table}.{ext}",
+        mime=mime,
+        key=f"{table}_export_btn"
+    )
@@ -8,11 +8,14 @@ from database.db import (
     create_sack_and_mint_token,
     get_sacks_by_farmer
 )
+from views.profiler import profile_page, profiled_tabs
+from views.exports import table_export
 
+@profile_page
 def run_farmers():
     st.title("Farmer Management")
 
-    tab1, tab2, tab3, tab4 = st.tabs([
+    tab1, tab2, tab3, tab4 = profiled_tabs([
         "➕ Register Farmer",
         "📋 View Farmers",
         "🧺 Deliver Cocoa Sack",
@@ -58,6 +61,7 @@ def run_farmers():
             else:
                 st.write(f"Total Farmers: {len(df)}")
                 st.dataframe(df, use_container_width=True)
+            table_export("farmers")
 
     # Tab 3: Deliver Cocoa Sack
     with tab3:
@@ -113,3 +117,4 @@ def run_farmers():
             else:
                 st.write(f"Total Sacks Delivered: {len(df_sacks)}")
                 st.dataframe(df_sacks, use_container_width=True)
+            table_export("sacks", "Download all sacks (every farmer)")
@@ -0,0 +1,62 @@
+# views/job_status.py
+#
+# Shows the progress of a background job (database/jobs.py) started from a page.
+# The job id lives in st.session_state under a key chosen by the page; while the
+# job is active only a small fragment re-runs to poll it, and the whole page
+# re-runs once it finishes so tables pick up the new rows.
+
+import streamlit as st
+
+from database.jobs import ACTIVE_STATUSES, enqueue_job, get_job
+
+JOB_POLL_SECONDS = 2
+
+
+def start_job(state_key, kind, params=None):
+    """Enqueues a job and remembers it under state_key for job_panel()."""
+    st.session_state[state_key] = enqueue_job(kind, params)
+
+
+def job_active(state_key):
+    job_id = st.session_state.get(state_key)
+    if not job_id:
+        return False
+    job = get_job(job_id)
+    return job is not None and job["status"] in ACTIVE_STATUSES
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def _poll(state_key):
+    job = get_job(st.session_state[state_key])
+    if job is None or job["status"] not in ACTIVE_STATUSES:
+        st.rerun()
+    label = "Waiting for a worker…" if job["status"] == "queued" else (job["message"] or "Running…")
+    st.progress(job["progress"], text=label)
+
+
+def job_panel(state_key, describe_result):
+    """
+    Renders the job stored under state_key: a live progress bar while it runs,
+    then describe_result(result) on success or the error on failure.
+    """
+    job_id = st.session_state.get(state_key)
+    if not job_id:
+        return
+    job = get_job(job_id)
+    if job is None:
+        st.session_state.pop(state_key, None)
+        return
+
+    if job["status"] in ACTIVE_STATUSES:
+        _poll(state_key)
+        return
+
+    if job["status"] == "succeeded":
+        st.success(describe_result(job["result"] or {}))
+    else:
+        st.error(f"Job `{job_id}` failed.")
+        with st.expander("Error details"):
+            st.code(job["error"] or "")
+    if st.button("Dismiss", key=f"{state_key}_dismiss"):
+        st.session_state.pop(state_key, None)
+        st.rerun()
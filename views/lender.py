@@ -9,15 +9,23 @@ from database.db import (
     get_unfunded_bundles,
     get_eligible_sacks_for_bundling,
     create_bundle,
+    plan_target_bundles,
+    create_bundles,
     fund_bundle,
+    plan_bundle_funding,
+    fund_bundles,
     get_all_bundles_with_details,
     update_lender_position
 )
+from database.allocation import FUNDING_RULES
+from views.profiler import profile_page, profiled_tabs
+from views.exports import table_export
 
+@profile_page
 def run_lender_management():
     st.title("Lender & Bundle Management")
 
-    tab1, tab2, tab3, tab4, tab5 = st.tabs([
+    tab1, tab2, tab3, tab4, tab5 = profiled_tabs([
         "Register Lender",
         "View Lenders",
         "Create Bundle",
@@ -48,6 +56,7 @@ def run_lender_management():
         else:
             df_display = df_lenders.rename(columns={"wallet_address": "Wallet Address", "position": "Current Position"})
             st.dataframe(df_display[["id", "Wallet Address", "Current Position"]], use_container_width=True)
+            table_export("lenders")
 
             st.markdown("---")
             st.subheader("Update Lender Position")
@@ -79,7 +88,7 @@ def run_lender_management():
 
                     if update_button:
                         try:
-                            update_lender_position(selected_lender_id, new_position)
+                            update_lender_position(selected_lender_id, new_position, expected_position=current_pos)
                             st.success(f"Lender '{selected_lender_id}' position updated to ₦{new_position:,.2f}.")
                             st.rerun() # Rerun to refresh the table
                         except Exception as e:
@@ -201,6 +210,56 @@ def run_lender_management():
         elif load_eligible_sacks_button and st.session_state.df_eligible_sacks.empty:
             st.info("No eligible sacks found for bundling with the selected criteria.")
 
+        # --- Auto-build bundles to a target value (same filter and interest rate) ---
+        st.markdown("---")
+        st.subheader("Auto-build Bundles to a Target Value")
+        if 'target_bundle_plans' not in st.session_state:
+            st.session_state.target_bundle_plans = []
+
+        col_target, col_tol, col_count = st.columns(3)
+        target_value = col_target.number_input("Target Value (₦)", min_value=0.0, step=100000.0, key="target_bundle_value")
+        tolerance_pct = col_tol.number_input("Tolerance (%)", min_value=0.0, max_value=50.0, value=2.0, step=0.5, key="target_bundle_tolerance")
+        bundle_count = col_count.number_input("Bundles", min_value=1, value=1, step=1, key="target_bundle_count")
+
+        if st.button("Plan Bundles", key="plan_target_bundles_btn"):
+            if target_value <= 0:
+                st.warning("Enter a target value above zero.")
+            else:
+                filter_type = st.session_state.bundle_filter_type_val
+                st.session_state.target_bundle_plans = plan_target_bundles(
+                    target_value,
+                    tolerance=tolerance_pct / 100,
+                    count=int(bundle_count),
+                    filter_type=None if filter_type == "None" else filter_type,
+                    filter_value=st.session_state.bundle_filter_value_val or None,
+                )
+                if not st.session_state.target_bundle_plans:
+                    st.info("The eligible sacks cannot make a bundle within the tolerance of that target.")
+
+        plans = st.session_state.target_bundle_plans
+        if plans:
+            if len(plans) < bundle_count:
+                st.info(f"Only {len(plans)} bundle(s) fit within the tolerance with the eligible sacks.")
+            st.dataframe(pd.DataFrame([
+                {"Bundle": i, "Sacks": p["sacks"], "Value (₦)": round(p["value"], 2),
+                 "Off Target (₦)": round(p["value"] - target_value, 2)}
+                for i, p in enumerate(plans, 1)
+            ]), use_container_width=True, hide_index=True)
+
+            if st.button(f"Create {len(plans)} Bundle(s)", key="create_target_bundles_btn"):
+                filter_type = st.session_state.bundle_filter_type_val
+                try:
+                    new_ids = create_bundles(
+                        filter_type,
+                        st.session_state.bundle_filter_value_val,
+                        st.session_state.bundle_interest_rate_val,
+                        [p["sack_ids"] for p in plans],
+                    )
+                    st.session_state.target_bundle_plans = []
+                    st.success(f"Created {len(new_ids)} bundle(s): {', '.join(new_ids)}")
+                except Exception as e:
+                    st.error(f"Error creating bundles: {e}")
+
     # --- Tab 4: Fund Bundle with Position Check ---
     with tab4:
         st.subheader("Fund an Unfunded Bundle")
@@ -285,6 +344,49 @@ def run_lender_management():
                     else:
                         st.warning("Please select a lender and enter a valid amount to fund.")
 
+        # --- Bulk funding: every lender's position across every open bundle ---
+        st.markdown("---")
+        st.subheader("Bulk Fund Bundles")
+        if 'funding_plan' not in st.session_state:
+            st.session_state.funding_plan = []
+
+        funding_rule = st.radio(
+            "Allocation Rule",
+            list(FUNDING_RULES),
+            format_func=FUNDING_RULES.get,
+            key="funding_rule",
+            horizontal=True,
+        )
+        if st.button("Plan Funding", key="plan_funding_btn"):
+            st.session_state.funding_plan = plan_bundle_funding(funding_rule)
+            if not st.session_state.funding_plan:
+                st.info("Nothing to allocate: no lender has an available position or no bundle needs funding.")
+
+        plan = st.session_state.funding_plan
+        if plan:
+            df_plan = pd.DataFrame(plan, columns=["lender_id", "bundle_id", "amount"])
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Total to Fund", f"₦{df_plan['amount'].sum():,.2f}")
+            col2.metric("Bundles", df_plan["bundle_id"].nunique())
+            col3.metric("Lenders", df_plan["lender_id"].nunique())
+            st.dataframe(
+                df_plan.groupby("bundle_id", as_index=False).agg(lenders=("lender_id", "nunique"), amount=("amount", "sum")),
+                use_container_width=True, hide_index=True
+            )
+            with st.expander(f"All {len(df_plan)} fundings"):
+                st.dataframe(df_plan, use_container_width=True, hide_index=True)
+
+            if st.button("Apply Funding Plan", key="apply_funding_btn"):
+                try:
+                    summary = fund_bundles(plan)
+                    st.session_state.funding_plan = []
+                    st.success(
+                        f"Funded {summary['bundles']} bundle(s) with ₦{summary['amount']:,.2f} "
+                        f"from {summary['lenders']} lender(s)."
+                    )
+                except ValueError as ve:
+                    st.error(f"Funding Error: {ve}")
+
     with tab5:
         st.subheader("All Bundles and Their Status")
 
@@ -298,6 +400,7 @@ def run_lender_management():
                 'bundle_id', 'status', 'calculated_status', 'filter_type', 'filter_value',
                 'interest_rate', 'total_bundle_value', 'funded_amount', 'created_at'
             ]], use_container_width=True)
+            table_export("bundles")
 
             st.markdown("---")
             st.subheader("Bundle Status Summary")
@@ -0,0 +1,176 @@
+# views/profiler.py
+#
+# Opt-in render profiler for the Streamlit pages. Each run_* entry point and
+# each tab is timed, together with the queries it ran, rows it fetched and the
+# bytes Streamlit sent to the browser for it. Results show in a sidebar panel
+# and are appended to a rolling log. Enable with ECOWISE_PROFILE_PAGES=1 or by
+# opening the app with ?profile=1.
+
+import os
+import json
+import time
+import logging
+import functools
+from logging.handlers import RotatingFileHandler
+from datetime import datetime, timezone
+
+import streamlit as st
+import pandas as pd
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from database import instrumentation
+
+PAGE_PROFILE_LOG = os.environ.get(
+    "ECOWISE_PAGE_PROFILE_LOG",
+    os.path.join(os.path.dirname(__file__), "..", "page_profile.log")
+)
+
+_logger = logging.getLogger("ecowise.page_profile")
+_logger.propagate = False
+
+
+def _log():
+    if not _logger.handlers:
+        handler = RotatingFileHandler(PAGE_PROFILE_LOG, maxBytes=5 * 1024 * 1024, backupCount=3)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _logger.addHandler(handler)
+        _logger.setLevel(logging.INFO)
+    return _logger
+
+
+def is_enabled():
+    if os.environ.get("ECOWISE_PROFILE_PAGES", "") not in ("", "0"):
+        return True
+    try:
+        return st.query_params.get("profile") == "1"
+    except Exception:
+        return False
+
+
+def _bytes_counter():
+    """
+    Wraps this session's outgoing message queue once so every ForwardMsg's
+    serialised size is counted. Returns a one-item list holding the running total.
+    """
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return [0]
+    counter = getattr(ctx, "_profiler_bytes", None)
+    if counter is None:
+        counter = [0]
+        enqueue = ctx._enqueue
+
+        def counting_enqueue(msg):
+            counter[0] += msg.ByteSize()
+            enqueue(msg)
+
+        ctx._enqueue = counting_enqueue
+        ctx._profiler_bytes = counter
+    return counter
+
+
+def _snapshot():
+    c = instrumentation.thread_counters()
+    c["bytes"] = _bytes_counter()[0]
+    c["t"] = time.perf_counter()
+    return c
+
+
+def _records():
+    if "_page_profile" not in st.session_state:
+        st.session_state["_page_profile"] = []
+    return st.session_state["_page_profile"]
+
+
+def _record(page, section, start, error=None):
+    end = _snapshot()
+    wall_ms = (end["t"] - start["t"]) * 1000
+    db_ms = (end["db_s"] - start["db_s"]) * 1000
+    rec = {
+        "page": page,
+        "section": section,
+        "wall_ms": round(wall_ms, 2),
+        "db_ms": round(db_ms, 2),
+        "python_ms": round(wall_ms - db_ms, 2),
+        "queries": end["statements"] - start["statements"],
+        "rows": end["rows"] - start["rows"],
+        "connections": end["connections"] - start["connections"],
+        "bytes_sent": end["bytes"] - start["bytes"],
+    }
+    if error:
+        rec["error"] = error
+    _records().append(rec)
+    _log().info(json.dumps(dict(rec, ts=datetime.now(timezone.utc).isoformat())))
+
+
+def profile_page(fn):
+    """Decorator for run_* page entry points."""
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not is_enabled():
+            return fn(*args, **kwargs)
+        instrumentation.enable()
+        st.session_state["_page_profile"] = []
+        st.session_state["_page_profile_page"] = fn.__name__
+        start = _snapshot()
+        error = None
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            _record(fn.__name__, "(page total)", start, error)
+
+    return wrapper
+
+
+class _ProfiledTab:
+    """Context manager that enters a Streamlit tab and profiles everything rendered inside it."""
+
+    def __init__(self, tab, label):
+        self._tab = tab
+        self._label = label
+        self._start = None
+
+    def __enter__(self):
+        self._start = _snapshot()
+        return self._tab.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        result = self._tab.__exit__(exc_type, exc, tb)
+        page = st.session_state.get("_page_profile_page", "")
+        _record(page, self._label, self._start, exc_type.__name__ if exc_type else None)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._tab, name)
+
+
+def profiled_tabs(labels, **kwargs):
+    """Drop-in replacement for st.tabs whose tabs profile their contents when profiling is on."""
+    tabs = st.tabs(labels, **kwargs)
+    if not is_enabled():
+        return tabs
+    return [_ProfiledTab(tab, label) for tab, label in zip(tabs, labels)]
+
+
+def render_profile_sidebar():
+    """Shows the breakdown for the page that just rendered."""
+    if not is_enabled():
+        return
+    records = st.session_state.get("_page_profile", [])
+    with st.sidebar.expander("⏱️ Page Profile", expanded=True):
+        if not records:
+            st.caption("Nothing profiled on this page yet.")
+            return
+        df = pd.DataFrame(records)
+        # Page total first, tabs after in render order
+        df = pd.concat([df[df["section"] == "(page total)"], df[df["section"] != "(page total)"]])
+        st.dataframe(
+            df[["section", "wall_ms", "db_ms", "python_ms", "queries", "rows", "bytes_sent"]],
+            hide_index=True,
+            use_container_width=True
+        )
+        st.caption(f"Rolling log: {os.path.abspath(PAGE_PROFILE_LOG)}")
@@ -14,10 +14,13 @@ from database.db import (
     get_batch_contributors,
 )
 from database.db import get_all_sack_ids, get_all_bag_ids, get_all_batch_ids, get_all_farmer_ids
+from database.export import stream_batch_provenance, spool_export
+from views.profiler import profile_page
 
 CODES_DIR = os.path.join(os.path.dirname(__file__), "..", "qr_codes")
 os.makedirs(CODES_DIR, exist_ok=True)
 
+@profile_page
 def run_qr_codes():
     st.title("QR Code Generator & Scanner")
 
@@ -97,6 +100,12 @@ def run_qr_codes():
         elif entity == "batch":
             st.write("**Farmers & Warehouses:**")
             st.table(get_batch_contributors(eid))
+            st.download_button(
+                "Download Full Provenance (CSV)",
+                data=lambda: spool_export(stream_batch_provenance([eid], "csv")),
+                file_name=f"{eid}_provenance.csv",
+                mime="text/csv"
+            )
         else:
             st.error("Unknown entity type.")
         st.markdown("---")
@@ -1,11 +1,14 @@
 import streamlit as st
 import pandas as pd
 from database.db import get_farmer_list, create_tip, get_all_tips
+from views.profiler import profile_page, profiled_tabs
+from views.exports import table_export
 
+@profile_page
 def run_tips():
     st.title("Tips")
 
-    tab1, tab2 = st.tabs(["➕ Give Tip", "📋 History"])
+    tab1, tab2 = profiled_tabs(["➕ Give Tip", "📋 History"])
 
     # --- Tab 1: Give Tip ---
     with tab1:
@@ -33,3 +36,4 @@ def run_tips():
             st.info("No tips have been given yet.")
         else:
             st.dataframe(df, use_container_width=True)
+            table_export("tips")
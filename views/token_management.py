@@ -8,11 +8,14 @@ from database.db import (
     burn_debt_tokens,
     burn_internal_tokens
 )
+from views.profiler import profile_page, profiled_tabs
+from views.exports import table_export
 
+@profile_page
 def run_token_management():
     st.title("Token Management")
 
-    tab1, tab2, tab3, tab4, tab5 = st.tabs([
+    tab1, tab2, tab3, tab4, tab5 = profiled_tabs([
         "View Balances",
         "Mint Internal",
         "Burn Debt",
@@ -82,8 +85,10 @@ def run_token_management():
     # Tab 5: History (unchanged)
     with tab5:
         st.subheader("All Token Transactions")
-        df = get_all_tokens()
+        include_archive = st.checkbox("Include archived seasons", key="tokens_include_archive")
+        df = get_all_tokens(include_archive)
         if df.empty:
             st.info("No token transactions yet.")
         else:
-            st.dataframe(df, use_container_width=True)
\ No newline at end of file
+            st.dataframe(df, use_container_width=True)
+            table_export("tokens")
\ No newline at end of file